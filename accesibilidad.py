@@ -0,0 +1,143 @@
+# accesibilidad.py  ·  servicio más cercano y servicios cercanos por barrio
+#
+# Para cada barrio de vulnerabilidad-por-barrios.csv (su centroide,
+# geo_point_2d) y cada capa de servicios se calcula la distancia al centro más
+# cercano y cuántos centros hay a menos de cada radio de RADIOS_M. Es un
+# cálculo todos-contra-todos vectorizado (distancias planas UTM de plano.py
+# por bloques), con una capa por proceso. La tabla resultante se guarda en ./data/cache como Parquet
+# con clave el hash de todos los CSV y los radios, así que la app solo la lee.
+#
+# Uso por lotes:  python accesibilidad.py [--radios 500 1000 2000] [--procesos N]
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from indice_espacial import MAX_PARES
+from plano import a_utm, coordenadas_utm, distancia_plana
+
+ARCHIVO_BARRIOS = "vulnerabilidad-por-barrios.csv"
+CAPAS_SERVICIOS = {
+    "hospitales": "hospitales.csv",
+    "dona": "dona.csv",
+    "majors": "majors.csv",
+    "migrants": "migrants.csv",
+    "discapacitat-fisica": "discapacitat-fisica.csv",
+    "discapacitat-sensorial": "discapacitat-sensorial.csv",
+    "discapacitat-intellectual": "discapacitat-intellectual.csv",
+    "malaltia-mental": "malaltia-mental.csv",
+}
+RADIOS_M = (500, 1000, 2000)
+# Subir si cambian las columnas de la tabla o cómo se calculan
+VERSION_TABLA = 2
+
+# (radios, carpeta) -> (firma, DataFrame)
+_tablas = CacheVersiones()
+
+
+def nombre_centro(df: pd.DataFrame) -> pd.Series:
+    """Nombre de cada centro: "Nombre" o, en las capas que no la tienen, "equipamien"."""
+    columna = "Nombre" if "Nombre" in df.columns else "equipamien"
+    return df[columna].astype(str)
+
+
+def accesibilidad_capa(capa: str, radios=RADIOS_M, carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """Filas (barrio, capa) con distancia al más cercano y conteos por radio."""
+    barrios = cargar_csv(ARCHIVO_BARRIOS, carpeta, columnas=["Codbar", "Name", "District"])
+    centros = cargar_csv(CAPAS_SERVICIOS[capa], carpeta, columnas=["Nombre", "equipamien"])
+    # Los barrios no traen x/y: se proyecta su centroide
+    x_b, y_b = a_utm(barrios["LATITUD"].to_numpy(), barrios["LONGITUD"].to_numpy())
+    x_c, y_c = coordenadas_utm(CAPAS_SERVICIOS[capa], carpeta)
+
+    n = len(barrios)
+    cercano = np.full(n, -1, dtype=np.int64)
+    dist = np.full(n, np.inf)
+    conteos = np.zeros((n, len(radios)), dtype=np.int64)
+    radios_arr = np.asarray(radios, dtype=float)
+    # Bloques de barrios para no pasar de MAX_PARES distancias a la vez
+    paso = max(1, MAX_PARES // max(len(centros), 1))
+    if len(centros):
+        for i in range(0, n, paso):
+            d = distancia_plana(x_b[i:i + paso, None], y_b[i:i + paso, None], x_c[None, :], y_c[None, :])
+            cercano[i:i + paso] = d.argmin(axis=1)
+            dist[i:i + paso] = d.min(axis=1)
+            conteos[i:i + paso] = (d[:, :, None] <= radios_arr).sum(axis=1)
+
+    nombres = nombre_centro(centros).to_numpy()
+    tabla = pd.DataFrame({
+        "Codbar": barrios["Codbar"].to_numpy(),
+        "Name": barrios["Name"].to_numpy(),
+        "District": barrios["District"].to_numpy(),
+        "capa": capa,
+        "dist_m": dist,
+        "mas_cercano": nombres[cercano] if len(centros) else None,
+    })
+    for j, r in enumerate(radios):
+        tabla[f"n_{int(r)}m"] = conteos[:, j]
+    return tabla
+
+
+def calcular_tabla(radios=RADIOS_M, procesos: int = 1, carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """Todas las capas; con procesos > 1, una capa por proceso."""
+    capas = list(CAPAS_SERVICIOS)
+    if procesos > 1:
+        with ProcessPoolExecutor(max_workers=min(procesos, len(capas))) as pool:
+            partes = list(pool.map(accesibilidad_capa, capas, [radios] * len(capas), [carpeta] * len(capas)))
+    else:
+        partes = [accesibilidad_capa(capa, radios, carpeta) for capa in capas]
+    return pd.concat(partes, ignore_index=True)
+
+
+def _firma(radios, carpeta):
+    huellas = {archivo: huella_csv(archivo, carpeta)
+               for archivo in [ARCHIVO_BARRIOS, *CAPAS_SERVICIOS.values()]}
+    texto = json.dumps([VERSION_TABLA, list(map(int, radios)), CAPAS_SERVICIOS, huellas], sort_keys=True)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def tabla_accesibilidad(radios=RADIOS_M, procesos: int = 1, carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """Tabla precalculada: de memoria, de ./data/cache o calculada y guardada."""
+    firma = _firma(radios, carpeta)
+    clave = (tuple(map(int, radios)), os.path.abspath(carpeta))
+    tabla = _tablas.buscar(clave, firma)
+    if tabla is not None:
+        return tabla
+
+    ruta = _ruta_tabla(firma)
+    if os.path.exists(ruta):
+        tabla = pd.read_parquet(ruta)
+    else:
+        tabla = calcular_tabla(radios, procesos, carpeta)
+        _guardar(tabla, ruta)
+    return _tablas.guardar(clave, firma, tabla)
+
+
+def _ruta_tabla(firma):
+    return os.path.join(CARPETA_CACHE, f"accesibilidad.{firma[:12]}.parquet")
+
+
+def _guardar(tabla, ruta):
+    os.makedirs(CARPETA_CACHE, exist_ok=True)
+    tmp = ruta + ".tmp"
+    tabla.to_parquet(tmp, index=False)
+    os.replace(tmp, ruta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula la accesibilidad a servicios por barrio.")
+    parser.add_argument("--radios", type=int, nargs="+", default=list(RADIOS_M))
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    tabla = calcular_tabla(args.radios, args.procesos)
+    ruta = _ruta_tabla(_firma(args.radios, CARPETA_CSV))
+    _guardar(tabla, ruta)
+    print(f"{len(tabla)} filas ({tabla['capa'].nunique()} capas) en "
+          f"{time.perf_counter() - inicio:.2f} s -> {ruta}")
@@ -1,10 +1,11 @@
 import streamlit as st
-import pandas as pd
 import folium
 from folium.plugins import MarkerCluster
 from streamlit_folium import folium_static
 import os
 
+from datos import cargar_csv
+
 # ---------------- CONFIGURACIÓN DE PÁGINA ----------------
 st.set_page_config(page_title="Mapa Interactivo", layout="wide")
 
@@ -60,11 +61,8 @@ st.markdown(f"## {titulo}")
 st.markdown(descripcion)
 
 # ---------------- CARGA DE DATOS ----------------
-df = pd.read_csv(os.path.join(data_folder, archivo_csv), sep=";")
-
-# Limpiar y separar latitud y longitud
-df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
+# CSV ya parseado (LATITUD/LONGITUD) desde la caché en disco
+df = cargar_csv(archivo_csv, data_folder)
 
 # ---------------- RESUMEN DE DATOS ----------------
 col1, col2, col3 = st.columns(3)
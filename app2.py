@@ -1,10 +1,9 @@
-import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import folium_static
 import streamlit as st
-import pandas as pd
 import os
 
+from datos import cargar_csv
+from mapas import html_mapa_servicios, mostrar_html
+
 # Configuración de la app
 st.set_page_config(page_title="Mapa Interactivo", layout="wide")
 
@@ -83,12 +82,8 @@ titulo_seleccionado = st.selectbox("📁 Selecciona el tipo de mapa:", list(opci
 # Nombre real del archivo
 archivo_csv = opciones_selector[titulo_seleccionado]
 
-# Cargar datos
-df = pd.read_csv(os.path.join(data_folder, archivo_csv), sep=";")
-
-# Procesar coordenadas
-df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
+# Cargar datos (coordenadas ya procesadas, desde la caché en disco)
+df = cargar_csv(archivo_csv, data_folder)
 
 # Título y descripción dinámicos
 titulo, descripcion = TITULOS_DESCRIPCIONES.get(archivo_csv, ("📍 Mapa Interactivo", "Mapa de datos geográficos"))
@@ -101,36 +96,12 @@ col1.metric("📍 Total de puntos", len(df))
 col2.metric("📌 Columnas", len(df.columns))
 col3.metric("🗂️ Archivo", archivo_csv)
 
-# Crear mapa (OpenStreetMap fijo)
-mapa = folium.Map(
-    location=[df['LATITUD'].mean(), df['LONGITUD'].mean()],
-    zoom_start=13,
-    tiles="OpenStreetMap"
-)
-
-# Añadir marcadores
-marker_cluster = MarkerCluster().add_to(mapa)
 key = archivo_csv.replace(".csv", "")
 info_util = info_util_por_archivo.get(key)
 
-for row in df.itertuples():
-    popup_parts = []
-    for col in info_util["popup"]:
-        valor = getattr(row, col, "N/D")
-        popup_parts.append(f"<strong>{col}:</strong> {valor}")
-    popup_html = "<br>".join(popup_parts)
-    tooltip_val = getattr(row, info_util["tooltip"], "")
-
-    folium.Marker(
-        location=[row.LATITUD, row.LONGITUD],
-        popup=folium.Popup(popup_html, max_width=300),
-        tooltip=tooltip_val,
-        icon=folium.Icon(color="cadetblue", icon="info-sign")
-    ).add_to(marker_cluster)
-
-# Mostrar mapa
+# Mostrar mapa (OpenStreetMap fijo, HTML cacheado por archivo y popup)
 st.markdown("### 🌍 Vista del mapa")
-folium_static(mapa, width=1100, height=600)
+mostrar_html(html_mapa_servicios(archivo_csv, info_util), width=1100, height=600)
 
 # Tabla expandible
 with st.expander("📊 Ver tabla de datos"):
@@ -1,10 +1,9 @@
 import folium
-from folium.plugins import MarkerCluster
 from streamlit_folium import folium_static
 import streamlit as st
-import pandas as pd
-import os
-import matplotlib.pyplot as plt
+
+from datos import cargar_csv
+from mapas import html_mapa_servicios, mostrar_html
 
 # --- Configuración de la app y estilo general ---
 st.set_page_config(page_title="Mapa Interactivo", layout="wide")
@@ -63,9 +62,7 @@ if seccion == "🗺️ Mapas de servicios":
     key = archivo_csv.replace(".csv", "")
     info_util = info_util_por_archivo.get(key)
 
-    df = pd.read_csv(os.path.join("./data/csv", archivo_csv), sep=";")
-    df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-    df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
+    df = cargar_csv(archivo_csv)
 
     titulo, descripcion = TITULOS_DESCRIPCIONES.get(archivo_csv, ("📍 Mapa Interactivo", "Mapa de datos geográficos"))
     st.markdown(f"## {titulo}")
@@ -76,25 +73,8 @@ if seccion == "🗺️ Mapas de servicios":
     col2.metric("📌 Columnas", len(df.columns))
     col3.metric("🗂️ Archivo", archivo_csv)
 
-    mapa = folium.Map(location=[df['LATITUD'].mean(), df['LONGITUD'].mean()], zoom_start=13, tiles="OpenStreetMap")
-    marker_cluster = MarkerCluster().add_to(mapa)
-
-    for row in df.itertuples():
-        popup_parts = []
-        for col in info_util["popup"]:
-            valor = getattr(row, col, "N/D")
-            popup_parts.append(f"<strong>{col}:</strong> {valor}")
-        popup_html = "<br>".join(popup_parts)
-        tooltip_val = getattr(row, info_util["tooltip"], "")
-        folium.Marker(
-            location=[row.LATITUD, row.LONGITUD],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=tooltip_val,
-            icon=folium.Icon(color="cadetblue", icon="info-sign")
-        ).add_to(marker_cluster)
-
     st.markdown("### 🌍 Vista del mapa")
-    folium_static(mapa, width=1100, height=600)
+    mostrar_html(html_mapa_servicios(archivo_csv, info_util), width=1100, height=600)
 
     with st.expander("📊 Ver tabla de datos"):
         columnas_mostrar = [col for col in info_util["popup"] if col in df.columns]
@@ -104,9 +84,7 @@ if seccion == "🗺️ Mapas de servicios":
 elif seccion == "📊 Vulnerabilidad por barrios":
     st.markdown("## 🔍 Análisis de Vulnerabilidad por Barrios")
 
-    vuln_df = pd.read_csv("./data/csv/vulnerabilidad-por-barrios.csv", sep=";")
-    vuln_df = vuln_df[vuln_df['geo_point_2d'].notna() & vuln_df['geo_point_2d'].str.contains(',')]
-    vuln_df[['LATITUD', 'LONGITUD']] = vuln_df['geo_point_2d'].str.split(',', expand=True).astype(float)
+    vuln_df = cargar_csv("vulnerabilidad-por-barrios.csv")
 
     mapa = folium.Map(location=[vuln_df['LATITUD'].astype(float).mean(), vuln_df['LONGITUD'].astype(float).mean()],
                       zoom_start=12, tiles="OpenStreetMap")
@@ -132,6 +110,7 @@ elif seccion == "📊 Vulnerabilidad por barrios":
     folium_static(mapa, width=1100, height=600)
 
     st.markdown("### 📈 Distribución de niveles de vulnerabilidad")
+    import matplotlib.pyplot as plt
     fig, ax = plt.subplots()
     vuln_df['Vul_Global'].value_counts().plot(kind='bar', color=["green", "orange", "red"], ax=ax)
     plt.title("Número de barrios por nivel de vulnerabilidad global")
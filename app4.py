@@ -1,13 +1,7 @@
 import streamlit as st
-import pandas as pd
-import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import folium_static
-from folium import GeoJson, GeoJsonTooltip
 
-import matplotlib.pyplot as plt
-import json
-import os
+from datos import cargar_csv
+from mapas import html_mapa_servicios, mostrar_html
 
 # Configuración de la app
 st.set_page_config(page_title="Mapa Interactivo", layout="wide")
@@ -71,9 +65,7 @@ if seccion == "🗺️ Mapas de servicios":
     key = archivo_csv.replace(".csv", "")
     info_util = info_util_por_archivo.get(key)
 
-    df = pd.read_csv(os.path.join("./data/csv", archivo_csv), sep=";")
-    df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-    df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
+    df = cargar_csv(archivo_csv)
 
     titulo, descripcion = TITULOS_DESCRIPCIONES.get(archivo_csv, ("📍 Mapa Interactivo", "Mapa de datos geográficos"))
     st.markdown(f"## {titulo}")
@@ -84,25 +76,8 @@ if seccion == "🗺️ Mapas de servicios":
     col2.metric("📌 Columnas", len(df.columns))
     col3.metric("🗂️ Archivo", archivo_csv)
 
-    mapa = folium.Map(location=[df['LATITUD'].mean(), df['LONGITUD'].mean()], zoom_start=13, tiles="OpenStreetMap")
-    marker_cluster = MarkerCluster().add_to(mapa)
-
-    for row in df.itertuples():
-        popup_parts = []
-        for col in info_util["popup"]:
-            valor = getattr(row, col, "N/D")
-            popup_parts.append(f"<strong>{col}:</strong> {valor}")
-        popup_html = "<br>".join(popup_parts)
-        tooltip_val = getattr(row, info_util["tooltip"], "")
-        folium.Marker(
-            location=[row.LATITUD, row.LONGITUD],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=tooltip_val,
-            icon=folium.Icon(color="cadetblue", icon="info-sign")
-        ).add_to(marker_cluster)
-
     st.markdown("### 🌍 Vista del mapa")
-    folium_static(mapa, width=1100, height=600)
+    mostrar_html(html_mapa_servicios(archivo_csv, info_util), width=1100, height=600)
 
     with st.expander("📊 Ver tabla de datos"):
         columnas_mostrar = [col for col in info_util["popup"] if col in df.columns]
@@ -110,4 +85,6 @@ if seccion == "🗺️ Mapas de servicios":
         st.dataframe(df[columnas_mostrar])
 
 elif seccion == "📊 Vulnerabilidad por barrios":
-    exec(open("./seccion_vulnerabilidad.py", encoding="utf-8").read())
+    # Se importa al entrar en la sección: matplotlib y compañía no pesan en el arranque
+    import seccion_vulnerabilidad
+    seccion_vulnerabilidad.render()
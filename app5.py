@@ -1,21 +1,19 @@
 import streamlit as st
 import pandas as pd
 import folium
-from folium.plugins import MarkerCluster
-from streamlit_folium import folium_static
-from folium import GeoJson, GeoJsonTooltip
 
-import matplotlib.pyplot as plt
-import json
-import os
+from datos import cargar_csv
+from instrumentacion import comenzar, etapa, fragmento, panel
+# Los módulos de cada sección (mapas, plano, red, encuadre, cobertura) se
+# importan al usarla: el arranque no paga los que la primera vista no necesita
 
-from streamlit_folium import st_folium
-from geopy.distance import distance
 
 
 
 # Configuración de la app
 st.set_page_config(page_title="Mapa Interactivo", layout="wide")
+# Tiempos por etapa con EDM_PERFIL=1 (o ?perfil=1 si EDM_PERFIL_URL=1; ver instrumentacion.py)
+comenzar()
 
 # CSS global
 st.markdown("""
@@ -67,55 +65,47 @@ opciones_selector = {
     "👴 Mapa de Servicios para Personas Mayores": "majors.csv"
 }
 
-# Menú lateral
-seccion = st.sidebar.radio("Selecciona una sección", ["🗺️ Mapas de servicios", "📊 Vulnerabilidad por barrios"])
-
-if seccion == "🗺️ Mapas de servicios":
-    titulo_vis = st.selectbox("Selecciona el tipo de mapa:", list(opciones_selector.keys()))
-    archivo_csv = opciones_selector[titulo_vis]
+# ---------- Mapa de servicios y centro más cercano ----------
+# Fragmento: un clic o un movimiento del mapa solo vuelve a ejecutar esta
+# función, no la página. El clic se lee del estado del mapa antes de
+# dibujarlo, así que el marcador y el centro más cercano salen en la misma
+# pasada, sin st.rerun().
+@st.fragment
+@fragmento("mapa de servicios")
+def mapa_servicios(archivo_csv, info_util, solo_visible, por_calles=False):
+    from mapas import plantilla_mapa_servicios, st_folium_plantilla
+
+    df = cargar_csv(archivo_csv)
     key = archivo_csv.replace(".csv", "")
-    info_util = info_util_por_archivo.get(key)
-
-    df = pd.read_csv(os.path.join("./data/csv", archivo_csv), sep=";")
-    df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-    df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
-
-    titulo, descripcion = TITULOS_DESCRIPCIONES.get(archivo_csv, ("📍 Mapa Interactivo", "Mapa de datos geográficos"))
-    st.markdown(f"## {titulo}")
-    st.markdown(descripcion)
-
-    col1, col2, col3 = st.columns(3)
-    col1.metric("📍 Total de puntos", len(df))
-    col2.metric("📌 Columnas", len(df.columns))
-    col3.metric("🗂️ Archivo", archivo_csv)
-
-    mapa = folium.Map(location=[df['LATITUD'].mean(), df['LONGITUD'].mean()], zoom_start=13, tiles="OpenStreetMap")
-    marker_cluster = MarkerCluster().add_to(mapa)
-
-    for row in df.itertuples():
-        popup_parts = []
-        for col in info_util["popup"]:
-            valor = getattr(row, col, "N/D")
-            popup_parts.append(f"<strong>{col}:</strong> {valor}")
-        popup_html = "<br>".join(popup_parts)
-        tooltip_val = getattr(row, info_util["tooltip"], "")
-        folium.Marker(
-            location=[row.LATITUD, row.LONGITUD],
-            popup=folium.Popup(popup_html, max_width=300),
-            tooltip=tooltip_val,
-            icon=folium.Icon(color="cadetblue", icon="info-sign")
-        ).add_to(marker_cluster)
+    clave_mapa = f"encuadre_{key}" if solo_visible else "main_map"
+    vista = st.session_state.get(clave_mapa) or {}
+    # El estado del mapa conserva el último clic: solo cuenta si es nuevo
+    if vista.get("last_clicked") and vista["last_clicked"] != st.session_state.get(f"_clic_{clave_mapa}"):
+        st.session_state[f"_clic_{clave_mapa}"] = st.session_state["click"] = vista["last_clicked"]
 
+    # Mapa base cacheado; el clic y el centro más cercano van en una capa aparte
+    with etapa("mapa base (marcadores + serialización)"):
+        plantilla = plantilla_mapa_servicios(archivo_csv, info_util, modo="encuadre" if solo_visible else "auto")
+    capa_clic = folium.FeatureGroup(name="Clic")
 
     if "click" in st.session_state:
         lat = st.session_state["click"]["lat"]
         lon = st.session_state["click"]["lng"]
 
         # 3a. Calcular hospital más cercano
-        df["dist_m"] = df.apply(
-            lambda r: distance((lat, lon), (r.LATITUD, r.LONGITUD)).meters, axis=1
-        )
-        nearest = df.loc[df.dist_m.idxmin()]
+        with etapa("centro más cercano"):
+            from plano import indice_utm_para
+            indice = indice_utm_para(archivo_csv)
+            idx, dist = indice.k_vecinos(lat, lon, k=1)
+            fila, dist_m, como = idx[0], dist[0], "en línea recta"
+            if por_calles:
+                # Sin camino por la red (punto fuera del extracto): línea recta
+                from red import mas_cercano_red
+                fila_red, metros = mas_cercano_red(lat, lon, archivo_csv)
+                if fila_red >= 0:
+                    fila, dist_m, como = fila_red, metros, "aprox. por calles"
+            nearest = df.iloc[fila]
+            cerca, _ = indice.en_radio(lat, lon, 1000)
 
         nombre= nearest.Nombre if 'Nombre' in df.columns else nearest.equipamien
         # 3b. Pintar marcador del clic y del hospital
@@ -123,27 +113,131 @@ if seccion == "🗺️ Mapas de servicios":
             [lat, lon],
             icon=folium.Icon(color="blue", icon="glyphicon-screenshot"),
             popup="Aquí has pinchado",
-        ).add_to(mapa)
+        ).add_to(capa_clic)
 
         folium.Marker(
             [nearest.LATITUD, nearest.LONGITUD],
             icon=folium.Icon(color="green", icon="info-sign"),
-            popup=f"{nombre} ({nearest.dist_m:,.0f} m)",
-        ).add_to(mapa)
+            popup=f"{nombre} ({dist_m:,.0f} m)",
+        ).add_to(capa_clic)
 
-        st.success(f"Centro más cercano: {nombre} – {nearest.dist_m:,.0f} m")
+        st.success(f"Centro más cercano: {nombre} – {dist_m:,.0f} m {como}")
+        st.caption(f"Centros a menos de 1 km del punto: {len(cerca)}")
 
 
     st.markdown("### 🌍 Vista del mapa")
 
-    result = st_folium(mapa, height=600, width=1100, key="main_map")
-    if result and result["last_clicked"]:
-        st.session_state["click"] = result["last_clicked"]
-        st.rerun()
+    capas_dinamicas = [capa_clic]
+    if solo_visible:
+        from encuadre import capa_encuadre, encuadre_inicial
+        # Límites y zoom del último movimiento del mapa (o la vista inicial)
+        zoom = vista.get("zoom") or 13
+        limites = vista.get("bounds") or encuadre_inicial(df["LATITUD"].mean(), df["LONGITUD"].mean(), zoom, 1100, 600)
+        with etapa("encuadre"):
+            capa_visible = capa_encuadre(archivo_csv, info_util, limites, zoom)
+        capas_dinamicas.insert(0, capa_visible)
+        que = "puntos" if capa_visible.tipo == "puntos" else "grupos"
+        st.caption(f"En el mapa: {capa_visible.n_marcadores} {que} con {capa_visible.n_puntos} de {len(df)} puntos")
+
+    with etapa("st_folium"):
+        st_folium_plantilla(plantilla, height=600, width=1100, key=clave_mapa,
+                            feature_group_to_add=capas_dinamicas,
+                            returned_objects=["last_clicked", "bounds", "zoom"] if solo_visible else ["last_clicked"])
+
+
+# ---------- Cobertura (fragmento: el clic solo lee una celda) ----------
+@st.fragment
+@fragmento("mapa de cobertura")
+def mapa_cobertura(rejilla, capa):
+    from cobertura import plantilla_cobertura
+    from mapas import st_folium_plantilla
+
+    with etapa("st_folium"):
+        result = st_folium_plantilla(plantilla_cobertura(capa), height=600, width=1100,
+                                     key="mapa_cobertura", returned_objects=["last_clicked"])
+
+    if result and result.get("last_clicked"):
+        punto = result["last_clicked"]
+        distancias = rejilla.distancias_en(punto["lat"], punto["lng"])
+        if distancias:
+            st.success(f"Centro de {capa} más cercano a ~{distancias[capa]:,.0f} m")
+            st.dataframe(pd.DataFrame({"Distancia (m)": distancias}).round(0))
+        else:
+            st.info("El punto queda fuera de la rejilla de cobertura.")
+
+
+# Menú lateral
+seccion = st.sidebar.radio("Selecciona una sección", ["🗺️ Mapas de servicios", "🗂️ Mapa por capas", "🟩 Cobertura de servicios", "📊 Vulnerabilidad por barrios"])
+
+if seccion == "🗺️ Mapas de servicios":
+    titulo_vis = st.selectbox("Selecciona el tipo de mapa:", list(opciones_selector.keys()))
+    archivo_csv = opciones_selector[titulo_vis]
+    key = archivo_csv.replace(".csv", "")
+    info_util = info_util_por_archivo.get(key)
+
+    with etapa("cargar_csv"):
+        df = cargar_csv(archivo_csv)
+
+    titulo, descripcion = TITULOS_DESCRIPCIONES.get(archivo_csv, ("📍 Mapa Interactivo", "Mapa de datos geográficos"))
+    st.markdown(f"## {titulo}")
+    st.markdown(descripcion)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("📍 Total de puntos", len(df))
+    col2.metric("📌 Columnas", len(df.columns))
+    col3.metric("🗂️ Archivo", archivo_csv)
+    solo_visible = st.toggle("Enviar solo lo visible", help="El mapa recibe solo los puntos del encuadre actual, "
+                             "o grupos por zona si son muchos; se actualiza al mover o acercar el mapa.")
+    # Solo si la red de calles de esta capa ya está preparada (ver red.py)
+    from red import hay_red, red_preparada
+    por_calles = False
+    if red_preparada(archivo_csv):
+        por_calles = st.toggle("Distancia por calles", help="Centro más cercano a pie por la red "
+                               "de calles en vez de en línea recta. Aproximada: se entra a la "
+                               "red por la calle más cercana y se sigue el eje de las calles.")
+    elif hay_red():
+        st.caption("Distancia por calles: falta preparar la red para esta capa (python red.py preparar).")
+
+    mapa_servicios(archivo_csv, info_util, solo_visible, por_calles)
+
     with st.expander("📊 Ver tabla de datos"):
         columnas_mostrar = [col for col in info_util["popup"] if col in df.columns]
         columnas_mostrar += ['LATITUD', 'LONGITUD']
         st.dataframe(df[columnas_mostrar])
 
+elif seccion == "🗂️ Mapa por capas":
+    st.markdown("## 🗂️ Mapa por capas")
+    st.markdown("Activa o desactiva cada tipo de servicio desde el control de capas del mapa.")
+
+    # Las capas se activan en el navegador; sus datos se descargan al activarlas
+    capas = {titulo.replace("Mapa de ", ""): archivo
+             for titulo, archivo in opciones_selector.items()}
+    primera = next(iter(capas))
+    with etapa("mapa por capas"):
+        from mapas import html_mapa_capas, mostrar_html
+        mostrar_html(html_mapa_capas(capas, info_util_por_archivo, visibles=[primera]), width=1100, height=600)
+
+elif seccion == "🟩 Cobertura de servicios":
+    from cobertura import DISTANCIA_MAX_M, rejilla_cobertura, rejilla_lista
+
+    st.markdown("## 🟩 Cobertura de servicios")
+    st.markdown(f"Distancia al centro más cercano en celdas de 50 m (rojo a partir de {DISTANCIA_MAX_M:,.0f} m).")
+
+    # Rejilla precalculada (python cobertura.py o precarga.py): el clic solo lee
+    # una celda. Si falta, se calcula aquí una vez para todas las sesiones
+    with etapa("rejilla de cobertura"):
+        if rejilla_lista():
+            rejilla = rejilla_cobertura()
+        else:
+            with st.spinner("Calculando la rejilla de cobertura (solo la primera vez, unos segundos)…"):
+                rejilla = rejilla_cobertura()
+    capa = st.selectbox("Tipo de servicio", rejilla.capas)
+    mapa_cobertura(rejilla, capa)
+
 elif seccion == "📊 Vulnerabilidad por barrios":
-    exec(open("./seccion_vulnerabilidad.py", encoding="utf-8").read())
\ No newline at end of file
+    # Se importa al entrar en la sección: matplotlib y compañía no pesan en el arranque
+    with etapa("vulnerabilidad por barrios"):
+        import seccion_vulnerabilidad
+        seccion_vulnerabilidad.render()
+
+panel()
\ No newline at end of file
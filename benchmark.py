@@ -0,0 +1,480 @@
+# benchmark.py  ·  tiempos de los caminos críticos de los mapas, sin navegador
+#
+# Mide, sobre los CSV reales y sobre copias sintéticas con el mismo esquema
+# escaladas a 1k, 10k, 100k y 1M filas:
+#
+#   carga               parsear_csv: lectura del CSV y separación de geo_point_2d
+#   carga_cache         cargar_csv desde el Parquet de ./data/cache
+#   marcadores          construir_mapa_servicios con un Marker de folium por fila
+#   marcadores_rapidos  construir_mapa_servicios con FastMarkerCluster
+#   html_folium_static  HTML completo del mapa (lo que hace folium_static)
+#   html_st_folium      serializar_mapa (lo que envía st_folium)
+#   indice              construcción del IndiceRejilla
+#   cercano             k_vecinos de CONSULTAS clics con el índice
+#   cercano_directo     mas_cercanos (todos contra todos) de los mismos clics
+#   cercano_utm         k_vecinos de los mismos clics con plano.IndiceUTM
+#   cercano_plano       mas_cercanos_plano (todos contra todos, en UTM)
+#   lote                lotes.mas_cercanos_lote de CONSULTAS_LOTE puntos (k=3)
+#   encuadre            capa_encuadre de vistas de 1100 x 600 px a zoom 13
+#   teselas             generar_tesela (MVT) de teselas a zoom 14
+#   coropletico         mapa de vulnerabilidad de seccion_vulnerabilidad
+#
+# y con --apps, cada app completa con AppTest (primera ejecución y reruns).
+#
+# Cada caso corre en un proceso nuevo con su propio ./data (el del repo para
+# "real", ./data/cache/benchmark/<filas> para los sintéticos), así que la
+# memoria de pico (RSS) es la del caso y las cachés no se mezclan entre
+# tamaños. Los resultados se guardan en RESULTADOS como JSON y se comparan con
+# la ejecución anterior: un p50 o un pico de RSS que empeora más de --umbral
+# cuenta como regresión y el proceso termina con código 1.
+#
+# Uso:  python benchmark.py [--tamanos real 1000 10000 100000 1000000]
+#                           [--casos carga cercano ...] [--repeticiones 5]
+#                           [--archivo majors.csv] [--apps] [--base RUTA] [--umbral 0.2]
+import argparse
+import glob
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from datos import CARPETA_CACHE, CARPETA_CSV
+
+CARPETA_BENCH = os.path.join(CARPETA_CACHE, "benchmark")
+RESULTADOS = os.path.join(CARPETA_BENCH, "resultados")
+TAMANOS = ("real", 1000, 10_000, 100_000, 1_000_000)
+# Clics aleatorios por repetición en los casos de cercanía
+CONSULTAS = 1000
+CONSULTAS_LOTE = 100_000
+# Por encima, un Marker de Python por fila tarda minutos: el caso se omite
+MAX_MARCADORES = 20_000
+APPS = ("app.py", "app2.py", "app3.py", "app4.py", "app5.py", "distancia2.py")
+# Mismos popup/tooltip que info_util_por_archivo de app5.py
+INFO_UTIL = {
+    "majors.csv": {"popup": ["equipamien", "identifica", "telefono", "codvia", "numportal"], "tooltip": "equipamien"},
+    "hospitales.csv": {"popup": ["Nombre", "Tipo", "Camas", "Financiaci", "Direccion"], "tooltip": "Nombre"},
+}
+
+
+# ---------- datos sintéticos ----------
+def _columna_forma(df):
+    return next((c for c in ("geo_shape", "Geo Shape") if c in df.columns), None)
+
+
+def _es_de_puntos(df) -> bool:
+    """Si la capa es de puntos (se escala) o de polígonos (se copia tal cual)."""
+    forma = _columna_forma(df)
+    if forma is None:
+        return True
+    tipos = df[forma][df[forma] != ""].str.extract(r'"type":\s*"(\w+)"', expand=False)
+    return tipos.isin(["Point", "MultiPoint"]).all()
+
+
+def generar_csv(origen: str, destino: str, n: int, semilla: int = 0):
+    """CSV de n filas con el esquema de `origen`: filas reales remuestreadas
+    con coordenadas aleatorias dentro de la caja de los puntos originales."""
+    df = pd.read_csv(origen, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+    validas = df[df["geo_point_2d"].str.contains(",")].reset_index(drop=True)
+    latlon = validas["geo_point_2d"].str.split(",", expand=True).astype(float).to_numpy()
+
+    rng = np.random.default_rng(semilla)
+    salida = validas.iloc[rng.integers(0, len(validas), n)].reset_index(drop=True)
+    lats = pd.Series(rng.uniform(latlon[:, 0].min(), latlon[:, 0].max(), n)).round(12).astype(str)
+    lons = pd.Series(rng.uniform(latlon[:, 1].min(), latlon[:, 1].max(), n)).round(12).astype(str)
+    salida["geo_point_2d"] = lats + ", " + lons
+    forma = _columna_forma(salida)
+    if forma is not None:
+        multi = salida[forma].str.contains("MultiPoint")
+        salida[forma] = np.where(
+            multi,
+            '{"coordinates": [[' + lons + ", " + lats + ']], "type": "MultiPoint"}',
+            '{"coordinates": [' + lons + ", " + lats + '], "type": "Point"}',
+        )
+    if salida.columns[0].lower() == "objectid":
+        salida[salida.columns[0]] = np.arange(1, n + 1).astype(str)
+
+    tmp = destino + ".tmp"
+    salida.to_csv(tmp, sep=";", index=False, encoding="utf-8-sig")
+    os.replace(tmp, destino)
+
+
+def preparar_arbol(n: int, archivos=None) -> str:
+    """Carpeta con ./data/csv a n filas por capa de puntos (se genera una vez)."""
+    raiz = os.path.abspath(os.path.join(CARPETA_BENCH, str(n)))
+    carpeta = os.path.join(raiz, CARPETA_CSV)
+    os.makedirs(carpeta, exist_ok=True)
+    for origen in sorted(glob.glob(os.path.join(CARPETA_CSV, "*.csv"))):
+        archivo = os.path.basename(origen)
+        destino = os.path.join(carpeta, archivo)
+        if (archivos and archivo not in archivos) or os.path.exists(destino):
+            continue
+        df = pd.read_csv(origen, sep=";", dtype=str, keep_default_na=False, encoding="utf-8-sig")
+        if _es_de_puntos(df):
+            generar_csv(origen, destino, n)
+        else:
+            shutil.copyfile(origen, destino)
+    return raiz
+
+
+# ---------- casos ----------
+# Cada caso prepara lo que no se mide y devuelve (función a medir, unidades
+# procesadas por llamada), o un texto si no aplica a ese tamaño. Si la función
+# a medir es un par (preparar, medir), preparar() se llama antes de cada
+# repetición sin medirla y su resultado se pasa a medir().
+def _consultas(df, n=CONSULTAS, semilla=1):
+    rng = np.random.default_rng(semilla)
+    lats, lons = df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy()
+    return rng.uniform(lats.min(), lats.max(), n), rng.uniform(lons.min(), lons.max(), n)
+
+
+def caso_carga(archivo, n):
+    from datos import parsear_csv
+    ruta = os.path.join(CARPETA_CSV, archivo)
+    return (lambda: parsear_csv(ruta)), n
+
+
+def caso_carga_cache(archivo, n):
+    import datos
+    datos.cargar_csv(archivo)
+
+    def medir():
+        datos.vaciar_memoria()
+        return datos.cargar_csv(archivo)
+    return medir, n
+
+
+def caso_marcadores(archivo, n):
+    if n > MAX_MARCADORES:
+        return f"más de {MAX_MARCADORES} filas"
+    from datos import cargar_csv
+    from mapas import construir_mapa_servicios
+    df = cargar_csv(archivo)
+    return (lambda: construir_mapa_servicios(df, INFO_UTIL[archivo], modo="marcadores")), n
+
+
+def caso_marcadores_rapidos(archivo, n):
+    from datos import cargar_csv
+    from mapas import construir_mapa_servicios
+    df = cargar_csv(archivo)
+    return (lambda: construir_mapa_servicios(df, INFO_UTIL[archivo], modo="rapido")), n
+
+
+def _mapa(archivo):
+    """Mapa nuevo por repetición: folium acumula scripts si se renderiza dos veces."""
+    from datos import cargar_csv
+    from mapas import construir_mapa_servicios
+    df = cargar_csv(archivo)
+    return lambda: construir_mapa_servicios(df, INFO_UTIL[archivo])
+
+
+def caso_html_folium_static(archivo, n):
+    import folium
+    return (_mapa(archivo), lambda mapa: folium.Figure().add_child(mapa).render()), n
+
+
+def caso_html_st_folium(archivo, n):
+    from mapas import serializar_mapa
+    return (_mapa(archivo), serializar_mapa), n
+
+
+def caso_indice(archivo, n):
+    from datos import cargar_csv
+    from indice_espacial import IndiceRejilla
+    df = cargar_csv(archivo, columnas=())
+    return (lambda: IndiceRejilla(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy())), n
+
+
+def caso_cercano(archivo, n):
+    from datos import cargar_csv
+    from indice_espacial import indice_para
+    lats, lons = _consultas(cargar_csv(archivo, columnas=()))
+    indice = indice_para(archivo)
+    return (lambda: indice.k_vecinos(lats, lons, k=1)), len(lats)
+
+
+def caso_cercano_directo(archivo, n):
+    from cercania import mas_cercanos
+    from datos import cargar_csv
+    from indice_espacial import MAX_PARES
+    df = cargar_csv(archivo, columnas=())
+    # Tantos clics como quepan en un bloque de MAX_PARES distancias
+    lats, lons = _consultas(df, max(1, min(CONSULTAS, MAX_PARES // len(df))))
+    destino = df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy()
+    return (lambda: mas_cercanos(lats, lons, *destino)), len(lats)
+
+
+def caso_cercano_utm(archivo, n):
+    from datos import cargar_csv
+    from plano import indice_utm_para
+    lats, lons = _consultas(cargar_csv(archivo, columnas=()))
+    indice = indice_utm_para(archivo)
+    return (lambda: indice.k_vecinos(lats, lons, k=1)), len(lats)
+
+
+def caso_cercano_plano(archivo, n):
+    from datos import cargar_csv
+    from indice_espacial import MAX_PARES
+    from plano import a_utm, coordenadas_utm, mas_cercanos_plano
+    df = cargar_csv(archivo, columnas=())
+    lats, lons = _consultas(df, max(1, min(CONSULTAS, MAX_PARES // len(df))))
+    destino = coordenadas_utm(archivo)
+
+    def medir():
+        x, y = a_utm(lats, lons)
+        return mas_cercanos_plano(x, y, *destino)
+    return medir, len(lats)
+
+
+def caso_lote(archivo, n):
+    from accesibilidad import CAPAS_SERVICIOS
+    from datos import cargar_csv
+    from lotes import mas_cercanos_lote
+    capas = [capa for capa, csv in CAPAS_SERVICIOS.items() if csv == archivo]
+    if not capas:
+        return f"{archivo} no es una capa de accesibilidad.CAPAS_SERVICIOS"
+    lats, lons = _consultas(cargar_csv(archivo, columnas=()), CONSULTAS_LOTE)
+    return (lambda: mas_cercanos_lote(lats, lons, capas, k=3)), len(lats)
+
+
+def caso_encuadre(archivo, n):
+    from datos import cargar_csv
+    from encuadre import capa_encuadre, encuadre_inicial, piramide_para
+    from indice_espacial import indice_para
+    lats, lons = _consultas(cargar_csv(archivo, columnas=()), 20)
+    # Vistas de la app (1100 x 600 a zoom 13) centradas en puntos al azar
+    vistas = [encuadre_inicial(lat, lon, 13, 1100, 600) for lat, lon in zip(lats, lons)]
+    indice_para(archivo)
+    piramide_para(archivo)
+
+    def medir():
+        for limites in vistas:
+            capa_encuadre(archivo, INFO_UTIL[archivo], limites, 13)
+    return medir, len(vistas)
+
+
+def caso_teselas(archivo, n):
+    from datos import cargar_csv
+    from encuadre import a_pixeles
+    from mapas import propiedades_teselas
+    from teselas import generar_tesela, preparar_capa, registrar_capa
+    x, y = a_pixeles(*_consultas(cargar_csv(archivo, columnas=()), 20), 14)
+    id_capa = registrar_capa(archivo, *propiedades_teselas(archivo, INFO_UTIL[archivo]))
+    preparar_capa(id_capa)
+
+    def medir():
+        # Sin pasar por el MBTiles: lo que cuesta una tesela que aún no está
+        for tx, ty in zip((x // 256).astype(int), (y // 256).astype(int)):
+            generar_tesela(id_capa, 14, tx, ty)
+    return medir, len(x)
+
+
+def caso_coropletico(archivo, n):
+    import streamlit as st
+    import seccion_vulnerabilidad
+    from datos import huella_csv
+    huella = huella_csv("vulnerabilidad-por-barrios.csv")
+
+    def medir():
+        # Como una sesión nueva: sin la caché de Streamlit, con la de disco
+        st.cache_data.clear()
+        return seccion_vulnerabilidad.html_mapa_vulnerabilidad(huella)
+    return medir, len(seccion_vulnerabilidad.cargar_datos())
+
+
+# nombre -> (función, si depende del tamaño de la capa)
+CASOS = {
+    "carga": (caso_carga, True),
+    "carga_cache": (caso_carga_cache, True),
+    "marcadores": (caso_marcadores, True),
+    "marcadores_rapidos": (caso_marcadores_rapidos, True),
+    "html_folium_static": (caso_html_folium_static, True),
+    "html_st_folium": (caso_html_st_folium, True),
+    "indice": (caso_indice, True),
+    "cercano": (caso_cercano, True),
+    "cercano_directo": (caso_cercano_directo, True),
+    "cercano_utm": (caso_cercano_utm, True),
+    "cercano_plano": (caso_cercano_plano, True),
+    "lote": (caso_lote, True),
+    "encuadre": (caso_encuadre, True),
+    "teselas": (caso_teselas, True),
+    "coropletico": (caso_coropletico, False),
+}
+
+
+# ---------- medición ----------
+def _rss_pico_mb():
+    if resource is None:
+        return None
+    # ru_maxrss va en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def _medir(medir, repeticiones):
+    """(primera llamada, resto) en segundos: la primera incluye el arranque en frío."""
+    if not isinstance(medir, tuple):
+        medir = (tuple, lambda _, llamar=medir: llamar())
+    preparar, medir = medir
+    tiempos = []
+    for _ in range(repeticiones + 1):
+        argumento = preparar()
+        inicio = time.perf_counter()
+        medir(argumento)
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos[0], np.array(tiempos[1:])
+
+
+def _resumen(primera, tiempos, unidades):
+    p50 = float(np.percentile(tiempos, 50))
+    return {
+        "unidades": unidades,
+        "repeticiones": len(tiempos),
+        "primera_ms": round(primera * 1000, 3),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(float(np.percentile(tiempos, 95)) * 1000, 3),
+        "max_ms": round(float(tiempos.max()) * 1000, 3),
+        "por_segundo": round(unidades / p50, 1) if p50 > 0 else None,
+    }
+
+
+def ejecutar_caso(caso, tamano, raiz, archivo, repeticiones) -> dict:
+    """Se ejecuta en un proceso aparte con ./data en `raiz`."""
+    os.chdir(raiz)
+    if tamano == "real":
+        from datos import cargar_csv
+        n = len(cargar_csv(archivo, columnas=()))
+    else:
+        n = int(tamano)
+    rss_base = _rss_pico_mb()
+    preparado = CASOS[caso][0](archivo, n)
+    resultado = {"caso": caso, "tamano": tamano, "archivo": archivo}
+    if isinstance(preparado, str):
+        return {**resultado, "omitido": preparado}
+    medir, unidades = preparado
+    resultado.update(_resumen(*_medir(medir, repeticiones), unidades))
+    rss = _rss_pico_mb()
+    resultado.update(rss_pico_mb=rss, rss_caso_mb=None if rss is None else round(rss - rss_base, 1))
+    return resultado
+
+
+def ejecutar_app(app, tamano, raiz, repeticiones) -> dict:
+    """Primera ejecución y reruns de una app completa con AppTest."""
+    from streamlit.testing.v1 import AppTest
+    os.chdir(raiz)
+    rss_base = _rss_pico_mb()
+    prueba = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), app), default_timeout=600)
+
+    def medir():
+        prueba.run()
+        if prueba.exception:
+            raise RuntimeError(f"{app}: {prueba.exception[0].value}")
+    primera, tiempos = _medir(medir, repeticiones)
+    resultado = {"caso": f"app:{app}", "tamano": tamano, **_resumen(primera, tiempos, 1)}
+    rss = _rss_pico_mb()
+    resultado.update(rss_pico_mb=rss, rss_caso_mb=None if rss is None else round(rss - rss_base, 1))
+    return resultado
+
+
+def _en_proceso_nuevo(funcion, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(funcion, *args).result()
+
+
+def ejecutar(tamanos=TAMANOS, casos=None, archivo="majors.csv", repeticiones=5, apps=False) -> list:
+    casos = list(casos or CASOS)
+    resultados = []
+    for tamano in tamanos:
+        if tamano == "real":
+            raiz = os.getcwd()
+        else:
+            raiz = preparar_arbol(int(tamano), None if apps else [archivo])
+        for caso in casos:
+            if tamano != "real" and not CASOS[caso][1]:
+                continue
+            r = _en_proceso_nuevo(ejecutar_caso, caso, tamano, raiz, archivo, repeticiones)
+            print(_linea(r), flush=True)
+            resultados.append(r)
+        if apps:
+            for app in APPS:
+                r = _en_proceso_nuevo(ejecutar_app, app, tamano, raiz, repeticiones)
+                print(_linea(r), flush=True)
+                resultados.append(r)
+    return resultados
+
+
+# ---------- informe y regresiones ----------
+def _linea(r):
+    if "omitido" in r:
+        return f"{r['caso']:<22} {str(r['tamano']):>8}  omitido ({r['omitido']})"
+    return (f"{r['caso']:<22} {str(r['tamano']):>8}  p50 {r['p50_ms']:>10.2f} ms  p95 {r['p95_ms']:>10.2f} ms  "
+            f"primera {r['primera_ms']:>10.2f} ms  {r['por_segundo'] or 0:>12,.1f}/s  RSS {r['rss_pico_mb']} MB")
+
+
+def ultima_ejecucion(carpeta=RESULTADOS):
+    rutas = sorted(glob.glob(os.path.join(carpeta, "*.json")))
+    return rutas[-1] if rutas else None
+
+
+def guardar(resultados, carpeta=RESULTADOS) -> str:
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump({"fecha": time.strftime("%Y-%m-%d %H:%M:%S"), "resultados": resultados}, f, indent=1)
+    return ruta
+
+
+def comparar(resultados, ruta_base, umbral=0.2) -> pd.DataFrame:
+    """Casos medidos en ambas ejecuciones con su cociente nuevo/base."""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = {(r["caso"], str(r["tamano"])): r for r in json.load(f)["resultados"] if "omitido" not in r}
+    filas = []
+    for r in resultados:
+        b = base.get((r["caso"], str(r["tamano"])))
+        if "omitido" in r or b is None:
+            continue
+        tiempo = r["p50_ms"] / b["p50_ms"] if b["p50_ms"] else None
+        rss = r["rss_pico_mb"] / b["rss_pico_mb"] if r.get("rss_pico_mb") and b.get("rss_pico_mb") else None
+        # Diferencias absolutas mínimas para no marcar ruido (1 ms, 10 MB)
+        regresion = (tiempo is not None and tiempo > 1 + umbral and r["p50_ms"] - b["p50_ms"] > 1) or \
+                    (rss is not None and rss > 1 + umbral and r["rss_pico_mb"] - b["rss_pico_mb"] > 10)
+        filas.append({"caso": r["caso"], "tamano": r["tamano"], "p50_base_ms": b["p50_ms"], "p50_ms": r["p50_ms"],
+                      "x_tiempo": None if tiempo is None else round(tiempo, 2),
+                      "x_rss": None if rss is None else round(rss, 2), "regresion": regresion})
+    return pd.DataFrame(filas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide los caminos críticos de las apps de mapas.")
+    parser.add_argument("--tamanos", nargs="+", default=[str(t) for t in TAMANOS],
+                        help='filas de los CSV sintéticos, o "real" para los de ./data/csv')
+    parser.add_argument("--casos", nargs="+", choices=list(CASOS), default=list(CASOS))
+    parser.add_argument("--archivo", choices=list(INFO_UTIL), default="majors.csv",
+                        help="esquema de CSV que se escala")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--apps", action="store_true", help="medir también cada app completa con AppTest")
+    parser.add_argument("--base", help="resultados con los que comparar (por defecto, la última ejecución)")
+    parser.add_argument("--umbral", type=float, default=0.2, help="empeoramiento que cuenta como regresión")
+    args = parser.parse_args()
+
+    tamanos = [t if t == "real" else int(t) for t in args.tamanos]
+    base = args.base or ultima_ejecucion()
+    resultados = ejecutar(tamanos, args.casos, args.archivo, args.repeticiones, args.apps)
+    print(f"\nResultados en {guardar(resultados)}")
+
+    if base:
+        tabla = comparar(resultados, base, args.umbral)
+        print(f"\nFrente a {base}:")
+        print(tabla.to_string(index=False) if len(tabla) else "sin casos en común")
+        if len(tabla) and tabla["regresion"].any():
+            sys.exit(1)
@@ -0,0 +1,90 @@
+# cercania.py  ·  distancias y centros más cercanos con NumPy
+#
+# Sustituye el df.apply(geopy.distance) fila a fila por una sola operación
+# vectorizada. Se usa la fórmula de Lambert sobre el elipsoide WGS84: dentro
+# de la ciudad (~10 km) difiere de la geodésica de geopy en menos de 4 cm
+# (ver comprobar_precision() o `python cercania.py`).
+import numpy as np
+
+# Elipsoide WGS84
+A_WGS84 = 6378137.0
+F_WGS84 = 1 / 298.257223563
+
+
+def distancia_m(lat, lon, lats, lons) -> np.ndarray:
+    """Distancia en metros entre (lat, lon) y cada punto de (lats, lons).
+
+    Todos los argumentos admiten escalares o arrays y se combinan con las
+    reglas de broadcasting de NumPy.
+    """
+    phi1, lam1 = np.radians(lat), np.radians(lon)
+    phi2, lam2 = np.radians(lats), np.radians(lons)
+
+    # Latitudes reducidas y ángulo central (haversine) sobre la esfera auxiliar
+    b1 = np.arctan((1 - F_WGS84) * np.tan(phi1))
+    b2 = np.arctan((1 - F_WGS84) * np.tan(phi2))
+    h = np.sin((b2 - b1) / 2) ** 2 + np.cos(b1) * np.cos(b2) * np.sin((lam2 - lam1) / 2) ** 2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+    # Corrección de Lambert por el aplanamiento
+    p = (b1 + b2) / 2
+    q = (b2 - b1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        d = A_WGS84 * (sigma - F_WGS84 / 2 * (x + y))
+    return np.where(sigma > 0, d, 0.0)
+
+
+def mas_cercanos(lat, lon, lats, lons, k: int = 1, distancia=distancia_m):
+    """Los k puntos de (lats, lons) más cercanos a cada consulta.
+
+    Con una consulta escalar devuelve (indices, distancias) de forma (k,);
+    con arrays de consultas, de forma (n_consultas, k). Ordenados de menor
+    a mayor distancia. distancia: función con la interfaz de distancia_m; con
+    plano.distancia_plana las coordenadas son x/y UTM en vez de lat/lon.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    escalar = np.ndim(lat) == 0
+    lat = np.atleast_1d(np.asarray(lat, dtype=float))[:, None]
+    lon = np.atleast_1d(np.asarray(lon, dtype=float))[:, None]
+    k = min(k, lats.size)
+
+    d = distancia(lat, lon, lats[None, :], lons[None, :])
+    if k < lats.size:
+        idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(lats.size), d.shape)
+    d_k = np.take_along_axis(d, idx, axis=1)
+    orden = np.argsort(d_k, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, orden, axis=1)
+    d_k = np.take_along_axis(d_k, orden, axis=1)
+
+    if escalar:
+        return idx[0], d_k[0]
+    return idx, d_k
+
+
+def comprobar_precision(n: int = 2000, radio_grados: float = 0.1, semilla: int = 0,
+                        distancia=distancia_m) -> float:
+    """Error máximo (m) de distancia frente a geopy.distance.geodesic.
+
+    Compara n pares aleatorios alrededor de València dentro de radio_grados.
+    distancia recibe (lats1, lons1, lats2, lons2), como distancia_m.
+    """
+    from geopy.distance import geodesic
+
+    rng = np.random.default_rng(semilla)
+    centro = np.array([39.47, -0.376])
+    p1 = centro + rng.uniform(-radio_grados, radio_grados, size=(n, 2))
+    p2 = centro + rng.uniform(-radio_grados, radio_grados, size=(n, 2))
+
+    nuestro = distancia(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1])
+    referencia = np.array([geodesic(tuple(a), tuple(b)).meters for a, b in zip(p1, p2)])
+    return float(np.max(np.abs(nuestro - referencia)))
+
+
+if __name__ == "__main__":
+    for radio in (0.01, 0.1, 1.0):
+        print(f"radio {radio}°: error máximo frente a geopy = {comprobar_precision(radio_grados=radio):.6f} m")
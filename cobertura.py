@@ -0,0 +1,223 @@
+# cobertura.py  ·  rejilla precalculada de distancia al servicio más cercano
+#
+# En vez de calcular el centro más cercano clic a clic, se cubre la ciudad con
+# una rejilla regular (CELDA_M, 50 m por defecto) y cada celda guarda, por
+# capa, la distancia en metros al centro más cercano (consulta por lotes con
+# plano.IndiceUTM, distancia plana en UTM) desde el centro
+# de la celda, así que el error en un punto es como mucho media diagonal
+# (~35 m con 50 m). Las filas son equidistantes en Mercator, como el mapa, para
+# que la imagen encaje sin deformarse sobre las teselas. La rejilla se
+# guarda en ./data/cache como .npy (n_capas, filas, columnas) en float32 y se
+# abre con memmap, así que consultar un clic es indexar el array y pintar la
+# capa es colorear una imagen.
+import hashlib
+import json
+import os
+import threading
+import time
+
+import folium
+from folium.raster_layers import ImageOverlay
+import numpy as np
+import streamlit as st
+
+from accesibilidad import CAPAS_SERVICIOS
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from indice_espacial import RADIO_TIERRA
+from mapas import serializar_mapa
+from plano import indice_utm_para
+from union_espacial import POLIGONOS, poligonos_para
+
+CELDA_M = 50.0
+# Margen alrededor de la ciudad (m)
+MARGEN_M = 1000.0
+# Distancia a la que la escala de colores se satura (m)
+DISTANCIA_MAX_M = 2000.0
+# Subir si cambia el formato de la rejilla o cómo se calcula
+VERSION_REJILLA = 2
+
+# (celda, carpeta) -> (firma, RejillaCobertura)
+_rejillas = CacheVersiones()
+# Una sola construcción a la vez: las demás sesiones esperan y la reutilizan
+_bloqueo = threading.Lock()
+
+
+class RejillaCobertura:
+    def __init__(self, distancias: np.ndarray, meta: dict, firma: str = ""):
+        self.distancias = distancias
+        self.firma = firma
+        self.capas = meta["capas"]
+        self.y_min, self.lon_min = meta["y_min"], meta["lon_min"]
+        self.dy, self.dlon = meta["dy"], meta["dlon"]
+        self.celda_m = meta["celda_m"]
+        self.filas, self.columnas = distancias.shape[1:]
+
+    @property
+    def limites(self):
+        return [[float(_latitud(self.y_min)), self.lon_min],
+                [float(_latitud(self.y_min + self.filas * self.dy)), self.lon_min + self.columnas * self.dlon]]
+
+    def celda(self, lat: float, lon: float):
+        """(fila, columna) de la celda que contiene el punto, o None si cae fuera."""
+        i = int((_mercator(lat) - self.y_min) // self.dy)
+        j = int((lon - self.lon_min) // self.dlon)
+        if 0 <= i < self.filas and 0 <= j < self.columnas:
+            return i, j
+        return None
+
+    def distancias_en(self, lat: float, lon: float) -> dict:
+        """{capa: metros al centro más cercano} en el punto (vacío si cae fuera)."""
+        celda = self.celda(lat, lon)
+        if celda is None:
+            return {}
+        return {capa: float(self.distancias[k][celda]) for k, capa in enumerate(self.capas)}
+
+    def capa(self, nombre: str) -> np.ndarray:
+        return self.distancias[self.capas.index(nombre)]
+
+
+# ---------- cálculo ----------
+def _mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def _latitud(y):
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+
+def _extension(carpeta):
+    """Caja (lat_min, lon_min, lat_max, lon_max) de barrios y centros."""
+    lats, lons = [], []
+    for csv, columna_geo, _ in POLIGONOS.values():
+        aristas = poligonos_para(csv, columna_geo, carpeta).aristas
+        lons.append(aristas[:, 0])
+        lats.append(aristas[:, 1])
+    for archivo in CAPAS_SERVICIOS.values():
+        df = cargar_csv(archivo, carpeta, columnas=())
+        lats.append(df["LATITUD"].to_numpy())
+        lons.append(df["LONGITUD"].to_numpy())
+    lats, lons = np.concatenate(lats), np.concatenate(lons)
+    return lats.min(), lons.min(), lats.max(), lons.max()
+
+
+def _meta(celda_m, carpeta):
+    lat_min, lon_min, lat_max, lon_max = _extension(carpeta)
+    # Celdas de celda_m en la latitud central: en Mercator son cuadradas
+    cos0 = np.cos(np.radians((lat_min + lat_max) / 2))
+    dy = float(celda_m / (RADIO_TIERRA * cos0))
+    dlon = float(np.degrees(dy))
+    margen = MARGEN_M / celda_m
+    y_min, y_max = _mercator(lat_min) - margen * dy, _mercator(lat_max) + margen * dy
+    lon_min, lon_max = lon_min - margen * dlon, lon_max + margen * dlon
+    return {
+        "capas": list(CAPAS_SERVICIOS), "celda_m": celda_m,
+        "y_min": float(y_min), "lon_min": float(lon_min), "dy": dy, "dlon": dlon,
+        "filas": int(np.ceil((y_max - y_min) / dy)),
+        "columnas": int(np.ceil((lon_max - lon_min) / dlon)),
+    }
+
+
+def calcular_rejilla(ruta: str, meta: dict, carpeta: str = CARPETA_CSV):
+    """Escribe en `ruta` el .npy con la distancia de cada celda a cada capa."""
+    filas, columnas = meta["filas"], meta["columnas"]
+    lats = _latitud(meta["y_min"] + (np.arange(filas) + 0.5) * meta["dy"])
+    lons = meta["lon_min"] + (np.arange(columnas) + 0.5) * meta["dlon"]
+    lat_celdas = np.repeat(lats, columnas)
+    lon_celdas = np.tile(lons, filas)
+
+    tmp = ruta + ".tmp.npy"
+    salida = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32,
+                                       shape=(len(meta["capas"]), filas, columnas))
+    for k, capa in enumerate(meta["capas"]):
+        _, dist = indice_utm_para(CAPAS_SERVICIOS[capa], carpeta).k_vecinos(lat_celdas, lon_celdas, k=1)
+        salida[k] = dist[:, 0].reshape(filas, columnas)
+    salida.flush()
+    del salida
+    os.replace(tmp, ruta)
+
+
+def _firma(celda_m, carpeta):
+    huellas = {capa: huella_csv(archivo, carpeta) for capa, archivo in CAPAS_SERVICIOS.items()}
+    huellas.update({csv: huella_csv(csv, carpeta) for csv, _, _ in POLIGONOS.values()})
+    texto = json.dumps([VERSION_REJILLA, celda_m, huellas], sort_keys=True)
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:12]
+
+
+def rejilla_lista(celda_m: float = CELDA_M, carpeta: str = CARPETA_CSV) -> bool:
+    """La rejilla de la versión actual ya está en memoria o en disco (abrirla es inmediato)."""
+    firma = _firma(celda_m, carpeta)
+    base = os.path.join(CARPETA_CACHE, f"cobertura.{firma}")
+    return (_rejillas.buscar((celda_m, os.path.abspath(carpeta)), firma) is not None
+            or (os.path.exists(base + ".npy") and os.path.exists(base + ".json")))
+
+
+def rejilla_cobertura(celda_m: float = CELDA_M, carpeta: str = CARPETA_CSV) -> RejillaCobertura:
+    """Rejilla de la versión actual de los CSV, calculada una vez y abierta con memmap.
+
+    Calcularla lleva unos segundos: precarga.py o `python cobertura.py` la
+    dejan en disco antes de la primera visita.
+    """
+    firma = _firma(celda_m, carpeta)
+    # Una rejilla por tamaño de celda y carpeta: la de una versión anterior de
+    # los CSV se suelta (y su memmap se cierra cuando nadie la usa)
+    clave = (celda_m, os.path.abspath(carpeta))
+    rejilla = _rejillas.buscar(clave, firma)
+    if rejilla is not None:
+        return rejilla
+
+    with _bloqueo:
+        rejilla = _rejillas.buscar(clave, firma)
+        if rejilla is not None:
+            return rejilla
+        base = os.path.join(CARPETA_CACHE, f"cobertura.{firma}")
+        if os.path.exists(base + ".npy") and os.path.exists(base + ".json"):
+            with open(base + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            meta = _meta(celda_m, carpeta)
+            os.makedirs(CARPETA_CACHE, exist_ok=True)
+            calcular_rejilla(base + ".npy", meta, carpeta)
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        rejilla = RejillaCobertura(np.load(base + ".npy", mmap_mode="r"), meta, firma)
+        return _rejillas.guardar(clave, firma, rejilla)
+
+
+# ---------- mapa ----------
+def imagen_capa(rejilla: RejillaCobertura, capa: str, maximo_m: float = DISTANCIA_MAX_M) -> np.ndarray:
+    """RGBA uint8: verde cerca de un centro, rojo a maximo_m o más."""
+    # matplotlib solo para la escala de colores: se importa al pintar la primera capa
+    from matplotlib import colormaps
+    valores = np.clip(np.asarray(rejilla.capa(capa)) / maximo_m, 0, 1)
+    rgba = colormaps["RdYlGn_r"](valores)
+    rgba[..., 3] = 0.55
+    return (rgba * 255).astype(np.uint8)
+
+
+def mapa_cobertura(rejilla: RejillaCobertura, capa: str, maximo_m: float = DISTANCIA_MAX_M) -> folium.Map:
+    (sur, oeste), (norte, este) = rejilla.limites
+    mapa = folium.Map(location=[(sur + norte) / 2, (oeste + este) / 2], zoom_start=12, tiles="OpenStreetMap")
+    # La fila 0 de la rejilla es la más al sur
+    ImageOverlay(imagen_capa(rejilla, capa, maximo_m), bounds=rejilla.limites,
+                 origin="lower", name=f"Distancia a {capa}").add_to(mapa)
+    centros = cargar_csv(CAPAS_SERVICIOS[capa], columnas=())
+    for lat, lon in zip(centros["LATITUD"], centros["LONGITUD"]):
+        folium.CircleMarker([lat, lon], radius=3, color="black", weight=1,
+                            fill=True, fill_opacity=1).add_to(mapa)
+    return mapa
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _plantilla_cobertura(capa, maximo_m, celda_m, firma):
+    return serializar_mapa(mapa_cobertura(rejilla_cobertura(celda_m), capa, maximo_m))
+
+
+def plantilla_cobertura(capa: str, maximo_m: float = DISTANCIA_MAX_M, celda_m: float = CELDA_M) -> dict:
+    return _plantilla_cobertura(capa, maximo_m, celda_m, rejilla_cobertura(celda_m).firma)
+
+
+if __name__ == "__main__":
+    inicio = time.perf_counter()
+    rejilla = rejilla_cobertura()
+    print(f"{len(rejilla.capas)} capas de {rejilla.filas}x{rejilla.columnas} celdas de "
+          f"{rejilla.celda_m:.0f} m en {time.perf_counter() - inicio:.2f} s")
@@ -0,0 +1,276 @@
+# datos.py  ·  acceso compartido a los CSV de ./data/csv
+#
+# Cada CSV se parsea una sola vez: el resultado (con LATITUD/LONGITUD ya
+# separadas de geo_point_2d) se guarda en ./data/cache como Parquet junto a un
+# manifiesto con mtime, tamaño y hash SHA-1 del CSV original. Mientras el CSV
+# no cambie, las siguientes cargas leen el Parquet (o la copia en memoria del
+# proceso) sin pasar por el parser de CSV.
+#
+# El CSV se lee por bloques de TAM_BLOQUE filas y, si quien llama pasa
+# `columnas`, solo se conservan esas columnas (más LATITUD/LONGITUD): la
+# memoria de pico es la del resultado más un bloque, sin importar el tamaño del
+# fichero ni columnas pesadas como geo_shape que no se piden.
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+CARPETA_CSV = "./data/csv"
+CARPETA_CACHE = "./data/cache"
+# Subir si cambia el formato de lo que se guarda en caché
+VERSION_CACHE = 2
+# Filas por bloque al leer el CSV
+TAM_BLOQUE = 100_000
+
+# (ruta absoluta del CSV, columnas) -> ((mtime_ns, tamaño), DataFrame, sha1)
+_memoria = {}
+
+# Las tablas de _memoria se comparten entre todas las sesiones del proceso y
+# cada llamada recibe una vista. Con copy-on-write (siempre activo desde
+# pandas 3) los datos no se copian al repartirlas y lo que una sesión cambie
+# copia solo esa columna, en su vista: la tabla compartida no se toca.
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+
+class CacheVersiones(dict):
+    """Caché en memoria con una sola versión por clave: clave -> (versión, valor).
+
+    Las cachés de los demás módulos van por contenido de los CSV. Con la huella
+    dentro de la clave, cada sincronización (sincronizacion.py) dejaría la
+    versión anterior en memoria hasta reiniciar el proceso; aquí la clave es
+    estable (ruta, parámetros) y la versión nueva sustituye a la vieja.
+    """
+
+    def buscar(self, clave, version):
+        entrada = self.get(clave)
+        return entrada[1] if entrada is not None and entrada[0] == version else None
+
+    def guardar(self, clave, version, valor):
+        self[clave] = (version, valor)
+        return valor
+
+
+def hash_fichero(ruta: str) -> str:
+    h = hashlib.sha1()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def coordenadas_geo_point(geo: pd.Series) -> np.ndarray:
+    """"lat, lon" -> array (n, 2) de floats, sin DataFrames intermedios."""
+    valores = np.fromstring(",".join(geo.tolist()), sep=",") if len(geo) else np.zeros(0)
+    if valores.size != 2 * len(geo):
+        # Algún valor con más o menos de dos números: como antes, fila a fila
+        return geo.str.split(",", expand=True).astype(float).to_numpy()
+    return valores.reshape(-1, 2)
+
+
+def unificar_tipos(partes):
+    """Columnas que unos bloques leen como texto y otros como número -> texto.
+
+    El tipo se deduce bloque a bloque; sin esto el concat deja columnas object
+    mezcladas que no se pueden guardar en Parquet.
+    """
+    for col in partes[0].columns:
+        textuales = [p[col].dtype for p in partes if not pd.api.types.is_numeric_dtype(p[col])]
+        if not textuales or len(textuales) == len(partes):
+            continue
+        for p in partes:
+            serie = p[col]
+            if pd.api.types.is_numeric_dtype(serie):
+                if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+                    serie = serie.astype("Int64")
+                p[col] = serie.astype(textuales[0]).where(serie.notna())
+    return partes
+
+
+def parsear_csv(ruta: str, columnas=None, tam_bloque: int = TAM_BLOQUE) -> pd.DataFrame:
+    """CSV de ./data/csv con LATITUD/LONGITUD, leído por bloques.
+
+    columnas: si no es None, solo se leen esas columnas (las que no existan se
+    ignoran) además de geo_point_2d.
+    """
+    usecols = None
+    if columnas is not None:
+        usecols = (set(columnas) | {"geo_point_2d"}).__contains__
+
+    partes = []
+    for bloque in pd.read_csv(ruta, sep=";", usecols=usecols, chunksize=tam_bloque):
+        geo = bloque["geo_point_2d"]
+        bloque = bloque[geo.notna() & geo.astype(str).str.contains(",")]
+        latlon = coordenadas_geo_point(bloque["geo_point_2d"])
+        bloque = bloque.assign(LATITUD=latlon[:, 0], LONGITUD=latlon[:, 1])
+        if columnas is not None and "geo_point_2d" not in columnas:
+            bloque = bloque.drop(columns="geo_point_2d")
+        partes.append(bloque)
+    if len(partes) == 1:
+        return partes[0].reset_index(drop=True)
+    return pd.concat(unificar_tipos(partes), ignore_index=True)
+
+
+def _nombre_cache(ruta_csv: str) -> str:
+    """Nombre del CSV más un hash corto de su carpeta: dos CSV con el mismo
+    nombre en carpetas distintas no comparten Parquet ni manifiesto."""
+    nombre = os.path.splitext(os.path.basename(ruta_csv))[0]
+    carpeta = os.path.dirname(os.path.abspath(ruta_csv))
+    return nombre + "." + hashlib.sha1(carpeta.encode("utf-8")).hexdigest()[:8]
+
+
+def _rutas_cache(ruta_csv: str, columnas=None):
+    base = os.path.join(CARPETA_CACHE, _nombre_cache(ruta_csv))
+    if columnas is not None:
+        firma = json.dumps(sorted(columnas), ensure_ascii=False)
+        base += "." + hashlib.sha1(firma.encode("utf-8")).hexdigest()[:8]
+    return base + ".parquet", base + ".json"
+
+
+def _leer_manifiesto(ruta: str):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _escribir_manifiesto(ruta: str, manifiesto: dict):
+    tmp = ruta + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f)
+    os.replace(tmp, ruta)
+
+
+def _guardar_cache(ruta_csv: str, df: pd.DataFrame, columnas, mtime_ns: int, tam: int, sha1: str):
+    ruta_parquet, ruta_manifiesto = _rutas_cache(ruta_csv, columnas)
+    os.makedirs(CARPETA_CACHE, exist_ok=True)
+    tmp = ruta_parquet + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, ruta_parquet)
+    _escribir_manifiesto(ruta_manifiesto, {
+        "version": VERSION_CACHE, "mtime_ns": mtime_ns, "tam": tam, "sha1": sha1,
+        "columnas": None if columnas is None else list(columnas),
+    })
+
+
+def _cargar_desde_disco(ruta_csv: str, mtime_ns: int, tam: int, columnas=None):
+    ruta_parquet, ruta_manifiesto = _rutas_cache(ruta_csv, columnas)
+    manifiesto = _leer_manifiesto(ruta_manifiesto)
+    if manifiesto and manifiesto.get("version") != VERSION_CACHE:
+        manifiesto = None
+    hay_parquet = os.path.exists(ruta_parquet)
+
+    # 1. Mismo mtime y tamaño: el Parquet es válido sin leer el CSV
+    if manifiesto and hay_parquet and manifiesto["mtime_ns"] == mtime_ns and manifiesto["tam"] == tam:
+        return pd.read_parquet(ruta_parquet), manifiesto["sha1"]
+
+    # 2. Cambió el mtime (p. ej. un checkout): solo se reconstruye si cambia el contenido
+    sha1 = hash_fichero(ruta_csv)
+    if manifiesto and hay_parquet and manifiesto["sha1"] == sha1:
+        manifiesto.update(mtime_ns=mtime_ns, tam=tam)
+        _escribir_manifiesto(ruta_manifiesto, manifiesto)
+        return pd.read_parquet(ruta_parquet), sha1
+
+    # 3. CSV nuevo o modificado: parsear una vez y guardar
+    df = parsear_csv(ruta_csv, columnas)
+    _guardar_cache(ruta_csv, df, columnas, mtime_ns, tam, sha1)
+    return df, sha1
+
+
+def _entrada(archivo_csv: str, carpeta: str, columnas=None):
+    ruta = os.path.abspath(os.path.join(carpeta, archivo_csv))
+    st_ = os.stat(ruta)
+    firma = (st_.st_mtime_ns, st_.st_size)
+    if columnas is not None:
+        columnas = tuple(sorted(set(columnas)))
+
+    en_memoria = _memoria.get((ruta, columnas))
+    if en_memoria is None or en_memoria[0] != firma:
+        en_memoria = (firma, *_cargar_desde_disco(ruta, *firma, columnas))
+        _memoria[(ruta, columnas)] = en_memoria
+    return en_memoria
+
+
+def cargar_csv(archivo_csv: str, carpeta: str = CARPETA_CSV, columnas=None) -> pd.DataFrame:
+    """Devuelve el CSV ya parseado, con columnas LATITUD y LONGITUD.
+
+    columnas: lista de columnas a conservar (None para todas); la caché es
+    distinta por cada conjunto de columnas.
+    """
+    # Vista de la tabla compartida: quien llama puede añadir o cambiar
+    # columnas sin tocar la caché y sin copiar las demás
+    return _entrada(archivo_csv, carpeta, columnas)[1].copy(deep=False)
+
+
+def huella_csv(archivo_csv: str, carpeta: str = CARPETA_CSV) -> str:
+    """SHA-1 del contenido actual del CSV, para usar como clave de otras cachés."""
+    # Con la entrada de solo coordenadas: no obliga a cargar el CSV entero
+    return _entrada(archivo_csv, carpeta, ())[2]
+
+
+def vaciar_memoria():
+    """Olvida todas las tablas en memoria del proceso (la caché de ./data/cache sigue)."""
+    _memoria.clear()
+
+
+def olvidar_csv(archivo_csv: str, carpeta: str = CARPETA_CSV):
+    """Quita la tabla del CSV de la memoria del proceso y sus Parquet de ./data/cache."""
+    ruta = os.path.abspath(os.path.join(carpeta, archivo_csv))
+    for clave in [c for c in _memoria if c[0] == ruta]:
+        del _memoria[clave]
+    patron = re.compile(re.escape(_nombre_cache(ruta)) + r"(\.[0-9a-f]{8})?\.(json|parquet)$")
+    if os.path.isdir(CARPETA_CACHE):
+        for fichero in os.listdir(CARPETA_CACHE):
+            if patron.fullmatch(fichero):
+                os.remove(os.path.join(CARPETA_CACHE, fichero))
+
+
+# ---------- actualización incremental ----------
+def _proyectar(df: pd.DataFrame, columnas) -> pd.DataFrame:
+    """Lo mismo que parsear_csv(..., columnas) a partir de la tabla completa."""
+    if columnas is None:
+        return df
+    quedan = set(columnas) | {"LATITUD", "LONGITUD"}
+    return df[[c for c in df.columns if c in quedan]]
+
+
+def _proyecciones(ruta_csv: str):
+    """Conjuntos de columnas con caché en disco para este CSV (None = todas)."""
+    patron = re.compile(re.escape(_nombre_cache(ruta_csv)) + r"(\.[0-9a-f]{8})?\.json$")
+    proyecciones = {None, ()}
+    if os.path.isdir(CARPETA_CACHE):
+        for fichero in os.listdir(CARPETA_CACHE):
+            if patron.fullmatch(fichero):
+                manifiesto = _leer_manifiesto(os.path.join(CARPETA_CACHE, fichero))
+                if manifiesto and manifiesto.get("version") == VERSION_CACHE and "columnas" in manifiesto:
+                    columnas = manifiesto["columnas"]
+                    proyecciones.add(None if columnas is None else tuple(columnas))
+    return proyecciones
+
+
+def reemplazar_csv(archivo_csv: str, contenido: bytes, df: pd.DataFrame, carpeta: str = CARPETA_CSV):
+    """Sustituye el CSV por `contenido` con su tabla ya parseada (`df`).
+
+    Para actualizaciones incrementales: quien llama construye df a partir de la
+    tabla anterior y las filas que cambian, y aquí se escriben el CSV, el
+    Parquet de cada proyección y la copia en memoria sin volver a parsear el CSV.
+    """
+    ruta = os.path.abspath(os.path.join(carpeta, archivo_csv))
+    tmp = ruta + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(contenido)
+    os.replace(tmp, ruta)
+
+    st_ = os.stat(ruta)
+    firma = (st_.st_mtime_ns, st_.st_size)
+    sha1 = hashlib.sha1(contenido).hexdigest()
+    df = df.reset_index(drop=True)
+    for columnas in _proyecciones(ruta) | {c for r, c in _memoria if r == ruta}:
+        proyectado = _proyectar(df, columnas)
+        _guardar_cache(ruta, proyectado, columnas, *firma, sha1)
+        _memoria[(ruta, columnas)] = (firma, proyectado, sha1)
+    return sha1
@@ -3,71 +3,83 @@ import os
 import streamlit as st
 import pandas as pd
 import folium
-from streamlit_folium import st_folium
-from geopy.distance import distance
 from folium.plugins import MarkerCluster
 
+from datos import cargar_csv, huella_csv
+from plano import a_utm, coordenadas_utm, mas_cercanos_plano
+from mapas import serializar_mapa, st_folium_plantilla
+
 st.set_page_config(page_title="Hospital más cercano · València")
 
-# ---------- 1. CARGAR DATOS (con caché) ----------
-@st.cache_data(show_spinner=False)
+# ---------- 1. CARGAR DATOS (compartidos entre sesiones) ----------
+# Vista de la tabla en memoria de datos.py, sin copiar; las coordenadas X/Y
+# (UTM) de los hospitales, de plano.coordenadas_utm
 def load_hospitals(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path, sep=";")
-    df = df[df["geo_point_2d"].notna() & df["geo_point_2d"].str.contains(",")]
-    df[["LATITUD", "LONGITUD"]] = (
-        df["geo_point_2d"].str.split(",", expand=True).astype(float)
-    )
+    df = cargar_csv(os.path.basename(path), os.path.dirname(path), columnas=["Nombre"])
     return df[["Nombre", "LATITUD", "LONGITUD"]]
 
 df = load_hospitals(os.path.join("./data/csv/hospitales.csv"))
 
-# ---------- 2. CONSTRUIR EL MAPA ----------
-m = folium.Map(
-    location=[df["LATITUD"].mean(), df["LONGITUD"].mean()],
-    zoom_start=13,
-    tiles="OpenStreetMap",
-    control_scale=True,
-)
-marker_cluster = MarkerCluster().add_to(m)
-
-for row in df.itertuples():
-    folium.Marker(
-        [row.LATITUD, row.LONGITUD],
-        popup=f"<strong>Nombre:</strong> {row.Nombre}",
-        icon=folium.Icon(color="cadetblue", icon="info-sign"),
-    ).add_to(marker_cluster)
-
-# ---------- 3. ¿HAY UN CLIC PREVIO GUARDADO? ----------
-if "click" in st.session_state:
-    lat = st.session_state["click"]["lat"]
-    lon = st.session_state["click"]["lng"]
-
-    # 3a. Calcular hospital más cercano
-    df["dist_m"] = df.apply(
-        lambda r: distance((lat, lon), (r.LATITUD, r.LONGITUD)).meters, axis=1
+# ---------- 2. CONSTRUIR EL MAPA (serializado una vez por versión del CSV, ver mapas.py) ----------
+@st.cache_resource(show_spinner=False, max_entries=2)
+def mapa_base(huella):
+    m = folium.Map(
+        location=[df["LATITUD"].mean(), df["LONGITUD"].mean()],
+        zoom_start=13,
+        tiles="OpenStreetMap",
+        control_scale=True,
     )
-    nearest = df.loc[df.dist_m.idxmin()]
-
-    # 3b. Pintar marcador del clic y del hospital
-    folium.Marker(
-        [lat, lon],
-        icon=folium.Icon(color="blue", icon="glyphicon-screenshot"),
-        popup="Aquí has pinchado",
-    ).add_to(m)
-
-    folium.Marker(
-        [nearest.LATITUD, nearest.LONGITUD],
-        icon=folium.Icon(color="green", icon="info-sign"),
-        popup=f"{nearest.Nombre} ({nearest.dist_m:,.0f} m)",
-    ).add_to(m)
-
-    st.success(f"Hospital más cercano: {nearest.Nombre} – {nearest.dist_m:,.0f} m")
-
-# ---------- 4. MOSTRAR MAPA Y CAPTAR NUEVO CLIC ----------
-st.markdown("### 🌍 Mapa interactivo")
-result = st_folium(m, height=600, width=1100, key="main_map")
-
-# Si el usuario acaba de pinchar, guardar coordenadas y forzar rerun
-if result and result["last_clicked"]:
-    st.session_state["click"] = result["last_clicked"]
-    st.rerun()
+    marker_cluster = MarkerCluster().add_to(m)
+
+    for row in df.itertuples():
+        folium.Marker(
+            [row.LATITUD, row.LONGITUD],
+            popup=f"<strong>Nombre:</strong> {row.Nombre}",
+            icon=folium.Icon(color="cadetblue", icon="info-sign"),
+        ).add_to(marker_cluster)
+    return serializar_mapa(m)
+
+plantilla = mapa_base(huella_csv("hospitales.csv"))
+
+# ---------- 3. CLIC Y HOSPITAL MÁS CERCANO ----------
+# Fragmento: un clic solo vuelve a ejecutar esta función. El clic se lee del
+# estado del mapa antes de dibujarlo, así que el mapa se envía una vez por
+# clic y solo con la capa del clic y el hospital.
+@st.fragment
+def mapa_interactivo():
+    vista = st.session_state.get("main_map") or {}
+    if vista.get("last_clicked") and vista["last_clicked"] != st.session_state.get("_clic_main_map"):
+        st.session_state["_clic_main_map"] = st.session_state["click"] = vista["last_clicked"]
+
+    capa_clic = folium.FeatureGroup(name="Clic")
+    if "click" in st.session_state:
+        lat = st.session_state["click"]["lat"]
+        lon = st.session_state["click"]["lng"]
+
+        # 3a. Calcular hospital más cercano
+        idx, dist = mas_cercanos_plano(*a_utm(lat, lon), *coordenadas_utm("hospitales.csv"))
+        nearest = df.iloc[idx[0]]
+        dist_m = dist[0]
+
+        # 3b. Pintar marcador del clic y del hospital
+        folium.Marker(
+            [lat, lon],
+            icon=folium.Icon(color="blue", icon="glyphicon-screenshot"),
+            popup="Aquí has pinchado",
+        ).add_to(capa_clic)
+
+        folium.Marker(
+            [nearest.LATITUD, nearest.LONGITUD],
+            icon=folium.Icon(color="green", icon="info-sign"),
+            popup=f"{nearest.Nombre} ({dist_m:,.0f} m)",
+        ).add_to(capa_clic)
+
+        st.success(f"Hospital más cercano: {nearest.Nombre} – {dist_m:,.0f} m")
+
+    # ---------- 4. MOSTRAR MAPA Y CAPTAR NUEVO CLIC ----------
+    st.markdown("### 🌍 Mapa interactivo")
+    st_folium_plantilla(plantilla, height=600, width=1100, key="main_map",
+                        feature_group_to_add=capa_clic, returned_objects=["last_clicked"])
+
+
+mapa_interactivo()
@@ -0,0 +1,190 @@
+# encuadre.py  ·  solo los marcadores del encuadre visible del mapa
+#
+# En vez de mandar al navegador todos los puntos de la capa, el mapa base va
+# vacío y en cada movimiento st_folium devuelve los límites y el zoom; con
+# ellos se manda únicamente lo que se ve:
+#
+#   - si en el encuadre hay como mucho MAX_PUNTOS_ENCUADRE puntos, los puntos
+#     (buscados con indice_espacial.IndiceRejilla.en_caja);
+#   - si hay más, grupos precalculados: por cada zoom, los puntos agregados en
+#     celdas de TAM_GRUPO_PX píxeles de Web Mercator (número de puntos y
+#     posición media). Una consulta solo recorre las filas de celdas visibles.
+#
+# Así lo que se envía depende del tamaño de la pantalla y no del de la capa:
+# como mucho MAX_PUNTOS_ENCUADRE marcadores o una celda cada TAM_GRUPO_PX
+# píxeles.
+import json
+import os
+
+import folium
+from folium.template import Template
+import numpy as np
+
+from datos import CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from indice_espacial import indice_para
+from mapas import filas_marcadores
+
+MAX_PUNTOS_ENCUADRE = 300
+TAM_GRUPO_PX = 60
+ZOOM_MAX = 19
+TAM_TESELA = 256
+LAT_MERCATOR = 85.05112878
+
+# ruta CSV -> (sha1, PiramideGrupos)
+_piramides = CacheVersiones()
+
+
+# ---------- Web Mercator ----------
+def a_pixeles(lats, lons, zoom: int = 0):
+    """Coordenadas de píxel Web Mercator (origen arriba a la izquierda) en `zoom`."""
+    escala = TAM_TESELA * 2.0 ** zoom
+    lat = np.radians(np.clip(np.asarray(lats, dtype=float), -LAT_MERCATOR, LAT_MERCATOR))
+    x = (np.asarray(lons, dtype=float) + 180.0) / 360.0 * escala
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * escala
+    return x, y
+
+
+def a_grados(x, y, zoom: int = 0):
+    escala = TAM_TESELA * 2.0 ** zoom
+    lon = np.asarray(x, dtype=float) / escala * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y, dtype=float) / escala))))
+    return lat, lon
+
+
+def encuadre_inicial(lat: float, lon: float, zoom: int, ancho: int, alto: int) -> dict:
+    """Límites, con el formato de st_folium, de un mapa de ancho x alto píxeles."""
+    x, y = a_pixeles(lat, lon, zoom)
+    (norte, sur), (oeste, este) = a_grados([x - ancho / 2, x + ancho / 2], [y - alto / 2, y + alto / 2], zoom)
+    return {"_southWest": {"lat": float(sur), "lng": float(oeste)},
+            "_northEast": {"lat": float(norte), "lng": float(este)}}
+
+
+# ---------- grupos por zoom ----------
+class PiramideGrupos:
+    def __init__(self, lats, lons, tam_px: int = TAM_GRUPO_PX, zoom_max: int = ZOOM_MAX):
+        self.tam_px = tam_px
+        x, y = a_pixeles(lats, lons, zoom_max)
+        cx, cy = (x // tam_px).astype(np.int64), (y // tam_px).astype(np.int64)
+        cuenta = np.ones(cx.size, dtype=np.int64)
+        suma_lat, suma_lon = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+        # Por zoom: clave de celda (fila * columnas + columna) ordenada, puntos y
+        # posición media. Cada celda de un zoom contiene exactamente 2 x 2 del
+        # siguiente, así que cada nivel se agrega a partir del anterior.
+        self.niveles = [None] * (zoom_max + 1)
+        for zoom in range(zoom_max, -1, -1):
+            columnas = int(np.ceil(TAM_TESELA * 2 ** zoom / tam_px))
+            cx, cy = cx.clip(0, columnas - 1), cy.clip(0, columnas - 1)
+            claves, celda = np.unique(cy * columnas + cx, return_inverse=True)
+            cuenta = np.bincount(celda, cuenta, minlength=claves.size).astype(np.int64)
+            suma_lat = np.bincount(celda, suma_lat, minlength=claves.size)
+            suma_lon = np.bincount(celda, suma_lon, minlength=claves.size)
+            self.niveles[zoom] = {"columnas": columnas, "claves": claves, "cuenta": cuenta,
+                                  "lat": suma_lat / cuenta, "lon": suma_lon / cuenta}
+            cx, cy = claves % columnas // 2, claves // columnas // 2
+
+    def grupos(self, zoom: int, sur: float, oeste: float, norte: float, este: float):
+        """(lat, lon, cuenta) de las celdas de `zoom` que tocan la caja."""
+        zoom = int(np.clip(zoom, 0, len(self.niveles) - 1))
+        nivel = self.niveles[zoom]
+        columnas = nivel["columnas"]
+        (x0, x1), (y1, y0) = a_pixeles([sur, norte], [max(oeste, -180.0), min(este, 180.0)], zoom)
+        cx0, cx1 = int(max(x0 // self.tam_px, 0)), int(min(x1 // self.tam_px, columnas - 1))
+        filas = np.arange(max(int(y0 // self.tam_px), 0), min(int(y1 // self.tam_px), columnas - 1) + 1)
+
+        # Las claves van ordenadas por fila: cada fila visible es un rango
+        ini = np.searchsorted(nivel["claves"], filas * columnas + cx0)
+        fin = np.searchsorted(nivel["claves"], filas * columnas + cx1, side="right")
+        sel = np.concatenate([np.arange(i, f) for i, f in zip(ini, fin)] or [np.empty(0, dtype=np.int64)])
+        return nivel["lat"][sel], nivel["lon"][sel], nivel["cuenta"][sel]
+
+
+def piramide_para(archivo_csv: str, carpeta: str = CARPETA_CSV) -> PiramideGrupos:
+    """Grupos de la capa, calculados una vez por contenido del CSV."""
+    clave, sha1 = os.path.abspath(os.path.join(carpeta, archivo_csv)), huella_csv(archivo_csv, carpeta)
+    piramide = _piramides.buscar(clave, sha1)
+    if piramide is None:
+        df = cargar_csv(archivo_csv, carpeta, columnas=())
+        piramide = _piramides.guardar(clave, sha1, PiramideGrupos(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy()))
+    return piramide
+
+
+def _caja(limites):
+    return (limites["_southWest"]["lat"], limites["_southWest"]["lng"],
+            limites["_northEast"]["lat"], limites["_northEast"]["lng"])
+
+
+def contenido_encuadre(archivo_csv: str, limites: dict, zoom: int, carpeta: str = CARPETA_CSV):
+    """("puntos", índices de fila) o ("grupos", (lat, lon, cuenta)) del encuadre."""
+    caja = _caja(limites)
+    grupos = piramide_para(archivo_csv, carpeta).grupos(zoom, *caja)
+    # Las celdas del borde sobresalen de la caja: su suma es una cota superior
+    # y solo si no es muy alta compensa contar los puntos exactos
+    if grupos[2].sum() <= 4 * MAX_PUNTOS_ENCUADRE:
+        puntos = indice_para(archivo_csv, carpeta).en_caja(*caja)
+        if puntos.size <= MAX_PUNTOS_ENCUADRE:
+            return "puntos", puntos
+    return "grupos", grupos
+
+
+# ---------- capa para st_folium ----------
+# Grupos: círculo con el número de puntos, como los de MarkerCluster (cuyo
+# CSS no está en el mapa base); al pinchar se acerca el zoom sobre el grupo
+_CALLBACK_GRUPO = """function (fila) {
+    var n = fila[2];
+    var lado = n < 10 ? 30 : n < 100 ? 36 : n < 1000 ? 42 : 48;
+    var color = n < 10 ? "rgba(110, 204, 57, 0.8)" : n < 100 ? "rgba(240, 194, 12, 0.8)" : "rgba(241, 128, 23, 0.8)";
+    var icono = L.divIcon({
+        html: '<div style="width:' + lado + 'px;height:' + lado + 'px;line-height:' + lado + 'px;' +
+              'border-radius:50%;background:' + color + ';text-align:center;font:12px sans-serif;">' +
+              n.toLocaleString() + '</div>',
+        className: "", iconSize: [lado, lado]
+    });
+    var marker = L.marker(new L.LatLng(fila[0], fila[1]), {icon: icono});
+    marker.on("click", function (e) {
+        var mapa = e.target._map;
+        mapa.setView(e.latlng, Math.min(mapa.getZoom() + 2, mapa.getMaxZoom()));
+    });
+    return marker;
+}"""
+
+
+class _MarcadoresEncuadre(folium.MacroElement):
+    # Los marcadores se crean en el navegador a partir de un único array de
+    # filas, como en mapas._ClusterRapido, y se añaden al FeatureGroup padre
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            (function () {
+                var crear = {{ this.callback }};
+                var filas = {{ this.data_json }};
+                for (var i = 0; i < filas.length; i++) {
+                    crear(filas[i]).addTo({{ this._parent.get_name() }});
+                }
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, data, callback):
+        super().__init__()
+        self._name = "MarcadoresEncuadre"
+        self.callback = callback
+        self.data_json = json.dumps(data, ensure_ascii=False)
+
+
+def capa_encuadre(archivo_csv: str, info_util: dict, limites: dict, zoom: int,
+                  carpeta: str = CARPETA_CSV) -> folium.FeatureGroup:
+    """FeatureGroup con los puntos o grupos visibles, para feature_group_to_add."""
+    capa = folium.FeatureGroup(name="Encuadre")
+    tipo, contenido = contenido_encuadre(archivo_csv, limites, zoom, carpeta)
+    if tipo == "puntos":
+        df = cargar_csv(archivo_csv, carpeta, columnas=[*info_util["popup"], info_util["tooltip"]])
+        data, callback = filas_marcadores(df.iloc[contenido], info_util)
+        capa.n_puntos = len(data)
+    else:
+        lat, lon, cuenta = contenido
+        data = list(zip(lat.round(6).tolist(), lon.round(6).tolist(), cuenta.tolist()))
+        callback = _CALLBACK_GRUPO
+        capa.n_puntos = int(cuenta.sum())
+    capa.tipo, capa.n_marcadores = tipo, len(data)
+    _MarcadoresEncuadre(data, callback).add_to(capa)
+    return capa
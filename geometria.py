@@ -0,0 +1,276 @@
+# geometria.py  ·  simplificación y cuantización de los polígonos de barrios
+#
+# "Geo Shape" (vulnerabilidad-por-barrios.csv) y "geo_shape"
+# (barris-policials.csv) traen coordenadas con 15+ decimales que se mandan tal
+# cual al navegador. Aquí se preparan una vez por zoom:
+#
+#   1. Cuantización a 6 decimales (~0,1 m), como enteros.
+#   2. Topología: los anillos se cortan en los puntos donde se separan barrios
+#      vecinos, de modo que cada frontera compartida es un único arco.
+#   3. Douglas–Peucker sobre cada arco con la tolerancia de un píxel en ese
+#      zoom. Como la frontera es el mismo arco para ambos barrios, no se abren
+#      huecos ni solapes entre vecinos.
+#   4. Salida como GeoJSON o como TopoJSON (arcos compartidos y delta-codificados).
+#
+# El resultado se guarda en ./data/cache con clave hash del CSV + zoom.
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+
+DECIMALES = 6
+ESCALA = 10 ** DECIMALES
+# Metros por píxel en el ecuador a zoom 0 (teselas de 256 px)
+METROS_PIXEL_Z0 = 156543.03392
+# Zoom por defecto: tolerancia de ~1 px al máximo zoom que se usa en los mapas
+ZOOM_DETALLE = 15
+
+# (ruta, columna, propiedades, zoom, formato) -> (sha1, dict)
+_capas = CacheVersiones()
+
+
+# ---------- Douglas–Peucker ----------
+def douglas_peucker(xy: np.ndarray, tolerancia: float) -> np.ndarray:
+    """Máscara de los puntos que se conservan (los extremos siempre)."""
+    n = len(xy)
+    conservar = np.zeros(n, dtype=bool)
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = xy[i], xy[j]
+        tramo = xy[i + 1:j]
+        ab = b - a
+        largo = np.hypot(*ab)
+        if largo == 0:
+            d = np.hypot(*(tramo - a).T)
+        else:
+            d = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / largo
+        k = int(np.argmax(d))
+        if d[k] > tolerancia:
+            k += i + 1
+            conservar[k] = True
+            pila.append((i, k))
+            pila.append((k, j))
+    return conservar
+
+
+def _simplificar_arco(arco: np.ndarray, tolerancia: float, cos0: float) -> np.ndarray:
+    # Douglas–Peucker en metros (equirectangular local) sobre enteros cuantizados
+    xy = np.column_stack((arco[:, 0] * cos0, arco[:, 1])) * (111319.49 / ESCALA)
+    if len(arco) > 3 and (arco[0] == arco[-1]).all():
+        # Anillo cerrado sin cortes: se parte por el punto más lejano al inicio
+        # para que no colapse a un segmento
+        f = int(np.argmax(np.hypot(*(xy - xy[0]).T)))
+        mascara = np.concatenate((douglas_peucker(xy[:f + 1], tolerancia)[:-1],
+                                  douglas_peucker(xy[f:], tolerancia)))
+    else:
+        mascara = douglas_peucker(xy, tolerancia)
+    return arco[mascara]
+
+
+# ---------- topología ----------
+def poligonos_de(geometria: dict):
+    """Lista de polígonos (cada uno, lista de anillos) de un Polygon/MultiPolygon."""
+    if geometria["type"] == "Polygon":
+        return [geometria["coordinates"]]
+    if geometria["type"] == "MultiPolygon":
+        return geometria["coordinates"]
+    raise ValueError(f"Geometría no soportada: {geometria['type']}")
+
+
+def _cuantizar(anillo) -> np.ndarray:
+    q = np.round(np.asarray(anillo, dtype=float) * ESCALA).astype(np.int64)
+    # Quitar puntos repetidos consecutivos que deja el redondeo
+    repetido = np.zeros(len(q), dtype=bool)
+    repetido[1:] = (q[1:] == q[:-1]).all(axis=1)
+    q = q[~repetido]
+    if not (q[0] == q[-1]).all():
+        q = np.vstack((q, q[:1]))
+    return q
+
+
+def construir_topologia(geometrias):
+    """Corta los anillos en arcos compartidos.
+
+    Devuelve (arcos, poligonos): arcos es una lista de arrays (n, 2) de enteros
+    cuantizados y poligonos, por cada geometría, la lista de polígonos como
+    listas de anillos, y cada anillo como lista de índices de arco (~i si el
+    arco se recorre al revés, como en TopoJSON).
+    """
+    anillos = [[[_cuantizar(a) for a in poligono] for poligono in poligonos_de(g)] for g in geometrias]
+
+    # Vecinos de cada punto en todos los anillos: con más de dos vecinos
+    # distintos, el punto es un cruce donde empieza o acaba una frontera común
+    vecinos = {}
+    for geometria in anillos:
+        for poligono in geometria:
+            for anillo in poligono:
+                pts = [tuple(p) for p in anillo[:-1]]
+                for i, p in enumerate(pts):
+                    s = vecinos.setdefault(p, set())
+                    s.add(pts[i - 1])
+                    s.add(pts[(i + 1) % len(pts)])
+    cruces = {p for p, s in vecinos.items() if len(s) > 2}
+
+    arcos, indice_arcos = [], {}
+
+    def registrar(arco):
+        clave = tuple(map(tuple, arco))
+        if clave in indice_arcos:
+            return indice_arcos[clave]
+        inverso = clave[::-1]
+        if inverso in indice_arcos:
+            return ~indice_arcos[inverso]
+        indice_arcos[clave] = len(arcos)
+        arcos.append(arco)
+        return len(arcos) - 1
+
+    poligonos = []
+    for geometria in anillos:
+        salida = []
+        for poligono in geometria:
+            anillos_arcos = []
+            for anillo in poligono:
+                pts = anillo[:-1]
+                cortes = [i for i, p in enumerate(map(tuple, pts)) if p in cruces]
+                if not cortes:
+                    # Sin cruces: se empieza en el punto mínimo para que dos
+                    # anillos idénticos den el mismo arco
+                    i0 = int(np.lexsort((pts[:, 1], pts[:, 0]))[0])
+                    cortes = [i0]
+                # Rotar para empezar en un cruce y trocear de cruce a cruce
+                rotado = np.vstack((pts[cortes[0]:], pts[:cortes[0]], pts[cortes[0]:cortes[0] + 1]))
+                posiciones = [c - cortes[0] for c in cortes] + [len(pts)]
+                anillos_arcos.append([
+                    registrar(rotado[a:b + 1]) for a, b in zip(posiciones[:-1], posiciones[1:])
+                ])
+            salida.append(anillos_arcos)
+        poligonos.append(salida)
+    return arcos, poligonos
+
+
+def _arco(arcos, i):
+    return arcos[i] if i >= 0 else arcos[~i][::-1]
+
+
+def _anillo_de_arcos(arcos, indices) -> np.ndarray:
+    partes = [_arco(arcos, indices[0])] + [_arco(arcos, i)[1:] for i in indices[1:]]
+    return np.vstack(partes)
+
+
+def simplificar_topologia(arcos, poligonos, tolerancia_m: float):
+    """Simplifica cada arco una vez; los anillos que degeneran conservan sus arcos."""
+    if not arcos:
+        return arcos
+    lat0 = np.mean([a[:, 1].mean() for a in arcos]) / ESCALA
+    cos0 = np.cos(np.radians(lat0))
+    simplificados = [_simplificar_arco(a, tolerancia_m, cos0) for a in arcos]
+
+    for geometria in poligonos:
+        for poligono in geometria:
+            for indices in poligono:
+                if len(_anillo_de_arcos(simplificados, indices)) < 4:
+                    for i in indices:
+                        j = i if i >= 0 else ~i
+                        simplificados[j] = arcos[j]
+    return simplificados
+
+
+def tolerancia_zoom(zoom: int, lat: float = 39.47) -> float:
+    """Metros que ocupa un píxel en ese zoom y latitud."""
+    return METROS_PIXEL_Z0 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+# ---------- salida ----------
+def a_geojson(arcos, poligonos, propiedades) -> dict:
+    features = []
+    for geometria, props in zip(poligonos, propiedades):
+        coords = [
+            [(_anillo_de_arcos(arcos, indices) / ESCALA).tolist() for indices in poligono]
+            for poligono in geometria
+        ]
+        if len(coords) == 1:
+            geo = {"type": "Polygon", "coordinates": coords[0]}
+        else:
+            geo = {"type": "MultiPolygon", "coordinates": coords}
+        features.append({"type": "Feature", "geometry": geo, "properties": props})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def a_topojson(arcos, poligonos, propiedades, nombre="capa") -> dict:
+    origen = np.vstack(arcos).min(axis=0) if arcos else np.zeros(2, dtype=np.int64)
+    arcos_delta = []
+    for arco in arcos:
+        rel = arco - origen
+        arcos_delta.append(np.vstack((rel[:1], np.diff(rel, axis=0))).tolist())
+
+    geometrias = []
+    for geometria, props in zip(poligonos, propiedades):
+        if len(geometria) == 1:
+            geometrias.append({"type": "Polygon", "arcs": geometria[0], "properties": props})
+        else:
+            geometrias.append({"type": "MultiPolygon", "arcs": geometria, "properties": props})
+    return {
+        "type": "Topology",
+        "transform": {"scale": [1 / ESCALA, 1 / ESCALA], "translate": (origen / ESCALA).tolist()},
+        "objects": {nombre: {"type": "GeometryCollection", "geometries": geometrias}},
+        "arcs": arcos_delta,
+    }
+
+
+# ---------- capas cacheadas ----------
+def capa_simplificada(archivo_csv: str, columna_geo: str, propiedades: dict,
+                      zoom: int = ZOOM_DETALLE, formato: str = "geojson",
+                      carpeta: str = CARPETA_CSV) -> dict:
+    """Capa de polígonos del CSV simplificada para un zoom.
+
+    propiedades: {nombre de la propiedad: columna del CSV}. formato: "geojson"
+    (FeatureCollection) o "topojson" (objeto "capa" dentro de la Topology).
+    """
+    sha1 = huella_csv(archivo_csv, carpeta)
+    clave = (os.path.abspath(os.path.join(carpeta, archivo_csv)), columna_geo,
+             tuple(propiedades.items()), zoom, formato)
+    capa = _capas.buscar(clave, sha1)
+    if capa is not None:
+        return capa
+
+    firma = json.dumps([columna_geo, list(propiedades.items()), zoom, formato], ensure_ascii=False)
+    nombre = os.path.splitext(archivo_csv)[0]
+    sufijo = hashlib.sha1(firma.encode("utf-8")).hexdigest()[:8]
+    ruta = os.path.join(CARPETA_CACHE, f"{nombre}.{sha1[:12]}.{sufijo}.z{zoom}.{formato}.json")
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            capa = json.load(f)
+    else:
+        capa = _preparar_capa(archivo_csv, carpeta, columna_geo, propiedades, zoom, formato)
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(capa, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, ruta)
+    return _capas.guardar(clave, sha1, capa)
+
+
+def _preparar_capa(archivo_csv, carpeta, columna_geo, propiedades, zoom, formato):
+    df = cargar_csv(archivo_csv, carpeta)
+    df = df[df[columna_geo].notna()]
+    geometrias = [json.loads(g) for g in df[columna_geo]]
+    # NaN no es JSON válido para el navegador
+    props = [
+        {k: None if isinstance(v, float) and math.isnan(v) else v for k, v in zip(propiedades, valores)}
+        for valores in zip(*(df[col].tolist() for col in propiedades.values()))
+    ] if propiedades else [{} for _ in geometrias]
+
+    arcos, poligonos = construir_topologia(geometrias)
+    lat = float(df["LATITUD"].mean())
+    arcos = simplificar_topologia(arcos, poligonos, tolerancia_zoom(zoom, lat))
+    if formato == "topojson":
+        return a_topojson(arcos, poligonos, props)
+    return a_geojson(arcos, poligonos, props)
@@ -0,0 +1,329 @@
+# indice_espacial.py  ·  índice de rejilla para consultas de cercanía
+#
+# Los puntos se proyectan a metros con una equirectangular local y se agrupan
+# en celdas cuadradas (orden tipo CSR: los índices de los puntos ordenados por
+# celda y el desplazamiento de inicio de cada celda). Una consulta solo mira
+# las celdas alrededor del clic, así que el coste depende de la densidad local
+# y no del tamaño de la capa. Las distancias finales son las de
+# cercania.distancia_m, así que los resultados coinciden con mas_cercanos().
+# plano.IndiceUTM usa la misma rejilla en metros UTM y distancias planas.
+import os
+
+import numpy as np
+
+from cercania import distancia_m
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+
+RADIO_TIERRA = 6371008.8
+# Margen frente a la proyección local: la distancia real puede ser algo menor
+# que la plana (elipsoide y cos(lat) distinto del de referencia)
+MARGEN = 0.99
+# Pares (consulta, punto) como máximo por bloque en las consultas por lotes
+MAX_PARES = 4_000_000
+
+# ruta CSV -> (sha1, IndiceRejilla)
+_indices = CacheVersiones()
+
+
+class IndiceRejilla:
+    def __init__(self, lats, lons, celda_m: float = None, xy=None):
+        self.lats = np.ascontiguousarray(lats, dtype=float)
+        self.lons = np.ascontiguousarray(lons, dtype=float)
+        n = self.lats.size
+        self.lat0 = float(self.lats.mean()) if n else 0.0
+        self.lon0 = float(self.lons.mean()) if n else 0.0
+        self._cos0 = np.cos(np.radians(self.lat0))
+        self._lat_abs_max = float(np.abs(self.lats).max(initial=0.0))
+
+        # xy: proyección de los puntos ya calculada (ver plano.IndiceUTM)
+        x, y = self._proyectar(self.lats, self.lons) if xy is None else xy
+        self.x_min = float(x.min()) if n else 0.0
+        self.y_min = float(y.min()) if n else 0.0
+        ancho = float(x.max()) - self.x_min if n else 0.0
+        alto = float(y.max()) - self.y_min if n else 0.0
+
+        if celda_m is None:
+            # Unos dos puntos por celda de media, sin bajar de 25 m
+            celda_m = max(np.sqrt(max(ancho * alto, 1.0) / max(n, 1) * 2), 25.0)
+            cuenta = self._contar(x, y, ancho, alto, celda_m)
+            # Con datos agrupados la media engaña: se ajusta a la ocupación que
+            # ve un punto típico (sum c² / sum c), sin pasar de ~8 celdas por punto
+            ocupacion = float((cuenta.astype(float) ** 2).sum() / max(n, 1))
+            minimo = np.sqrt(max(ancho * alto, 1.0) / (8 * max(n, 1)))
+            celda_m = max(celda_m * np.sqrt(2 / max(ocupacion, 2)), minimo, 25.0)
+        self.celda_m = float(celda_m)
+        cuenta = self._contar(x, y, ancho, alto, self.celda_m)
+
+        cx, cy = self._celdas(x, y)
+        self.orden = np.argsort(cy * self.nx + cx, kind="stable")
+        self.inicio = np.concatenate(([0], np.cumsum(cuenta)))
+
+    def _contar(self, x, y, ancho, alto, celda_m):
+        self.celda_m = celda_m
+        self.nx = int(ancho // celda_m) + 1
+        self.ny = int(alto // celda_m) + 1
+        cx, cy = self._celdas(x, y)
+        return np.bincount(cy * self.nx + cx, minlength=self.nx * self.ny)
+
+    # ---------- proyección y celdas ----------
+    def _proyectar(self, lats, lons):
+        x = RADIO_TIERRA * np.radians(np.asarray(lons) - self.lon0) * self._cos0
+        y = RADIO_TIERRA * np.radians(np.asarray(lats) - self.lat0)
+        return x, y
+
+    def _celdas(self, x, y):
+        cx = np.floor((x - self.x_min) / self.celda_m).astype(np.int64)
+        cy = np.floor((y - self.y_min) / self.celda_m).astype(np.int64)
+        return cx, cy
+
+    def _escala(self, lats_consulta, xs_consulta=()):
+        # Factor que convierte distancia plana en cota inferior de la real
+        lat_max = max(self._lat_abs_max, np.abs(lats_consulta).max(initial=0.0))
+        return MARGEN * min(1.0, np.cos(np.radians(lat_max)) / self._cos0)
+
+    def _distancia(self, x, y, lat, lon, punto):
+        """Distancia real (m) de cada consulta a su punto candidato."""
+        return distancia_m(lat, lon, self.lats[punto], self.lons[punto])
+
+    def _rectangulo(self, sur, oeste, norte, este):
+        """(x0, x1, y0, y1) proyectados que cubren la caja lat/lon."""
+        # La proyección es lineal en lat y en lon: basta con las esquinas
+        (x0, x1), (y0, y1) = self._proyectar(np.array([sur, norte]), np.array([oeste, este]))
+        return x0, x1, y0, y1
+
+    def _candidatos(self, cx, cy, r):
+        """Pares (consulta, punto) de las celdas a distancia <= r de cada consulta."""
+        # El bloque se recorta a la rejilla; dentro de una fila las celdas son
+        # consecutivas en self.orden, así que cada fila es un único rango.
+        x0 = np.clip(cx - r, 0, self.nx - 1)
+        x1 = np.clip(cx + r, 0, self.nx - 1)
+        y0 = np.clip(cy - r, 0, self.ny - 1)
+        y1 = np.clip(cy + r, 0, self.ny - 1)
+        corta = (cx + r >= 0) & (cx - r < self.nx) & (cy + r >= 0) & (cy - r < self.ny)
+
+        filas = y0[:, None] + np.arange(min(2 * int(np.max(r)) + 1, self.ny))[None, :]
+        validas = corta[:, None] & (filas <= y1[:, None])
+        filas = np.where(validas, filas, 0)
+        ini = self.inicio[filas * self.nx + x0[:, None]]
+        fin = self.inicio[filas * self.nx + x1[:, None] + 1]
+        cuenta = np.where(validas, fin - ini, 0).ravel()
+
+        total = int(cuenta.sum())
+        consulta = np.repeat(np.repeat(np.arange(cx.size), filas.shape[1]), cuenta)
+        # Posición dentro de self.orden de cada candidato
+        salto = np.repeat(ini.ravel() - np.concatenate(([0], np.cumsum(cuenta)[:-1])), cuenta)
+        pos = np.arange(total) + salto
+        return consulta, self.orden[pos]
+
+    # ---------- k vecinos ----------
+    def k_vecinos(self, lat, lon, k: int = 1):
+        """Los k puntos más cercanos. Misma interfaz que cercania.mas_cercanos."""
+        escalar = np.ndim(lat) == 0
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        k = min(k, self.lats.size)
+
+        idx = np.full((lat.size, k), -1, dtype=np.int64)
+        dist = np.full((lat.size, k), np.inf)
+        if k == 0:
+            return (idx[0], dist[0]) if escalar else (idx, dist)
+
+        x, y = self._proyectar(lat, lon)
+        paso = self.celda_m * self._escala(lat, x)
+        cx, cy = self._celdas(x, y)
+        # Celdas hasta la rejilla (consultas de fuera) y hasta cubrirla entera
+        fuera = np.maximum(np.maximum(-cx, cx - self.nx + 1), np.maximum(-cy, cy - self.ny + 1)).clip(0)
+        r_total = fuera + max(self.nx, self.ny)
+        # Radio inicial para tener ~k candidatos con la densidad media (~2 por celda)
+        r = fuera + max(1, int(np.ceil(np.sqrt(k / 2) / 2)))
+
+        pendientes = np.arange(lat.size)
+        while pendientes.size:
+            rp = r[pendientes]
+            # Bloques de consultas con como mucho ~MAX_PARES candidatos estimados
+            pares = np.minimum((2 * rp + 1) ** 2 * 2, self.lats.size)
+            corte = np.searchsorted(np.cumsum(pares), np.arange(1, pares.sum() // MAX_PARES + 1) * MAX_PARES)
+            siguientes = []
+            for q in np.split(pendientes, np.unique(corte[(corte > 0) & (corte < pendientes.size)])):
+                i_q, d_q = self._k_en_bloque(lat[q], lon[q], x[q], y[q], cx[q], cy[q], r[q], k)
+                idx[q], dist[q] = i_q, d_q
+                # Resuelta si el k-ésimo cae dentro de lo ya cubierto por el bloque
+                ok = (d_q[:, -1] <= r[q] * paso) | (r[q] >= r_total[q])
+                # Si no, saltar al radio que cubre el k-ésimo actual (o doblar si faltan)
+                r_nuevo = np.where(np.isfinite(d_q[:, -1]),
+                                   np.ceil(np.nan_to_num(d_q[:, -1] / paso, posinf=0)).astype(np.int64),
+                                   2 * r[q])
+                r[q] = np.minimum(np.maximum(r_nuevo, r[q] + 1), r_total[q])
+                siguientes.append(q[~ok])
+            pendientes = np.concatenate(siguientes)
+
+        if escalar:
+            return idx[0], dist[0]
+        return idx, dist
+
+    def _k_en_bloque(self, lat, lon, x, y, cx, cy, r, k):
+        consulta, punto = self._candidatos(cx, cy, r)
+        d = self._distancia(x[consulta], y[consulta], lat[consulta], lon[consulta], punto)
+        idx = np.full((lat.size, k), -1, dtype=np.int64)
+        dist = np.full((lat.size, k), np.inf)
+        if consulta.size == 0:
+            return idx, dist
+
+        if k == 1:
+            # Caso del clic: mínimo por consulta sin ordenar (consulta ya viene ordenada)
+            con, primeros = np.unique(consulta, return_index=True)
+            minimos = np.minimum.reduceat(d, primeros)
+            d_min = np.repeat(minimos, np.diff(np.append(primeros, d.size)))
+            pos = np.flatnonzero(d == d_min)
+            pos = pos[np.unique(consulta[pos], return_index=True)[1]]
+            idx[con, 0] = punto[pos]
+            dist[con, 0] = d[pos]
+            return idx, dist
+
+        # Posición de cada candidato dentro de su consulta (consulta ya viene ordenada)
+        primeros = np.searchsorted(consulta, np.arange(lat.size))
+        cuenta = np.diff(np.append(primeros, consulta.size))
+        rango = np.arange(consulta.size) - np.repeat(primeros, cuenta)
+        ancho = max(int(cuenta.max()), k)
+        if lat.size * ancho <= 4 * consulta.size:
+            # Candidatos en una matriz (consulta, rango) rellena con inf: los k
+            # menores de cada fila sin ordenar todos los candidatos
+            matriz = np.full((lat.size, ancho), np.inf)
+            matriz[consulta, rango] = d
+            columnas = np.argpartition(matriz, k - 1, axis=1)[:, :k] if ancho > k else np.arange(k)[None, :]
+            d_k = np.take_along_axis(matriz, columnas, axis=1)
+            orden = np.argsort(d_k, axis=1, kind="stable")
+            columnas, d_k = np.take_along_axis(columnas, orden, axis=1), np.take_along_axis(d_k, orden, axis=1)
+            hay = np.isfinite(d_k)
+            idx[hay] = punto[(primeros[:, None] + columnas)[hay]]
+            dist[hay] = d_k[hay]
+            return idx, dist
+
+        # Con consultas de muy distinto número de candidatos, orden completo
+        orden = np.lexsort((d, consulta))
+        consulta, punto, d = consulta[orden], punto[orden], d[orden]
+        sel = rango < k
+        idx[consulta[sel], rango[sel]] = punto[sel]
+        dist[consulta[sel], rango[sel]] = d[sel]
+        return idx, dist
+
+    # ---------- radio ----------
+    def en_radio(self, lat: float, lon: float, radio_m: float):
+        """Índices y distancias de todos los puntos a <= radio_m, ordenados."""
+        x, y = self._proyectar(np.array([lat]), np.array([lon]))
+        cx, cy = self._celdas(x, y)
+        r = int(np.ceil(radio_m / (self.celda_m * self._escala(np.array([lat]), x)))) + 1
+        _, punto = self._candidatos(cx, cy, r)
+        d = self._distancia(x[0], y[0], lat, lon, punto)
+        dentro = d <= radio_m
+        punto, d = punto[dentro], d[dentro]
+        orden = np.argsort(d, kind="stable")
+        return punto[orden], d[orden]
+
+    # ---------- caja ----------
+    def en_caja(self, sur: float, oeste: float, norte: float, este: float):
+        """Índices (ordenados) de los puntos dentro de la caja lat/lon."""
+        x0, x1, y0, y1 = self._rectangulo(sur, oeste, norte, este)
+        cx, cy = self._celdas(np.array([x0, x1]), np.array([y0, y1]))
+        cx, cy = np.clip(cx, 0, self.nx - 1), np.clip(cy, 0, self.ny - 1)
+        if x1 < self.x_min or y1 < self.y_min or cx[0] > cx[1] or cy[0] > cy[1]:
+            return np.empty(0, dtype=np.int64)
+
+        filas = np.arange(cy[0], cy[1] + 1)
+        ini = self.inicio[filas * self.nx + cx[0]]
+        fin = self.inicio[filas * self.nx + cx[1] + 1]
+        punto = self.orden[np.concatenate([np.arange(i, f) for i, f in zip(ini, fin)])]
+        lats, lons = self.lats[punto], self.lons[punto]
+        dentro = (lats >= sur) & (lats <= norte) & (lons >= oeste) & (lons <= este)
+        return np.sort(punto[dentro])
+
+    # ---------- actualización ----------
+    def con_cambios(self, origen, lats_nuevas, lons_nuevas) -> "IndiceRejilla":
+        """Índice tras añadir, quitar o reordenar puntos.
+
+        origen[i] es el punto actual que pasa a la posición i, o -1 si en esa
+        posición va el siguiente de (lats_nuevas, lons_nuevas). Reutiliza la
+        rejilla (origen y tamaño de celda) y la celda ya calculada de cada
+        punto; solo se proyectan los nuevos. Si alguno cae fuera de la rejilla
+        se construye un índice nuevo.
+        """
+        origen = np.asarray(origen, dtype=np.int64)
+        nuevo = origen < 0
+        viejo = origen[~nuevo]
+        lats = np.empty(origen.size)
+        lons = np.empty(origen.size)
+        lats[~nuevo], lons[~nuevo] = self.lats[viejo], self.lons[viejo]
+        lats[nuevo], lons[nuevo] = lats_nuevas, lons_nuevas
+
+        cx, cy = self._celdas(*self._proyectar(lats[nuevo], lons[nuevo]))
+        if ((cx < 0) | (cx >= self.nx) | (cy < 0) | (cy >= self.ny)).any():
+            return IndiceRejilla(lats, lons)
+
+        celda = np.empty(self.lats.size, dtype=np.int64)
+        celda[self.orden] = np.repeat(np.arange(self.nx * self.ny), np.diff(self.inicio))
+        celdas = np.empty(origen.size, dtype=np.int64)
+        celdas[~nuevo] = celda[viejo]
+        celdas[nuevo] = cy * self.nx + cx
+
+        indice = IndiceRejilla.__new__(IndiceRejilla)
+        indice.__dict__.update(self.__dict__)
+        indice.lats, indice.lons = lats, lons
+        indice._lat_abs_max = float(np.abs(lats).max(initial=0.0))
+        indice.orden = np.argsort(celdas, kind="stable")
+        indice.inicio = np.concatenate(([0], np.cumsum(np.bincount(celdas, minlength=self.nx * self.ny))))
+        return indice
+
+    # ---------- persistencia ----------
+    def guardar(self, ruta: str):
+        tmp = ruta + ".tmp.npz"
+        np.savez(
+            tmp, lats=self.lats, lons=self.lons, orden=self.orden, inicio=self.inicio,
+            meta=np.array([self.lat0, self.lon0, self.x_min, self.y_min, self.celda_m, self.nx, self.ny]),
+        )
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "IndiceRejilla":
+        with np.load(ruta) as z:
+            indice = cls.__new__(cls)
+            indice.lats, indice.lons = z["lats"], z["lons"]
+            indice.orden, indice.inicio = z["orden"], z["inicio"]
+            lat0, lon0, x_min, y_min, celda_m, nx, ny = z["meta"]
+        indice.lat0, indice.lon0 = float(lat0), float(lon0)
+        indice._cos0 = np.cos(np.radians(indice.lat0))
+        indice._lat_abs_max = float(np.abs(indice.lats).max(initial=0.0))
+        indice.x_min, indice.y_min, indice.celda_m = float(x_min), float(y_min), float(celda_m)
+        indice.nx, indice.ny = int(nx), int(ny)
+        return indice
+
+
+def _ruta_indice(archivo_csv: str, sha1: str) -> str:
+    nombre = os.path.splitext(archivo_csv)[0]
+    return os.path.join(CARPETA_CACHE, f"{nombre}.{sha1[:12]}.indice.npz")
+
+
+def indice_para(archivo_csv: str, carpeta: str = CARPETA_CSV) -> IndiceRejilla:
+    """Índice de la capa, construido una vez por contenido del CSV y guardado en disco."""
+    sha1 = huella_csv(archivo_csv, carpeta)
+    clave = os.path.abspath(os.path.join(carpeta, archivo_csv))
+    indice = _indices.buscar(clave, sha1)
+    if indice is not None:
+        return indice
+
+    ruta = _ruta_indice(archivo_csv, sha1)
+    if os.path.exists(ruta):
+        indice = IndiceRejilla.cargar(ruta)
+    else:
+        df = cargar_csv(archivo_csv, carpeta, columnas=())
+        indice = IndiceRejilla(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy())
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        indice.guardar(ruta)
+    return _indices.guardar(clave, sha1, indice)
+
+
+def registrar_indice(archivo_csv: str, indice: IndiceRejilla, carpeta: str = CARPETA_CSV):
+    """Guarda un índice ya construido (p. ej. con con_cambios) para la versión actual del CSV."""
+    sha1 = huella_csv(archivo_csv, carpeta)
+    os.makedirs(CARPETA_CACHE, exist_ok=True)
+    indice.guardar(_ruta_indice(archivo_csv, sha1))
+    _indices.guardar(os.path.abspath(os.path.join(carpeta, archivo_csv)), sha1, indice)
@@ -0,0 +1,18 @@
+# inicio.py  ·  todas las variantes de la app en un solo proceso
+#
+# streamlit run inicio.py  (o python precarga.py servir, que además calienta
+# las cachés antes de aceptar conexiones). Cada variante es una página: los
+# módulos, los CSV cargados y las cachés de Streamlit se comparten entre todas
+# en vez de repetirse en un servidor por app.
+import streamlit as st
+
+PAGINAS = [
+    st.Page("app5.py", title="Mapas, cobertura y vulnerabilidad", icon="🗺️", default=True),
+    st.Page("app4.py", title="Mapas y vulnerabilidad", icon="📊"),
+    st.Page("app3.py", title="Mapas y vulnerabilidad (básica)", icon="🌐"),
+    st.Page("app2.py", title="Mapas de servicios", icon="📍"),
+    st.Page("app.py", title="Mapa interactivo", icon="🧭"),
+    st.Page("distancia2.py", title="Hospital más cercano", icon="🏥"),
+]
+
+st.navigation(PAGINAS).run()
@@ -0,0 +1,280 @@
+# instrumentacion.py  ·  tiempos y memoria por etapa de cada rerun (opcional)
+#
+# Desactivada por defecto. Se activa para todo el proceso con la variable de
+# entorno EDM_PERFIL=1. El parámetro ?perfil=1 de la URL solo se atiende si
+# además se arrancó con EDM_PERFIL_URL=1: si no, cualquier visitante podría
+# encender el perfilador en un servidor compartido. Entonces:
+#
+#   - cada `with etapa("nombre"):` registra el tiempo de reloj y la memoria
+#     asignada (neta y de pico, con tracemalloc) de ese bloque, anidable;
+#   - panel() muestra las etapas del rerun en la barra lateral y escribe una
+#     línea JSON por rerun en el logger "edm.perfil" (a stderr, o al fichero
+#     de EDM_PERFIL_LOG);
+#   - desde el panel (o con ?perfil=cprofile / ?perfil=pyinstrument) se
+#     perfila un rerun completo y el resultado se guarda en CARPETA_PERFILES;
+#   - las funciones con @st.fragment llevan también @fragmento("nombre"):
+#     cuando Streamlit vuelve a ejecutar solo el fragmento (un clic en el
+#     mapa), comenzar() y panel() no corren, así que el fragmento abre y
+#     cierra su propia medición y la muestra al final de su cuerpo.
+#
+# Desactivada, etapa() devuelve un contexto vacío y no mide nada. tracemalloc
+# es de todo el proceso: con varias sesiones a la vez, la memoria de una
+# etapa incluye la que asignen las demás en ese intervalo. Se enciende con la
+# primera medición abierta y se apaga al cerrarse la última; una medición
+# cuyo rerun terminó con una excepción antes de panel() se recoge en el
+# siguiente comenzar() (su hilo ya no está vivo).
+import cProfile
+import contextlib
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+
+from datos import CARPETA_CACHE
+
+CARPETA_PERFILES = os.path.join(CARPETA_CACHE, "perfiles")
+PERFILADORES = ("cprofile", "pyinstrument")
+# Funciones del perfil que se muestran en el panel
+LINEAS_PERFIL = 25
+
+registro = logging.getLogger("edm.perfil")
+_NULO = contextlib.nullcontext()
+# Estado del rerun en curso: Streamlit ejecuta cada rerun en su propio hilo
+_local = threading.local()
+# ?perfil= en la URL solo con EDM_PERFIL_URL=1
+PERFIL_URL = os.environ.get("EDM_PERFIL_URL", "").lower() not in ("", "0", "no")
+
+# Mediciones abiertas en todo el proceso (id -> estado) y si tracemalloc lo
+# arrancamos nosotros (entonces lo paramos al cerrarse la última)
+_abiertas = {}
+_bloqueo = threading.Lock()
+_traza_propia = False
+
+
+def _pedido():
+    """Valor de EDM_PERFIL o de ?perfil= si PERFIL_URL ("" si no se pidió)."""
+    valor = os.environ.get("EDM_PERFIL", "")
+    if PERFIL_URL:
+        try:
+            valor = st.query_params.get("perfil", valor)
+        except Exception:
+            pass
+    return "" if valor.lower() in ("", "0", "no") else valor.lower()
+
+
+def _configurar_registro():
+    if registro.handlers:
+        return
+    ruta = os.environ.get("EDM_PERFIL_LOG")
+    manejador = logging.FileHandler(ruta, encoding="utf-8") if ruta else logging.StreamHandler()
+    manejador.setFormatter(logging.Formatter("%(message)s"))
+    registro.addHandler(manejador)
+    registro.setLevel(logging.INFO)
+    registro.propagate = False
+
+
+# ---------- etapas ----------
+class _Etapa:
+    def __init__(self, nombre, estado):
+        self.nombre = nombre
+        self.estado = estado
+
+    def __enter__(self):
+        pila = self.estado["pila"]
+        actual, pico = tracemalloc.get_traced_memory()
+        # El pico se reinicia por etapa: el de la madre se guarda antes
+        if pila:
+            pila[-1].pico = max(pila[-1].pico, pico)
+        tracemalloc.reset_peak()
+        self.memoria = self.pico = actual
+        self.fila = {"etapa": self.nombre, "nivel": len(pila)}
+        self.estado["etapas"].append(self.fila)
+        pila.append(self)
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ms = (time.perf_counter() - self.inicio) * 1000
+        actual, pico = tracemalloc.get_traced_memory()
+        pico = max(pico, self.pico)
+        pila = self.estado["pila"]
+        pila.pop()
+        if pila:
+            pila[-1].pico = max(pila[-1].pico, pico)
+        self.fila.update(ms=round(ms, 2), asignado_kb=round((actual - self.memoria) / 1024, 1),
+                         pico_kb=round((pico - self.memoria) / 1024, 1))
+        return False
+
+
+def etapa(nombre: str):
+    """Contexto que mide el bloque si la instrumentación está activa."""
+    estado = getattr(_local, "estado", None)
+    return _NULO if estado is None else _Etapa(nombre, estado)
+
+
+# ---------- rerun ----------
+def comenzar():
+    """Al principio de la app: decide si se mide este rerun y arranca el perfilador."""
+    if _abiertas:
+        _recoger_huerfanas()
+    pedido = _pedido()
+    _local.estado = _iniciar(pedido) if pedido else None
+
+
+def _iniciar(pedido):
+    global _traza_propia
+    _configurar_registro()
+    estado = {"etapas": [], "pila": [], "inicio": time.perf_counter(), "perfilador": None,
+              "hilo": threading.current_thread()}
+    with _bloqueo:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _traza_propia = True
+        _abiertas[id(estado)] = estado
+
+    try:
+        perfilador = st.session_state.pop("_perfilar", None) or (pedido if pedido in PERFILADORES else None)
+        if perfilador == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                perfilador = "cprofile"
+            else:
+                estado["perfilador"] = ("pyinstrument", Profiler())
+                estado["perfilador"][1].start()
+        if perfilador == "cprofile":
+            estado["perfilador"] = ("cprofile", cProfile.Profile())
+            estado["perfilador"][1].enable()
+    except BaseException:
+        _terminar(estado)
+        raise
+    return estado
+
+
+def _terminar(estado):
+    """Para el perfilador si sigue en marcha y, con la última medición, tracemalloc."""
+    global _traza_propia
+    tipo, perfilador = estado["perfilador"] or (None, None)
+    estado["perfilador"] = None
+    if perfilador is not None:
+        try:
+            perfilador.stop() if tipo == "pyinstrument" else perfilador.disable()
+        except Exception:
+            pass
+    with _bloqueo:
+        _abiertas.pop(id(estado), None)
+        if not _abiertas and _traza_propia:
+            tracemalloc.stop()
+            _traza_propia = False
+
+
+def _recoger_huerfanas():
+    """Cierra sin registrar las mediciones de reruns que acabaron en excepción."""
+    with _bloqueo:
+        huerfanas = [e for e in _abiertas.values() if not e["hilo"].is_alive()]
+    for estado in huerfanas:
+        _terminar(estado)
+
+
+def _guardar_perfil(tipo, perfilador):
+    os.makedirs(CARPETA_PERFILES, exist_ok=True)
+    base = os.path.join(CARPETA_PERFILES, time.strftime("%Y%m%d-%H%M%S"))
+    if tipo == "pyinstrument":
+        perfilador.stop()
+        ruta = base + ".html"
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(perfilador.output_html())
+        return ruta, perfilador.output_text(unicode=True)
+    perfilador.disable()
+    ruta = base + ".prof"
+    perfilador.dump_stats(ruta)
+    texto = io.StringIO()
+    pstats.Stats(perfilador, stream=texto).sort_stats("cumulative").print_stats(LINEAS_PERFIL)
+    return ruta, texto.getvalue()
+
+
+def _perfilar_siguiente(clave):
+    st.session_state["_perfilar"] = st.session_state[clave]
+
+
+def _cerrar(estado, **extra):
+    """Para el perfilador y escribe la línea JSON. (total_ms, etapas, memoria)."""
+    total_ms = (time.perf_counter() - estado["inicio"]) * 1000
+    try:
+        if estado["perfilador"] is not None:
+            ruta, texto = _guardar_perfil(*estado["perfilador"])
+            estado["perfilador"] = None
+            st.session_state["_ultimo_perfil"] = {"ruta": ruta, "texto": texto}
+        memoria, pico = tracemalloc.get_traced_memory()
+    finally:
+        _terminar(estado)
+
+    etapas = [e for e in estado["etapas"] if "ms" in e]
+    registro.info(json.dumps({
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"), **extra, "total_ms": round(total_ms, 2),
+        "memoria_kb": round(memoria / 1024, 1), "etapas": etapas,
+    }, ensure_ascii=False))
+    return total_ms, etapas, memoria
+
+
+def _resumen(total_ms, etapas, memoria):
+    st.caption(f"Total {total_ms:,.0f} ms · memoria trazada {memoria / 2 ** 20:,.1f} MB")
+    if etapas:
+        tabla = pd.DataFrame(etapas)
+        tabla["etapa"] = ["· " * n + e for n, e in zip(tabla["nivel"], tabla["etapa"])]
+        st.dataframe(tabla.drop(columns="nivel").set_index("etapa"))
+
+
+@contextlib.contextmanager
+def fragmento(nombre: str):
+    """Mide el cuerpo de un st.fragment (usar como decorador, debajo de @st.fragment).
+
+    Dentro de un rerun completo es una etapa más. Si Streamlit ejecuta solo el
+    fragmento, mide esa ejecución por su cuenta, la registra con "fragmento"
+    en la línea JSON y muestra sus etapas al final del fragmento (un fragmento
+    no puede escribir en la barra lateral).
+    """
+    if getattr(_local, "estado", None) is not None:
+        with etapa(nombre):
+            yield
+        return
+    pedido = _pedido()
+    if not pedido:
+        yield
+        return
+    _local.estado = _iniciar(pedido)
+    try:
+        with etapa(nombre):
+            yield
+    finally:
+        estado, _local.estado = _local.estado, None
+        medida = _cerrar(estado, fragmento=nombre)
+        with st.expander("⏱️ Perfil del fragmento"):
+            _resumen(*medida)
+
+
+def panel():
+    """Al final de la app: registra el rerun y muestra sus etapas en la barra lateral."""
+    estado = getattr(_local, "estado", None)
+    if estado is None:
+        return
+    _local.estado = None
+    medida = _cerrar(estado)
+
+    with st.sidebar.expander("⏱️ Perfil del rerun", expanded=True):
+        _resumen(*medida)
+
+        st.selectbox("Perfilador", PERFILADORES, key="_perfilador")
+        st.button("Perfilar un rerun", on_click=_perfilar_siguiente, args=("_perfilador",))
+        ultimo = st.session_state.get("_ultimo_perfil")
+        if ultimo and os.path.exists(ultimo["ruta"]):
+            with open(ultimo["ruta"], "rb") as f:
+                st.download_button("Descargar perfil", f.read(), file_name=os.path.basename(ultimo["ruta"]))
+            st.code(ultimo["texto"], language=None)
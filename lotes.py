@@ -0,0 +1,239 @@
+# lotes.py  ·  servicios más cercanos de una lista de puntos
+#
+# Lo mismo que un clic en app5.py, pero para un fichero entero (p. ej. un
+# listado de direcciones geocodificadas): para cada punto y cada capa de
+# accesibilidad.CAPAS_SERVICIOS, los k centros más cercanos y sus distancias.
+# Todo en metros UTM (plano.py). Las consultas se ordenan por zona y van por
+# bloques de TAM_LOTE puntos a un pool de procesos. Dentro de un bloque se
+# agrupan en celdas de CELDA_LOTE_M y cada celda calcula una sola vez sus
+# candidatos: los centros a menos de (k-ésima distancia desde el centro de la
+# celda) + (diagonal de la celda), que contienen por desigualdad triangular
+# los k más cercanos de cualquier punto de la celda. Así cada consulta mira
+# unos pocos centros y no la capa entera. Las capas de más de MAX_CENTROS_CELDAS
+# centros usan plano.IndiceUTM.
+#
+#   python lotes.py direcciones.csv [--salida cercanos.parquet]
+#                   [--capas hospitales dona] [-k 3] [--procesos N]
+#                   [--lat LAT --lon LON]
+#
+# La entrada es un CSV (separado por ';' o ',') o un Parquet con las
+# coordenadas en columnas de latitud y longitud (se buscan por nombre, ver
+# COLUMNAS_LAT / COLUMNAS_LON) o en geo_point_2d ("lat, lon"), como los CSV de
+# ./data/csv. La salida añade a cada fila, por capa y vecino j, el nombre del
+# centro (<capa>_<j>) y la distancia en metros (<capa>_<j>_m).
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from accesibilidad import CAPAS_SERVICIOS, nombre_centro
+from datos import CARPETA_CSV, cargar_csv, coordenadas_geo_point
+from indice_espacial import MAX_PARES
+from plano import a_utm, coordenadas_utm, distancia_plana, indice_utm_para
+
+# Puntos por bloque enviado a cada proceso
+TAM_LOTE = 50_000
+# Lado de las celdas que comparten candidatos (m)
+CELDA_LOTE_M = 100.0
+# Holgura de la cota de candidatos: cubre la diferencia entre la distancia
+# plana sin corregir (con la que se eligen) y la corregida por la escala UTM
+HOLGURA_M = 1.0
+# Capas más grandes: IndiceUTM en vez de candidatos por celda
+MAX_CENTROS_CELDAS = 5000
+# Nombres de columna que se reconocen como latitud / longitud
+COLUMNAS_LAT = ("LATITUD", "latitud", "lat", "latitude", "Latitude", "LAT")
+COLUMNAS_LON = ("LONGITUD", "longitud", "lon", "lng", "longitude", "Longitude", "LON")
+
+
+# ---------- entrada ----------
+def leer_consultas(ruta: str, lat: str = None, lon: str = None) -> pd.DataFrame:
+    """Fichero de consultas con columnas LATITUD y LONGITUD (NaN si no hay coordenadas)."""
+    if ruta.endswith(".parquet"):
+        df = pd.read_parquet(ruta)
+    else:
+        with open(ruta, encoding="utf-8-sig") as f:
+            cabecera = f.readline()
+        df = pd.read_csv(ruta, sep=";" if cabecera.count(";") >= cabecera.count(",") else ",",
+                         encoding="utf-8-sig")
+
+    lat = lat or next((c for c in COLUMNAS_LAT if c in df.columns), None)
+    lon = lon or next((c for c in COLUMNAS_LON if c in df.columns), None)
+    if lat and lon:
+        lats = pd.to_numeric(df[lat], errors="coerce").to_numpy(dtype=float)
+        lons = pd.to_numeric(df[lon], errors="coerce").to_numpy(dtype=float)
+    elif "geo_point_2d" in df.columns:
+        geo = df["geo_point_2d"].astype(str)
+        validas = geo.str.contains(",") & df["geo_point_2d"].notna()
+        lats, lons = np.full(len(df), np.nan), np.full(len(df), np.nan)
+        latlon = coordenadas_geo_point(geo[validas])
+        lats[validas.to_numpy()], lons[validas.to_numpy()] = latlon[:, 0], latlon[:, 1]
+    else:
+        raise ValueError(f"{ruta}: no hay columnas de latitud/longitud ni geo_point_2d "
+                         f"(usa --lat y --lon)")
+    return df.assign(LATITUD=lats, LONGITUD=lons)
+
+
+# ---------- cálculo ----------
+def _candidatos_por_celda(x, y, xs, ys, k, celda_m=CELDA_LOTE_M):
+    """Celda de cada consulta y matriz (celdas, m) de candidatos, con -1 de relleno."""
+    x0, y0 = x.min(), y.min()
+    cx = ((x - x0) // celda_m).astype(np.int64)
+    cy = ((y - y0) // celda_m).astype(np.int64)
+    columnas = int(cx.max()) + 1
+    celdas, celda = np.unique(cy * columnas + cx, return_inverse=True)
+    centro_x = x0 + (celdas % columnas + 0.5) * celda_m
+    centro_y = y0 + (celdas // columnas + 0.5) * celda_m
+
+    filas, puntos = [], []
+    paso = max(1, MAX_PARES // xs.size)
+    for i in range(0, celdas.size, paso):
+        d = np.hypot(xs[None, :] - centro_x[i:i + paso, None], ys[None, :] - centro_y[i:i + paso, None])
+        cota = np.partition(d, k - 1, axis=1)[:, k - 1] + np.sqrt(2) * celda_m + HOLGURA_M
+        f, p = np.nonzero(d <= cota[:, None])
+        filas.append(f + i)
+        puntos.append(p)
+    filas, puntos = np.concatenate(filas), np.concatenate(puntos)
+
+    # filas viene ordenada: posición de cada candidato dentro de su celda
+    primeros = np.searchsorted(filas, np.arange(celdas.size))
+    cuenta = np.diff(np.append(primeros, filas.size))
+    candidatos = np.full((celdas.size, int(cuenta.max())), -1, dtype=np.int64)
+    candidatos[filas, np.arange(filas.size) - np.repeat(primeros, cuenta)] = puntos
+    return celda, candidatos
+
+
+def _k_por_celdas(x, y, xs, ys, k):
+    """Los k de (xs, ys) más cercanos a cada consulta, mirando solo los candidatos de su celda."""
+    celda, candidatos = _candidatos_por_celda(x, y, xs, ys, k)
+    idx = np.empty((x.size, k), dtype=np.int64)
+    paso = max(1, MAX_PARES // candidatos.shape[1])
+    for i in range(0, x.size, paso):
+        cand = candidatos[celda[i:i + paso]]
+        # Se ordena por la distancia plana sin corregir: entre candidatos
+        # cercanos la escala UTM cambia en menos de 1e-5, así que solo
+        # cambiaría el orden de empates a menos de 1 cm
+        dx, dy = xs[cand] - x[i:i + paso, None], ys[cand] - y[i:i + paso, None]
+        d2 = dx * dx + dy * dy
+        d2[cand < 0] = np.inf
+        if k == 1:
+            col = d2.argmin(axis=1)[:, None]
+        elif cand.shape[1] > k:
+            col = np.argpartition(d2, k - 1, axis=1)[:, :k]
+            col = np.take_along_axis(col, np.take_along_axis(d2, col, axis=1).argsort(axis=1), axis=1)
+        else:
+            col = d2.argsort(axis=1)
+        idx[i:i + paso] = np.take_along_axis(cand, col, axis=1)
+    # Distancias corregidas solo de los k elegidos
+    return idx, distancia_plana(x[:, None], y[:, None], xs[idx], ys[idx])
+
+
+def _lote(lats, lons, capas, k, carpeta):
+    """{capa: (índices, distancias)} de un bloque de consultas, en un proceso del pool."""
+    x, y = a_utm(lats, lons)
+    resultado = {}
+    for capa in capas:
+        xs, ys = coordenadas_utm(CAPAS_SERVICIOS[capa], carpeta)
+        k_capa = min(k, xs.size)
+        if xs.size > MAX_CENTROS_CELDAS:
+            idx, dist = indice_utm_para(CAPAS_SERVICIOS[capa], carpeta).k_vecinos(lats, lons, k=k_capa)
+        elif k_capa and x.size:
+            idx, dist = _k_por_celdas(x, y, xs, ys, k_capa)
+        else:
+            idx, dist = np.full((x.size, k_capa), -1), np.full((x.size, k_capa), np.nan)
+        resultado[capa] = idx.astype(np.int32), dist.astype(np.float32)
+    return resultado
+
+
+def mas_cercanos_lote(lats, lons, capas=None, k: int = 1, procesos: int = 1,
+                      tam_lote: int = TAM_LOTE, carpeta: str = CARPETA_CSV) -> dict:
+    """Los k centros más cercanos de cada capa para cada punto.
+
+    Devuelve {capa: (índices, distancias)} con arrays (n, k) ordenados de
+    menor a mayor distancia; los índices son filas de cargar_csv(capa). Los
+    puntos sin coordenadas dan -1 y NaN.
+    """
+    capas = list(capas or CAPAS_SERVICIOS)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    validas = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+    # Bloques de puntos cercanos entre sí (por zonas de ~1 km): cada uno toca
+    # pocas celdas y las celdas se llenan
+    zona = np.round(lats[validas] * 100).astype(np.int64) * 100_000 + np.round(lons[validas] * 100).astype(np.int64)
+    validas = validas[np.argsort(zona, kind="stable")]
+    bloques = [validas[i:i + tam_lote] for i in range(0, validas.size, tam_lote)]
+
+    # Coordenadas e índices calculados antes de abrir el pool: con fork los
+    # procesos los heredan
+    for capa in capas:
+        if len(coordenadas_utm(CAPAS_SERVICIOS[capa], carpeta)[0]) > MAX_CENTROS_CELDAS:
+            indice_utm_para(CAPAS_SERVICIOS[capa], carpeta)
+    argumentos = ([lats[b] for b in bloques], [lons[b] for b in bloques],
+                  [capas] * len(bloques), [k] * len(bloques), [carpeta] * len(bloques))
+    if procesos > 1 and len(bloques) > 1:
+        with ProcessPoolExecutor(max_workers=min(procesos, len(bloques))) as pool:
+            partes = list(pool.map(_lote, *argumentos))
+    else:
+        partes = list(map(_lote, *argumentos))
+
+    resultado = {}
+    for capa in capas:
+        k_capa = min(k, len(coordenadas_utm(CAPAS_SERVICIOS[capa], carpeta)[0]))
+        idx = np.full((lats.size, k_capa), -1, dtype=np.int32)
+        dist = np.full((lats.size, k_capa), np.nan, dtype=np.float32)
+        for b, parte in zip(bloques, partes):
+            idx[b], dist[b] = parte[capa]
+        resultado[capa] = idx, dist
+    return resultado
+
+
+def puntuar(df: pd.DataFrame, capas=None, k: int = 1, procesos: int = 1,
+            carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """df (con LATITUD/LONGITUD) con el nombre y la distancia de los k más cercanos por capa."""
+    cercanos = mas_cercanos_lote(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy(),
+                                 capas, k, procesos, carpeta=carpeta)
+    columnas = {}
+    for capa, (idx, dist) in cercanos.items():
+        centros = cargar_csv(CAPAS_SERVICIOS[capa], carpeta, columnas=["Nombre", "equipamien"])
+        # Categóricas: un código por fila en vez de un objeto str por fila
+        # (el -1 de los puntos sin coordenadas queda como nulo)
+        nombres, codigo = np.unique(nombre_centro(centros).to_numpy(dtype=str), return_inverse=True)
+        codigos = np.where(idx >= 0, codigo[idx], -1)
+        for j in range(idx.shape[1]):
+            columnas[f"{capa}_{j + 1}"] = pd.Categorical.from_codes(codigos[:, j], nombres)
+            columnas[f"{capa}_{j + 1}_m"] = dist[:, j].round(1)
+    return pd.concat([df.reset_index(drop=True), pd.DataFrame(columnas)], axis=1)
+
+
+def _guardar(df: pd.DataFrame, ruta: str):
+    tmp = ruta + ".tmp"
+    if ruta.endswith(".parquet"):
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, sep=";", index=False)
+    os.replace(tmp, ruta)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servicios más cercanos de cada punto de un CSV o Parquet.")
+    parser.add_argument("entrada")
+    parser.add_argument("--salida", help="CSV o Parquet (por defecto <entrada>.cercanos.parquet)")
+    parser.add_argument("--capas", nargs="+", choices=list(CAPAS_SERVICIOS), default=list(CAPAS_SERVICIOS))
+    parser.add_argument("-k", type=int, default=1, help="centros por capa")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--lat", help="columna de latitud")
+    parser.add_argument("--lon", help="columna de longitud")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    consultas = leer_consultas(args.entrada, args.lat, args.lon)
+    leido = time.perf_counter()
+    tabla = puntuar(consultas, args.capas, args.k, args.procesos)
+    calculado = time.perf_counter()
+    salida = args.salida or os.path.splitext(args.entrada)[0] + ".cercanos.parquet"
+    _guardar(tabla, salida)
+    print(f"{len(tabla)} puntos x {len(args.capas)} capas (k={args.k}): lectura {leido - inicio:.2f} s, "
+          f"cálculo {calculado - leido:.2f} s ({len(tabla) / max(calculado - leido, 1e-9):,.0f} puntos/s), "
+          f"total {time.perf_counter() - inicio:.2f} s -> {salida}")
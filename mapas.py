@@ -0,0 +1,530 @@
+# mapas.py  ·  mapas base de servicios, construidos y serializados una vez
+#
+# Construir el folium.Map con un Marker/Popup/Icon por fila y, sobre todo,
+# serializarlo (folium renderiza plantillas Jinja por cada elemento) cuesta
+# segundos con unos pocos miles de puntos. Aquí el resultado serializado se
+# guarda en la caché de Streamlit con clave (CSV, popup/tooltip de
+# info_util_por_archivo, tiles, hash del CSV) y se sirve tal cual en cada rerun.
+# Lo dinámico (clic, centro más cercano) va aparte en un FeatureGroup.
+#
+# Por encima de UMBRAL_MARCADORES_RAPIDOS filas (configurable con la variable
+# de entorno EDM_UMBRAL_MARCADORES) los marcadores se crean en el navegador con
+# FastMarkerCluster: un único array de datos y una plantilla JS de popup
+# compartida, en vez de un Marker/Popup/Icon de Python por fila.
+#
+# Con EDM_TESELAS=1 los mapas de servicios no llevan los datos: cargan la capa
+# como teselas vectoriales del servidor local de teselas.py y el navegador
+# pide solo las que ve.
+import copy
+import hashlib
+import json
+import logging
+import os
+
+import folium
+from folium.plugins import FastMarkerCluster, MarkerCluster, VectorGridProtobuf
+from folium.template import Template
+import streamlit as st
+import streamlit.components.v1 as components
+from streamlit_folium import st_folium
+
+from datos import cargar_csv, huella_csv
+
+UMBRAL_MARCADORES_RAPIDOS = int(os.environ.get("EDM_UMBRAL_MARCADORES", 1000))
+# Carpeta que Streamlit sirve como estáticos y su URL relativa a la página
+CARPETA_ESTATICOS = "./static"
+URL_ESTATICOS = os.environ.get("EDM_URL_ESTATICOS", "app/static")
+TESELAS = os.environ.get("EDM_TESELAS", "").lower() not in ("", "0", "no")
+# CSV cuyas filas son polígonos: en modo teselas se dibujan como tales
+COLUMNAS_POLIGONOS = {"barris-policials.csv": "geo_shape", "vulnerabilidad-por-barrios.csv": "Geo Shape"}
+ESTILO_PUNTO_TESELAS = {"radius": 6, "fill": True, "fillColor": "#436978", "fillOpacity": 0.9,
+                        "color": "white", "weight": 1}
+ESTILO_POLIGONO_TESELAS = {"fill": True, "fillColor": "#436978", "fillOpacity": 0.3,
+                           "color": "#436978", "weight": 1}
+
+# st_folium vuelve a serializar el mapa entero en cada llamada. Para servir la
+# versión cacheada se llama directamente al componente con las mismas piezas
+# que genera st_folium. Son nombres privados de streamlit_folium (probado con
+# 0.27.x, fijado en requirements.txt): si la versión instalada no los expone o
+# han cambiado de firma, se usa st_folium.
+try:
+    from streamlit_folium import (
+        _component_func, _get_feature_group_string, _get_header, _get_html,
+        _get_map_string, generate_js_hash, get_full_id,
+    )
+    import branca
+    _COMPONENTE_DIRECTO = True
+except ImportError:
+    _COMPONENTE_DIRECTO = False
+# Errores que indican que los nombres privados ya no encajan con la versión
+_ERRORES_COMPONENTE = (TypeError, AttributeError, KeyError)
+registro = logging.getLogger("edm.mapas")
+
+
+# ---------- CONSTRUCCIÓN ----------
+def construir_mapa_servicios(df, info_util, tiles="OpenStreetMap", modo="auto") -> folium.Map:
+    """modo: "marcadores" (un Marker por fila), "rapido" (FastMarkerCluster), "auto"
+    o "encuadre" (sin marcadores: los pone encuadre.capa_encuadre según la vista)."""
+    mapa = folium.Map(location=[df['LATITUD'].mean(), df['LONGITUD'].mean()], zoom_start=13, tiles=tiles)
+    if modo == "encuadre":
+        return mapa
+    if modo == "auto":
+        modo = "rapido" if len(df) > UMBRAL_MARCADORES_RAPIDOS else "marcadores"
+    if modo == "rapido":
+        cluster_rapido(df, info_util).add_to(mapa)
+        return mapa
+
+    marker_cluster = MarkerCluster().add_to(mapa)
+    for row in df.itertuples():
+        popup_parts = []
+        for col in info_util["popup"]:
+            valor = getattr(row, col, "N/D")
+            popup_parts.append(f"<strong>{col}:</strong> {valor}")
+        popup_html = "<br>".join(popup_parts)
+        tooltip_val = getattr(row, info_util["tooltip"], "")
+        folium.Marker(
+            location=[row.LATITUD, row.LONGITUD],
+            popup=folium.Popup(popup_html, max_width=300),
+            tooltip=tooltip_val,
+            icon=folium.Icon(color="cadetblue", icon="info-sign")
+        ).add_to(marker_cluster)
+
+    return mapa
+
+
+# Plantilla JS compartida por todos los marcadores: mismo icono que
+# folium.Icon(color="cadetblue", icon="info-sign") y el popup se compone al
+# abrirlo a partir de los valores de la fila
+_CALLBACK_RAPIDO = """(function () {
+    var campos = %(campos)s;
+    var iTooltip = %(i_tooltip)d;
+    var icono = L.AwesomeMarkers.icon({
+        "extraClasses": "fa-rotate-0", "icon": "info-sign", "iconColor": "white",
+        "markerColor": "cadetblue", "prefix": "glyphicon"
+    });
+    return function (row) {
+        var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icono});
+        marker.bindPopup(function () {
+            var partes = [];
+            for (var i = 0; i < campos.length; i++) {
+                partes.push("<strong>" + campos[i] + ":</strong> " + row[2 + i]);
+            }
+            return partes.join("<br>");
+        }, {maxWidth: 300});
+        if (iTooltip >= 0) {
+            marker.bindTooltip("<div>" + row[2 + iTooltip] + "</div>", {sticky: true});
+        }
+        return marker;
+    };
+})()"""
+
+
+class _ClusterRapido(FastMarkerCluster):
+    # Igual que FastMarkerCluster, pero los datos (ya floats válidos) se
+    # codifican a JSON una sola vez en vez de validarse y codificarse fila a
+    # fila en cada render
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.callback }}
+
+                var data = {{ this.data_json }};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+
+                for (var i = 0; i < data.length; i++) {
+                    var row = data[i];
+                    var marker = callback(row);
+                    marker.addTo(cluster);
+                }
+
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, data, callback):
+        super().__init__([], callback=callback)
+        self.data = data
+        self.data_json = json.dumps(data)
+
+
+def filas_marcadores(df, info_util):
+    """Filas [lat, lon, campos del popup (+ tooltip)] para _CALLBACK_RAPIDO."""
+    campos = list(info_util["popup"])
+    tooltip = info_util["tooltip"]
+    columnas = [df[col].astype(str).tolist() if col in df.columns else ["N/D"] * len(df)
+                for col in campos]
+    # El tooltip reutiliza la columna del popup si ya está incluida
+    if tooltip not in df.columns:
+        i_tooltip = -1
+    elif tooltip in campos:
+        i_tooltip = campos.index(tooltip)
+    else:
+        i_tooltip = len(campos)
+        columnas.append(df[tooltip].astype(str).tolist())
+
+    data = list(zip(df["LATITUD"].tolist(), df["LONGITUD"].tolist(), *columnas))
+    callback = _CALLBACK_RAPIDO % {"campos": json.dumps(campos), "i_tooltip": i_tooltip}
+    return data, callback
+
+
+def cluster_rapido(df, info_util) -> FastMarkerCluster:
+    return _ClusterRapido(*filas_marcadores(df, info_util))
+
+
+# ---------- TESELAS VECTORIALES ----------
+class _CapaTeselas(VectorGridProtobuf):
+    # VectorGrid no tiene popups ni tooltips por elemento: se montan con los
+    # eventos de la capa a partir de las propiedades de la tesela
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }}, {{ this.opciones }}
+            );
+            (function (capa) {
+                var popup = {{ this.popup|tojson }};
+                var tooltip = {{ this.tooltip|tojson }};
+                function texto(p, campos) {
+                    if (campos.length === 1) return String(p[campos[0]] === undefined ? "" : p[campos[0]]);
+                    return campos.map(function (c) {
+                        return "<strong>" + c + ":</strong> " + (p[c] === undefined ? "N/D" : p[c]);
+                    }).join("<br>");
+                }
+                if (popup.length) {
+                    capa.on("click", function (e) {
+                        L.popup({maxWidth: 300}).setLatLng(e.latlng)
+                            .setContent(texto(e.layer.properties, popup)).openOn(capa._map);
+                    });
+                }
+                if (tooltip.length) {
+                    var etiqueta = L.tooltip({sticky: true});
+                    capa.on("mouseover", function (e) {
+                        etiqueta.setLatLng(e.latlng).setContent(texto(e.layer.properties, tooltip));
+                        capa._map.openTooltip(etiqueta);
+                    });
+                    capa.on("mouseout", function () { capa._map.closeTooltip(etiqueta); });
+                }
+            })({{ this.get_name() }});
+        {% endmacro %}"""
+    )
+
+    def __init__(self, url, nombre_capa, estilo, popup=(), tooltip=(), name=None):
+        from teselas import ZOOM_MAX
+        super().__init__(url, name=name)
+        self.popup, self.tooltip = list(popup), list(tooltip)
+        # El estilo puede ser un dict o una función JS (texto) por elemento
+        estilo = estilo if isinstance(estilo, str) else json.dumps(estilo)
+        self.opciones = '{"vectorTileLayerStyles": {%s: %s}, "interactive": true, "maxNativeZoom": %d}' % (
+            json.dumps(nombre_capa), estilo, ZOOM_MAX)
+
+
+def propiedades_teselas(archivo_csv, info_util):
+    """(propiedades, columna de polígonos o None) de la capa de teselas de un CSV."""
+    columnas = list(dict.fromkeys([*info_util["popup"], info_util["tooltip"]]))
+    return {col: col for col in columnas}, COLUMNAS_POLIGONOS.get(archivo_csv)
+
+
+def capa_teselas(archivo_csv, propiedades, columna_geo=None, estilo=None, popup=(), tooltip=(),
+                 name=None) -> _CapaTeselas:
+    """Capa de teselas vectoriales del CSV, servidas por teselas.py."""
+    from teselas import iniciar_servidor, url_teselas
+    iniciar_servidor()
+    if estilo is None:
+        estilo = ESTILO_POLIGONO_TESELAS if columna_geo else ESTILO_PUNTO_TESELAS
+    return _CapaTeselas(url_teselas(archivo_csv, propiedades, columna_geo),
+                        os.path.splitext(archivo_csv)[0], estilo, popup, tooltip, name)
+
+
+def _mapa_de_csv(archivo_csv, popup, tooltip, tiles, modo):
+    info_util = {"popup": list(popup), "tooltip": tooltip}
+    if modo == "teselas":
+        df = cargar_csv(archivo_csv, columnas=())
+        mapa = construir_mapa_servicios(df, info_util, tiles, "encuadre")
+        capa_teselas(archivo_csv, *propiedades_teselas(archivo_csv, info_util),
+                     popup=popup, tooltip=[tooltip]).add_to(mapa)
+        return mapa
+    df = cargar_csv(archivo_csv, columnas=[*popup, tooltip])
+    return construir_mapa_servicios(df, info_util, tiles, modo)
+
+
+def _modo(modo):
+    if modo == "auto" and TESELAS:
+        modo = "teselas"
+    if modo == "teselas":
+        # Si el mapa sale de la caché, capa_teselas no llega a llamarse
+        from teselas import iniciar_servidor
+        iniciar_servidor()
+    return modo
+
+
+# ---------- HTML ESTÁTICO (equivalente a folium_static) ----------
+@st.cache_data(show_spinner=False, max_entries=32)
+def _html_servicios(archivo_csv, popup, tooltip, tiles, modo, umbral, huella):
+    mapa = _mapa_de_csv(archivo_csv, popup, tooltip, tiles, modo)
+    return folium.Figure().add_child(mapa).render()
+
+
+def html_mapa_servicios(archivo_csv, info_util, tiles="OpenStreetMap", modo="auto") -> str:
+    return _html_servicios(archivo_csv, tuple(info_util["popup"]), info_util["tooltip"],
+                           tiles, _modo(modo), UMBRAL_MARCADORES_RAPIDOS, huella_csv(archivo_csv))
+
+
+def mostrar_html(html, width=1100, height=600):
+    components.html(html, height=height + 10, width=width)
+
+
+# ---------- MAPA POR CAPAS (carga perezosa) ----------
+# Un solo mapa con una capa por CSV en el LayerControl. Los datos de cada capa
+# se escriben como JSON en ./static/capas (servido por Streamlit con
+# server.enableStaticServing, ver .streamlit/config.toml) y el navegador los
+# descarga la primera vez que se activa la capa. Activar o desactivar capas no
+# pasa por Python.
+class _CapaPerezosa(MarkerCluster):
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.markerClusterGroup(
+                {{ this.options|tojavascript }}
+            );
+            (function (capa) {
+                var crear = {{ this.callback }};
+                var estado = "vacia";
+                capa.on("add", function () {
+                    if (estado !== "vacia") return;
+                    estado = "cargando";
+                    fetch({{ this.url|tojson }})
+                        .then(function (r) {
+                            if (!r.ok) throw new Error(r.status + " " + r.statusText);
+                            return r.json();
+                        })
+                        .then(function (filas) {
+                            capa.addLayers(filas.map(crear));
+                            estado = "cargada";
+                        })
+                        .catch(function (e) {
+                            estado = "vacia";
+                            console.error("No se pudo cargar la capa {{ this.layer_name }}:", e);
+                        });
+                });
+            })({{ this.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, url, callback, name, show=False):
+        super().__init__(name=name, show=show)
+        self.url = url
+        self.callback = callback
+
+
+def url_capa(archivo_csv, info_util) -> str:
+    """Escribe (si no existe ya) el JSON de la capa y devuelve su URL."""
+    firma = json.dumps([list(info_util["popup"]), info_util["tooltip"]], ensure_ascii=False)
+    nombre = "%s.%s.%s.json" % (os.path.splitext(archivo_csv)[0], huella_csv(archivo_csv)[:12],
+                                hashlib.sha1(firma.encode("utf-8")).hexdigest()[:8])
+    ruta = os.path.join(CARPETA_ESTATICOS, "capas", nombre)
+    if not os.path.exists(ruta):
+        df = cargar_csv(archivo_csv, columnas=[*info_util["popup"], info_util["tooltip"]])
+        data, _ = filas_marcadores(df, info_util)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, ruta)
+    return f"{URL_ESTATICOS}/capas/{nombre}"
+
+
+def construir_mapa_capas(capas, visibles=(), tiles="OpenStreetMap") -> folium.Map:
+    """capas: lista de (nombre, archivo_csv, popup, tooltip, url)."""
+    medias = [cargar_csv(archivo, columnas=())[["LATITUD", "LONGITUD"]].mean() for _, archivo, *_ in capas]
+    centro = [sum(m["LATITUD"] for m in medias) / len(medias),
+              sum(m["LONGITUD"] for m in medias) / len(medias)]
+    mapa = folium.Map(location=centro, zoom_start=13, tiles=tiles)
+    for nombre, archivo, popup, tooltip, url in capas:
+        # El callback solo depende de los campos: se genera sin leer los datos
+        df = cargar_csv(archivo, columnas=[*popup, tooltip]).iloc[:0]
+        _, callback = filas_marcadores(df, {"popup": popup, "tooltip": tooltip})
+        _CapaPerezosa(url, callback, name=nombre, show=nombre in visibles).add_to(mapa)
+    folium.LayerControl(collapsed=False).add_to(mapa)
+    return mapa
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _html_capas(capas, visibles, tiles):
+    return folium.Figure().add_child(construir_mapa_capas(capas, visibles, tiles)).render()
+
+
+def html_mapa_capas(capas: dict, info_util_por_archivo: dict, visibles=(), tiles="OpenStreetMap") -> str:
+    """capas: {nombre en el LayerControl: archivo CSV}, como opciones_selector."""
+    config = []
+    for nombre, archivo in capas.items():
+        info_util = info_util_por_archivo[os.path.splitext(archivo)[0]]
+        # La URL lleva el hash del CSV: si cambian los datos cambia el HTML
+        config.append((nombre, archivo, tuple(info_util["popup"]), info_util["tooltip"],
+                       url_capa(archivo, info_util)))
+    return _html_capas(tuple(config), tuple(visibles), tiles)
+
+
+# ---------- MAPA INTERACTIVO (equivalente a st_folium) ----------
+def _enlaces(mapa):
+    # Igual que st_folium: CSS/JS que necesitan los plugins del mapa
+    def walk(fig):
+        if isinstance(fig, branca.colormap.ColorMap):
+            yield fig
+        if isinstance(fig, folium.elements.JSCSSMixin):
+            yield fig
+        if hasattr(fig, "_children"):
+            for child in fig._children.values():
+                yield from walk(child)
+
+    css_links, js_links = [], []
+    for elem in walk(mapa):
+        if isinstance(elem, branca.colormap.ColorMap):
+            js_links.insert(0, "https://cdnjs.cloudflare.com/ajax/libs/d3/3.5.5/d3.min.js")
+            js_links.insert(0, "https://d3js.org/d3.v4.min.js")
+        css_links.extend([href for _, href in getattr(elem, "default_css", [])])
+        js_links.extend([src for _, src in getattr(elem, "default_js", [])])
+    return list(dict.fromkeys(css_links)), list(dict.fromkeys(js_links))
+
+
+def _limites(mapa):
+    # FastMarkerCluster no guarda los puntos, así que get_bounds() no los ve
+    (sur, oeste), (norte, este) = mapa.get_bounds()
+    for hijo in mapa._children.values():
+        if isinstance(hijo, FastMarkerCluster) and hijo.data:
+            lats = [fila[0] for fila in hijo.data] + [v for v in (sur, norte) if v is not None]
+            lons = [fila[1] for fila in hijo.data] + [v for v in (oeste, este) if v is not None]
+            sur, norte, oeste, este = min(lats), max(lats), min(lons), max(lons)
+    return [[sur, oeste], [norte, este]]
+
+
+def serializar_mapa(mapa: folium.Map) -> dict:
+    """Todo lo que st_folium envía al navegador, calculado una sola vez.
+
+    Conserva el mapa para volver a st_folium si el componente directo falla.
+    """
+    if not _COMPONENTE_DIRECTO:
+        return {"mapa": mapa}
+
+    try:
+        mapa.get_root().render()
+        mapa.render()
+        html = _get_html(mapa)
+        header = _get_header(mapa)
+        leaflet = _get_map_string(mapa)
+        ident = get_full_id(mapa)
+        hash_script = generate_js_hash(leaflet)
+    except _ERRORES_COMPONENTE as e:
+        _desactivar_componente(e)
+        return {"mapa": mapa}
+    (sw_lat, sw_lng), (ne_lat, ne_lng) = _limites(mapa)
+    css_links, js_links = _enlaces(mapa)
+    return {
+        "mapa": mapa,
+        "script": leaflet,
+        "header": header,
+        "html": html,
+        "id": ident,
+        # Base de la clave del componente; la de cada widget se deriva con su key
+        "hash_script": hash_script,
+        "bounds": {"_southWest": {"lat": sw_lat, "lng": sw_lng},
+                   "_northEast": {"lat": ne_lat, "lng": ne_lng}},
+        "zoom": mapa.options.get("zoom"),
+        "css_links": css_links,
+        "js_links": js_links,
+    }
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _plantilla_servicios(archivo_csv, popup, tooltip, tiles, modo, umbral, huella):
+    return serializar_mapa(_mapa_de_csv(archivo_csv, popup, tooltip, tiles, modo))
+
+
+def plantilla_mapa_servicios(archivo_csv, info_util, tiles="OpenStreetMap", modo="auto") -> dict:
+    return _plantilla_servicios(archivo_csv, tuple(info_util["popup"]), info_util["tooltip"],
+                                tiles, _modo(modo), UMBRAL_MARCADORES_RAPIDOS, huella_csv(archivo_csv))
+
+
+def st_folium_plantilla(plantilla, key, height=700, width=500, feature_group_to_add=None,
+                        returned_objects=None, zoom=None, center=None):
+    """Como st_folium, pero sobre un mapa ya serializado con serializar_mapa()."""
+    if _COMPONENTE_DIRECTO and "script" in plantilla:
+        try:
+            return _componente_directo(plantilla, key, height, width, feature_group_to_add,
+                                       returned_objects, zoom, center)
+        except _ERRORES_COMPONENTE as e:
+            _desactivar_componente(e)
+    # st_folium añade las capas al mapa que recibe: nunca el de la plantilla,
+    # que comparten todas las sesiones
+    return st_folium(copy.deepcopy(plantilla["mapa"]), key=key, height=height, width=width,
+                     feature_group_to_add=feature_group_to_add,
+                     returned_objects=returned_objects, zoom=zoom, center=center)
+
+
+def _desactivar_componente(error):
+    global _COMPONENTE_DIRECTO
+    _COMPONENTE_DIRECTO = False
+    registro.warning("streamlit_folium no admite la llamada directa al componente (%r); se usa st_folium", error)
+
+
+def _componente_directo(plantilla, key, height, width, feature_group_to_add, returned_objects, zoom, center):
+    defaults = {
+        "last_clicked": None,
+        "last_object_clicked": None,
+        "last_object_clicked_count": None,
+        "last_object_clicked_tooltip": None,
+        "last_object_clicked_popup": None,
+        "all_drawings": None,
+        "last_active_drawing": None,
+        "bounds": plantilla["bounds"],
+        "zoom": plantilla["zoom"],
+        "last_circle_radius": None,
+        "last_circle_polygon": None,
+        "selected_layers": None,
+        "selected_tags": None,
+        "last_geocoder_result": None,
+    }
+    if returned_objects is not None:
+        defaults = {k: v for k, v in defaults.items() if k in returned_objects}
+
+    # Solo las capas dinámicas se serializan en cada rerun, sobre un mapa vacío
+    feature_group_string = None
+    if feature_group_to_add is not None:
+        if isinstance(feature_group_to_add, folium.FeatureGroup):
+            feature_group_to_add = [feature_group_to_add]
+        auxiliar = folium.Map(tiles=None)
+        feature_group_string = "".join(
+            _get_feature_group_string(fg, map=auxiliar, idx=i)
+            for i, fg in enumerate(feature_group_to_add)
+        )
+
+    # Sin escribir en la plantilla compartida: la clave sale de un hash ya calculado
+    hash_key = hashlib.sha256(f"{plantilla['hash_script']}.{key}".encode("utf-8")).hexdigest()
+
+    def _on_change():
+        st.session_state[key] = st.session_state.get(hash_key, {})
+
+    return _component_func(
+        script=plantilla["script"],
+        header=plantilla["header"],
+        html=plantilla["html"],
+        id=plantilla["id"],
+        key=hash_key,
+        height=height,
+        width=width,
+        returned_objects=returned_objects,
+        default=defaults,
+        zoom=zoom,
+        center=center,
+        feature_group=feature_group_string,
+        return_on_hover=False,
+        layer_control=None,
+        pixelated=False,
+        css_links=plantilla["css_links"],
+        js_links=plantilla["js_links"],
+        on_change=_on_change,
+        wrap_longitude=False,
+    )
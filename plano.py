@@ -0,0 +1,207 @@
+# plano.py  ·  distancias en metros UTM (huso 30N, ETRS89)
+#
+# Los CSV de equipamientos traen x/y (hospitales.csv, X/Y) en UTM 30N, el
+# sistema oficial del Ayuntamiento. Con esas coordenadas las distancias,
+# radios y rejillas son operaciones euclídeas sobre arrays, sin trigonometría
+# por par. Donde faltan (o no cuadran con geo_point_2d, que es lo que se
+# dibuja en el mapa) se proyecta lat/lon con las series de Krüger.
+#
+# Precisión: la distancia plana se divide por el factor de escala UTM en el
+# punto medio (en València ~1.00023, es decir 23 cm por km sin corregir).
+# Dentro de la ciudad (~10 km) difiere de la geodésica de geopy en menos de
+# 1 cm; en pares de hasta ~250 km, en menos de 6 m (ver
+# comprobar_precision() o `python plano.py`, que además dice cuántos x/y de
+# cada CSV se usan).
+import os
+
+import numpy as np
+
+import cercania
+from cercania import A_WGS84, mas_cercanos
+from datos import CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from indice_espacial import MARGEN, IndiceRejilla
+
+# Elipsoide GRS80 (ETRS89): el mismo semieje que WGS84
+F_GRS80 = 1 / 298.257222101
+K0 = 0.9996
+LON_CENTRAL = -3.0
+FALSO_ESTE = 500000.0
+# Diferencia máxima entre los x/y del CSV y geo_point_2d proyectado para
+# usar los del CSV
+TOLERANCIA_XY_M = 5.0
+# Columnas con coordenadas UTM en los CSV de ./data/csv
+COLUMNAS_XY = (("x", "y"), ("X", "Y"))
+
+_N = F_GRS80 / (2 - F_GRS80)
+_E = 2 * np.sqrt(_N) / (1 + _N)
+# Radio rectificador y coeficientes de Krüger hasta n⁴ (error < 1 mm)
+_A = A_WGS84 / (1 + _N) * (1 + _N ** 2 / 4 + _N ** 4 / 64)
+_ALFA = (
+    _N / 2 - 2 * _N ** 2 / 3 + 5 * _N ** 3 / 16 + 41 * _N ** 4 / 180,
+    13 * _N ** 2 / 48 - 3 * _N ** 3 / 5 + 557 * _N ** 4 / 1440,
+    61 * _N ** 3 / 240 - 103 * _N ** 4 / 140,
+    49561 * _N ** 4 / 161280,
+)
+
+# ruta CSV -> (sha1, (x, y))
+_coordenadas = CacheVersiones()
+# ruta CSV -> (sha1, IndiceUTM)
+_indices = CacheVersiones()
+
+
+# ---------- proyección ----------
+def a_utm(lats, lons):
+    """(x, y) en metros UTM 30N de cada (lat, lon)."""
+    phi = np.radians(np.asarray(lats, dtype=float))
+    lam = np.radians(np.asarray(lons, dtype=float) - LON_CENTRAL)
+    sen = np.sin(phi)
+    t = np.sinh(np.arctanh(sen) - _E * np.arctanh(_E * sen))
+    xi = np.arctan2(t, np.cos(lam))
+    eta = np.arctanh(np.sin(lam) / np.sqrt(1 + t ** 2))
+    x, y = eta.copy(), xi.copy()
+    for j, alfa in enumerate(_ALFA, start=1):
+        x += alfa * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+        y += alfa * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+    return FALSO_ESTE + K0 * _A * x, K0 * _A * y
+
+
+def _radio(y):
+    # Radio medio de curvatura a la latitud de y (la rectificadora basta)
+    sen2 = np.sin(np.asarray(y, dtype=float) / (K0 * _A)) ** 2
+    e2 = F_GRS80 * (2 - F_GRS80)
+    return A_WGS84 * np.sqrt(1 - e2) / (1 - e2 * sen2)
+
+
+def _escala(x, radio):
+    u2 = ((x - FALSO_ESTE) / (K0 * radio)) ** 2
+    return K0 * (1 + u2 / 2 + u2 * u2 / 24)
+
+
+def escala_utm(x, y):
+    """Factor de escala UTM en (x, y): distancia plana / distancia real."""
+    return _escala(np.asarray(x, dtype=float), _radio(y))
+
+
+# ---------- distancias ----------
+def distancia_plana(x, y, xs, ys) -> np.ndarray:
+    """Distancia en metros entre (x, y) y cada punto de (xs, ys), en UTM.
+
+    Misma interfaz (broadcasting) que cercania.distancia_m.
+    """
+    dx, dy = np.subtract(xs, x), np.subtract(ys, y)
+    # Escala en el punto medio. El radio, con la latitud media de las
+    # consultas: a ±1° de latitud cambia la escala en menos de 1e-7. Sin
+    # consultas (un bloque vacío del índice) no hay media
+    escala = _escala(np.add(x, xs) / 2, _radio(np.mean(y) if np.size(y) else 0.0))
+    return np.sqrt(dx * dx + dy * dy) / escala
+
+
+def mas_cercanos_plano(x, y, xs, ys, k: int = 1):
+    """Los k puntos de (xs, ys) más cercanos. Misma interfaz que cercania.mas_cercanos."""
+    return mas_cercanos(x, y, xs, ys, k, distancia=distancia_plana)
+
+
+# ---------- coordenadas de cada CSV ----------
+def _xy_csv(df, x_proy, y_proy):
+    """x/y del CSV donde existen y cuadran con geo_point_2d; si no, los proyectados."""
+    x, y = x_proy.copy(), y_proy.copy()
+    for col_x, col_y in COLUMNAS_XY:
+        if col_x in df.columns and col_y in df.columns:
+            x_csv = df[col_x].to_numpy(dtype=float, na_value=np.nan)
+            y_csv = df[col_y].to_numpy(dtype=float, na_value=np.nan)
+            with np.errstate(invalid="ignore"):
+                usar = np.hypot(x_csv - x_proy, y_csv - y_proy) <= TOLERANCIA_XY_M
+            x[usar], y[usar] = x_csv[usar], y_csv[usar]
+            return x, y, usar
+    return x, y, np.zeros(x.size, dtype=bool)
+
+
+def coordenadas_utm(archivo_csv: str, carpeta: str = CARPETA_CSV):
+    """(x, y) en UTM 30N de cada fila de cargar_csv(archivo_csv), de solo lectura."""
+    clave, sha1 = os.path.abspath(os.path.join(carpeta, archivo_csv)), huella_csv(archivo_csv, carpeta)
+    xy = _coordenadas.buscar(clave, sha1)
+    if xy is None:
+        df = cargar_csv(archivo_csv, carpeta, columnas=[c for par in COLUMNAS_XY for c in par])
+        x, y, _ = _xy_csv(df, *a_utm(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy()))
+        x.setflags(write=False)
+        y.setflags(write=False)
+        xy = _coordenadas.guardar(clave, sha1, (x, y))
+    return xy
+
+
+# ---------- índice de rejilla en UTM ----------
+class IndiceUTM(IndiceRejilla):
+    """IndiceRejilla con la rejilla en UTM y distancias de distancia_plana.
+
+    Las consultas siguen siendo en lat/lon. Solo en memoria (indice_utm_para):
+    construirlo cuesta poco más que proyectar las consultas.
+    """
+
+    def __init__(self, lats, lons, celda_m: float = None, xy=None):
+        x, y = a_utm(lats, lons) if xy is None else xy
+        self.x, self.y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        super().__init__(lats, lons, celda_m, (self.x, self.y))
+
+    def _proyectar(self, lats, lons):
+        return a_utm(lats, lons)
+
+    def _distancia(self, x, y, lat, lon, punto):
+        return distancia_plana(x, y, self.x[punto], self.y[punto])
+
+    def _escala(self, lats_consulta, xs_consulta=()):
+        # La escala crece con la distancia al meridiano central: se acota con
+        # el borde de la rejilla más alejado (o la consulta, si está más lejos)
+        bordes = [self.x_min, self.x_min + self.nx * self.celda_m, *np.atleast_1d(xs_consulta)]
+        lejos = FALSO_ESTE + np.abs(np.asarray(bordes) - FALSO_ESTE).max()
+        return MARGEN / float(escala_utm(lejos, self.y_min))
+
+    def _rectangulo(self, sur, oeste, norte, este):
+        # En UTM los paralelos son curvos: borde de la caja muestreado
+        t = np.linspace(0.0, 1.0, 9)
+        lats = np.concatenate([np.full(9, sur), np.full(9, norte), sur + (norte - sur) * t, sur + (norte - sur) * t])
+        lons = np.concatenate([oeste + (este - oeste) * t, oeste + (este - oeste) * t, np.full(9, oeste), np.full(9, este)])
+        x, y = self._proyectar(lats, lons)
+        return x.min() - self.celda_m, x.max() + self.celda_m, y.min() - self.celda_m, y.max() + self.celda_m
+
+    def con_cambios(self, origen, lats_nuevas, lons_nuevas) -> "IndiceUTM":
+        """Índice tras los cambios (ver IndiceRejilla.con_cambios), conservando los x/y."""
+        origen = np.asarray(origen, dtype=np.int64)
+        nuevo = origen < 0
+        x, y = np.empty(origen.size), np.empty(origen.size)
+        x[~nuevo], y[~nuevo] = self.x[origen[~nuevo]], self.y[origen[~nuevo]]
+        x[nuevo], y[nuevo] = a_utm(lats_nuevas, lons_nuevas)
+        lats, lons = np.empty(origen.size), np.empty(origen.size)
+        lats[~nuevo], lons[~nuevo] = self.lats[origen[~nuevo]], self.lons[origen[~nuevo]]
+        lats[nuevo], lons[nuevo] = lats_nuevas, lons_nuevas
+        return IndiceUTM(lats, lons, self.celda_m, (x, y))
+
+
+def indice_utm_para(archivo_csv: str, carpeta: str = CARPETA_CSV) -> IndiceUTM:
+    """IndiceUTM de la capa con coordenadas_utm, construido una vez por contenido del CSV."""
+    clave, sha1 = os.path.abspath(os.path.join(carpeta, archivo_csv)), huella_csv(archivo_csv, carpeta)
+    indice = _indices.buscar(clave, sha1)
+    if indice is None:
+        df = cargar_csv(archivo_csv, carpeta, columnas=())
+        indice = _indices.guardar(clave, sha1, IndiceUTM(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy(),
+                                                         xy=coordenadas_utm(archivo_csv, carpeta)))
+    return indice
+
+
+# ---------- precisión ----------
+def _distancia_proyectada(lats1, lons1, lats2, lons2):
+    return distancia_plana(*a_utm(lats1, lons1), *a_utm(lats2, lons2))
+
+
+def comprobar_precision(n: int = 2000, radio_grados: float = 0.1, semilla: int = 0) -> float:
+    """Error máximo (m) de distancia_plana frente a geopy (cercania.comprobar_precision)."""
+    return cercania.comprobar_precision(n, radio_grados, semilla, distancia=_distancia_proyectada)
+
+
+if __name__ == "__main__":
+    for radio in (0.01, 0.1, 1.0):
+        print(f"radio {radio}°: error máximo frente a geopy = {comprobar_precision(radio_grados=radio):.6f} m")
+    for archivo in sorted(os.listdir(CARPETA_CSV)):
+        if archivo.endswith(".csv"):
+            df = cargar_csv(archivo, columnas=[c for par in COLUMNAS_XY for c in par])
+            _, _, usar = _xy_csv(df, *a_utm(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy()))
+            print(f"{archivo}: x/y del CSV en {usar.sum()} de {len(df)} filas")
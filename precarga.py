@@ -0,0 +1,177 @@
+# precarga.py  ·  cachés calientes antes de la primera visita
+#
+# En un proceso de Streamlit recién arrancado, la primera sesión paga todo:
+# leer los CSV (o sus Parquet), construir índices, tablas y rejillas y
+# serializar los mapas. Aquí se hace por adelantado:
+#
+#   python precarga.py                cachés de disco (./data/cache y
+#                                     ./static/capas), p. ej. al construir la
+#                                     imagen o antes de arrancar el servidor
+#   python precarga.py servir [APP]   además, las cachés en memoria de Streamlit
+#                                     (mapas serializados, HTML, gráficos) de
+#                                     las variantes que usa APP, y arranca el
+#                                     servidor en este mismo proceso: la primera
+#                                     sesión ya las encuentra. Por defecto APP
+#                                     es inicio.py, con todas las variantes.
+#
+# Los popup/tooltip y las capas de cada app se leen de su código fuente
+# (info_util_por_archivo y opciones_selector), sin ejecutarla.
+import argparse
+import ast
+import contextlib
+import logging
+import os
+import time
+
+from accesibilidad import CAPAS_SERVICIOS, tabla_accesibilidad
+from cobertura import rejilla_cobertura
+from datos import CARPETA_CSV, cargar_csv
+from indice_espacial import indice_para
+from union_espacial import asignar_barrios, conteo_por_barrio
+
+APPS_CON_MAPAS = ("app2.py", "app3.py", "app4.py", "app5.py")
+# Variantes que cada punto de entrada incluye
+VARIANTES = {"inicio.py": APPS_CON_MAPAS}
+
+
+def constante_app(app: str, nombre: str):
+    """Valor literal asignado a `nombre` en el código de la app (None si no está)."""
+    with open(app, encoding="utf-8") as f:
+        arbol = ast.parse(f.read(), filename=app)
+    for nodo in arbol.body:
+        if isinstance(nodo, ast.Assign) and any(getattr(t, "id", None) == nombre for t in nodo.targets):
+            return ast.literal_eval(nodo.value)
+    return None
+
+
+def _usa(app: str, texto: str) -> bool:
+    with open(app, encoding="utf-8") as f:
+        return texto in f.read()
+
+
+@contextlib.contextmanager
+def _sin_avisos_de_streamlit():
+    # Fuera de una sesión, cada función cacheada avisa de que no hay contexto
+    registros = [logging.getLogger(nombre) for nombre in logging.root.manager.loggerDict
+                 if nombre.startswith("streamlit")]
+    niveles = [r.level for r in registros]
+    for r in registros:
+        r.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        for r, nivel in zip(registros, niveles):
+            r.setLevel(nivel)
+
+
+# ---------- disco ----------
+def precargar_datos(apps=APPS_CON_MAPAS, carpeta: str = CARPETA_CSV):
+    """CSV en Parquet, índices, uniones, tablas, rejilla, geometrías, capas estáticas y red de calles."""
+    from geometria import capa_simplificada
+    from mapas import url_capa
+    from red import etiquetas_para, hay_red
+    from seccion_vulnerabilidad import ARCHIVO_VULNERABILIDAD, PROPIEDADES_BARRIOS
+
+    for archivo in sorted(os.listdir(carpeta)):
+        if archivo.endswith(".csv"):
+            cargar_csv(archivo, carpeta)
+    for capa, archivo in CAPAS_SERVICIOS.items():
+        indice_para(archivo, carpeta)
+        asignar_barrios(archivo, carpeta)
+        conteo_por_barrio({capa: archivo}, carpeta)
+    tabla_accesibilidad(carpeta=carpeta)
+    rejilla_cobertura(carpeta=carpeta)
+    capa_simplificada(ARCHIVO_VULNERABILIDAD, "Geo Shape", PROPIEDADES_BARRIOS, carpeta=carpeta)
+    for app in apps:
+        if _usa(app, "html_mapa_capas"):
+            info = constante_app(app, "info_util_por_archivo")
+            for archivo in constante_app(app, "opciones_selector").values():
+                url_capa(archivo, info.get(os.path.splitext(archivo)[0]))
+        if _usa(app, "mas_cercano_red") and hay_red():
+            for archivo in constante_app(app, "opciones_selector").values():
+                etiquetas_para(archivo, carpeta)
+
+
+# ---------- memoria (cachés de Streamlit) ----------
+def precargar_vistas(apps=APPS_CON_MAPAS):
+    """Lo que cada app cachea con st.cache_data / st.cache_resource."""
+    from cobertura import plantilla_cobertura
+    from encuadre import piramide_para
+    from mapas import TESELAS, html_mapa_capas, html_mapa_servicios, plantilla_mapa_servicios
+    from plano import indice_utm_para
+    import seccion_vulnerabilidad as sv
+
+    with _sin_avisos_de_streamlit():
+        for app in apps:
+            info = constante_app(app, "info_util_por_archivo") or {}
+            opciones = constante_app(app, "opciones_selector") or {}
+            for archivo in opciones.values():
+                info_util = info.get(os.path.splitext(archivo)[0])
+                if _usa(app, "plantilla_mapa_servicios"):
+                    plantilla_mapa_servicios(archivo, info_util)
+                elif _usa(app, "html_mapa_servicios"):
+                    html_mapa_servicios(archivo, info_util)
+            if _usa(app, "html_mapa_capas"):
+                # Mismas capas y capa visible que app5.py
+                capas = {titulo.replace("Mapa de ", ""): archivo for titulo, archivo in opciones.items()}
+                html_mapa_capas(capas, info, visibles=[next(iter(capas))])
+            if _usa(app, "capa_encuadre"):
+                for archivo in opciones.values():
+                    piramide_para(archivo)
+            if _usa(app, "indice_utm_para"):
+                for archivo in opciones.values():
+                    indice_utm_para(archivo)
+            if _usa(app, "plantilla_cobertura"):
+                for capa in rejilla_cobertura().capas:
+                    plantilla_cobertura(capa)
+
+        if any(_usa(app, "seccion_vulnerabilidad") for app in apps):
+            huella = sv.huella_csv(sv.ARCHIVO_VULNERABILIDAD)
+            sv.cargar_datos()
+            sv.html_mapa_vulnerabilidad(huella, TESELAS)
+            sv.png_barras(huella)
+            sv.png_cajas(huella)
+
+
+def _opciones(argumentos):
+    """Separa las opciones de Streamlit (--server.port 8502) de los argumentos de la app."""
+    opciones, resto = {}, []
+    argumentos = list(argumentos)
+    while argumentos:
+        arg = argumentos.pop(0)
+        if arg.startswith("--") and "." in arg:
+            clave, _, valor = arg[2:].partition("=")
+            opciones[clave.replace(".", "_")] = valor if _ else argumentos.pop(0)
+        else:
+            resto.append(arg)
+    return opciones, resto
+
+
+def servir(app: str, argumentos=()):
+    """Calienta las cachés y arranca Streamlit con `app` en este proceso."""
+    from streamlit.web import bootstrap
+
+    opciones, argumentos = _opciones(argumentos)
+    bootstrap.load_config_options(flag_options=opciones)
+    apps = VARIANTES.get(app, (app,))
+    inicio = time.perf_counter()
+    precargar_datos(apps)
+    precargar_vistas(apps)
+    print(f"Cachés listas en {time.perf_counter() - inicio:.1f} s", flush=True)
+    bootstrap.run(app, False, argumentos, opciones)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calienta las cachés de las apps.")
+    sub = parser.add_subparsers(dest="orden")
+    p_serv = sub.add_parser("servir", help="calentar también las cachés en memoria y arrancar Streamlit")
+    p_serv.add_argument("app", nargs="?", default="inicio.py")
+    p_serv.add_argument("argumentos", nargs=argparse.REMAINDER, help="opciones de Streamlit (--server.port 8502) y argumentos para la app")
+    args = parser.parse_args()
+
+    if args.orden == "servir":
+        servir(args.app, args.argumentos)
+    else:
+        inicio = time.perf_counter()
+        precargar_datos()
+        print(f"Cachés de disco listas en {time.perf_counter() - inicio:.1f} s")
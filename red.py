@@ -0,0 +1,404 @@
+# red.py  ·  distancia por la red de calles (extracto local de OpenStreetMap)
+#
+# La distancia en línea recta engaña donde hay barreras: el viejo cauce del
+# Turia, las vías del tren o el puerto. Aquí la distancia es la del camino a
+# pie por las calles de un extracto de OSM en disco (RUTA_OSM, .osm, .osm.gz
+# u .osm.bz2, p. ej. exportado de openstreetmap.org o recortado con osmium);
+# nunca se descarga nada.
+#
+# Preparación (una vez por extracto y por capa, guardada en ./data/cache):
+#
+#   - grafo: las vías con highway=* por las que se puede ir a pie, como CSR
+#     (inicio/destino/peso) no dirigido, con longitudes en metros UTM, y la
+#     componente conexa de cada nodo;
+#   - etiquetas de la capa: un Dijkstra con todos los centros de la capa como
+#     orígenes a la vez da, para cada nodo, la distancia por la red a su
+#     centro más cercano y cuál es.
+#
+# Enganche a la red: los centros y los clics entran por el tramo de calle más
+# cercano (no por los nodos más cercanos en línea recta, que pueden estar al
+# otro lado del río o de las vías sin camino entre medias), y solo por tramos
+# de la componente conexa principal: los trozos sueltos del extracto (patios,
+# vías cortadas por el borde del recorte) no llevan a ningún centro. El tramo
+# recto hasta la calle y la calle misma siguen siendo una aproximación del
+# camino real (portales, pasos de cebra, aceras): la cifra es orientativa.
+#
+# Consulta (milisegundos): el tramo más cercano al clic y, de sus dos
+# extremos, el de menor (recto hasta el tramo + a lo largo del tramo +
+# etiqueta del nodo).
+#
+# Uso:  python red.py preparar [ARCHIVO ...] [--osm RUTA]
+#       python red.py consultar LAT LON [--archivo hospitales.csv] [--osm RUTA]
+import argparse
+import bz2
+import gzip
+import heapq
+import os
+import time
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, hash_fichero, huella_csv
+from plano import IndiceUTM, a_utm, distancia_plana, escala_utm
+
+RUTA_OSM = os.environ.get("EDM_RED_OSM", "./data/osm/valencia.osm")
+# Subir si cambia cómo se construye el grafo o las etiquetas
+VERSION_RED = 2
+# Vías por las que no se va a pie (autopistas, autovías, obras...)
+VIAS_EXCLUIDAS = {
+    "motorway", "motorway_link", "trunk", "trunk_link", "construction", "proposed",
+    "abandoned", "disused", "raceway", "bus_guideway", "escape", "busway",
+}
+# Los tramos se indexan por puntos cada PASO_TRAMO_M como mucho; se miran los
+# tramos de los K_MUESTRAS puntos más cercanos al clic
+PASO_TRAMO_M = 25.0
+K_MUESTRAS = 8
+
+# ruta OSM -> ((mtime_ns, tamaño), sha1)
+_huellas = CacheVersiones()
+# ruta OSM -> (sha1, RedCalles)
+_redes = CacheVersiones()
+# (ruta OSM, ruta CSV) -> ((sha1 del OSM, sha1 del CSV), (distancia, centro) por nodo)
+_etiquetas = CacheVersiones()
+
+
+def hay_red(ruta: str = RUTA_OSM) -> bool:
+    """Hay un extracto de OSM en disco (puede que aún sin preparar)."""
+    return os.path.exists(ruta)
+
+
+def red_preparada(archivo_csv: str, carpeta: str = CARPETA_CSV, ruta: str = RUTA_OSM) -> bool:
+    """El grafo y las etiquetas de la capa ya están en ./data/cache.
+
+    Las apps solo ofrecen la distancia por calles entonces: prepararlos (leer
+    el extracto y el Dijkstra) bloquearía la sesión. Ver `python red.py preparar`.
+    """
+    if not hay_red(ruta):
+        return False
+    sha1_osm, sha1_csv = _huella_osm(ruta), huella_csv(archivo_csv, carpeta)
+    return (os.path.exists(_ruta_red(sha1_osm))
+            and os.path.exists(_ruta_etiquetas(sha1_osm, archivo_csv, sha1_csv)))
+
+
+def _huella_osm(ruta):
+    st_ = os.stat(ruta)
+    clave, firma = os.path.abspath(ruta), (st_.st_mtime_ns, st_.st_size)
+    sha1 = _huellas.buscar(clave, firma)
+    if sha1 is None:
+        sha1 = _huellas.guardar(clave, firma, hash_fichero(ruta))
+    return sha1
+
+
+# ---------- lectura del OSM ----------
+def _abrir(ruta):
+    if ruta.endswith(".gz"):
+        return gzip.open(ruta, "rb")
+    if ruta.endswith(".bz2"):
+        return bz2.open(ruta, "rb")
+    return open(ruta, "rb")
+
+
+def _a_pie(etiquetas: dict) -> bool:
+    via = etiquetas.get("highway")
+    if via is None or via in VIAS_EXCLUIDAS or etiquetas.get("area") == "yes":
+        return False
+    if etiquetas.get("foot") in ("yes", "designated", "permissive"):
+        return True
+    return etiquetas.get("foot") != "no" and etiquetas.get("access") not in ("no", "private")
+
+
+def leer_osm(ruta: str):
+    """(ids, lats, lons) de los nodos y (u, v) con los ids de cada tramo de vía a pie."""
+    ids, lats, lons = array("q"), array("d"), array("d")
+    u, v = array("q"), array("q")
+    with _abrir(ruta) as f:
+        for _, elem in ET.iterparse(f, events=("end",)):
+            if elem.tag == "node":
+                ids.append(int(elem.get("id")))
+                lats.append(float(elem.get("lat")))
+                lons.append(float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                etiquetas = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+                if _a_pie(etiquetas):
+                    refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+                    u.extend(refs[:-1])
+                    v.extend(refs[1:])
+                elem.clear()
+            elif elem.tag == "relation":
+                elem.clear()
+    return (np.frombuffer(ids, dtype=np.int64), np.frombuffer(lats), np.frombuffer(lons),
+            np.frombuffer(u, dtype=np.int64), np.frombuffer(v, dtype=np.int64))
+
+
+# ---------- grafo ----------
+def componentes(inicio, destino) -> np.ndarray:
+    """Número de componente conexa de cada nodo del CSR (recorrido en anchura)."""
+    n = inicio.size - 1
+    inicio, destino = inicio.tolist(), destino.tolist()
+    componente = [-1] * n
+    actual = 0
+    for raiz in range(n):
+        if componente[raiz] >= 0:
+            continue
+        componente[raiz] = actual
+        pendientes = [raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            for i in range(inicio[nodo], inicio[nodo + 1]):
+                vecino = destino[i]
+                if componente[vecino] < 0:
+                    componente[vecino] = actual
+                    pendientes.append(vecino)
+        actual += 1
+    return np.array(componente, dtype=np.int32)
+
+
+class RedCalles:
+    def __init__(self, lats, lons, inicio, destino, peso, componente):
+        self.lats, self.lons = lats, lons
+        self.inicio, self.destino, self.peso = inicio, destino, peso
+        self.componente = componente
+        self._indexar_tramos()
+
+    def _indexar_tramos(self):
+        """Índice de puntos a lo largo de los tramos de la componente principal."""
+        self.x, self.y = a_utm(self.lats, self.lons)
+        origen = np.repeat(np.arange(self.lats.size), np.diff(self.inicio))
+        principal = np.bincount(self.componente).argmax() if self.componente.size else 0
+        # Cada tramo una vez (el CSR los tiene en los dos sentidos)
+        una_vez = (origen < self.destino) & (self.componente[origen] == principal)
+        self.tramo_u, self.tramo_v = origen[una_vez], self.destino[una_vez]
+        self.tramo_largo = self.peso[una_vez]
+
+        # Puntos en el centro de trozos de como mucho PASO_TRAMO_M: el punto
+        # del tramo más cercano al clic está a menos de PASO_TRAMO_M / 2 de uno
+        partes = np.maximum(1, np.ceil(self.tramo_largo / PASO_TRAMO_M)).astype(np.int64)
+        tramo = np.repeat(np.arange(partes.size), partes)
+        t = (np.arange(tramo.size) - np.repeat(np.cumsum(partes) - partes, partes) + 0.5) / partes[tramo]
+        u, v = self.tramo_u[tramo], self.tramo_v[tramo]
+        x = self.x[u] + t * (self.x[v] - self.x[u])
+        y = self.y[u] + t * (self.y[v] - self.y[u])
+        lats = self.lats[u] + t * (self.lats[v] - self.lats[u])
+        lons = self.lons[u] + t * (self.lons[v] - self.lons[u])
+        self.muestra_tramo = tramo
+        self.indice = IndiceUTM(lats, lons, xy=(x, y))
+
+    @classmethod
+    def desde_osm(cls, ruta: str) -> "RedCalles":
+        ids, lats, lons, u, v = leer_osm(ruta)
+        orden = np.argsort(ids, kind="stable")
+        ids, lats, lons = ids[orden], lats[orden], lons[orden]
+        # Tramos con los dos nodos en el extracto (las vías cortadas por el
+        # borde del recorte pueden citar nodos que no están)
+        pu = np.searchsorted(ids, u).clip(max=max(ids.size - 1, 0))
+        pv = np.searchsorted(ids, v).clip(max=max(ids.size - 1, 0))
+        validos = (ids[pu] == u) & (ids[pv] == v) & (pu != pv) if ids.size else np.zeros(0, dtype=bool)
+        pu, pv = pu[validos], pv[validos]
+
+        # Solo los nodos que usa alguna vía, renumerados
+        usados, nuevo = np.unique(np.concatenate([pu, pv]), return_inverse=True)
+        pu, pv = nuevo[:pu.size], nuevo[pu.size:]
+        lats, lons = lats[usados], lons[usados]
+        x, y = a_utm(lats, lons)
+        largo = distancia_plana(x[pu], y[pu], x[pv], y[pv])
+
+        # CSR no dirigido: cada tramo en los dos sentidos
+        origen = np.concatenate([pu, pv])
+        orden = np.argsort(origen, kind="stable")
+        destino = np.concatenate([pv, pu])[orden]
+        peso = np.concatenate([largo, largo])[orden]
+        inicio = np.concatenate(([0], np.cumsum(np.bincount(origen, minlength=usados.size))))
+        return cls(lats, lons, inicio, destino, peso, componentes(inicio, destino))
+
+    def enganchar(self, lat, lon, k: int = K_MUESTRAS):
+        """Entrada a la red por el tramo más cercano a cada punto.
+
+        Devuelve (nodos, metros): los dos extremos del tramo y, para cada uno,
+        el recorrido recto hasta el tramo más lo que queda por el tramo hasta
+        ese extremo. Forma (2,) con un punto escalar, (n, 2) con arrays; -1 e
+        inf si no hay tramos.
+        """
+        escalar = np.ndim(lat) == 0
+        lat = np.atleast_1d(np.asarray(lat, dtype=float))
+        lon = np.atleast_1d(np.asarray(lon, dtype=float))
+        if not self.tramo_u.size:
+            nodos, metros = np.full((lat.size, 2), -1, dtype=np.int64), np.full((lat.size, 2), np.inf)
+            return (nodos[0], metros[0]) if escalar else (nodos, metros)
+        muestras, _ = self.indice.k_vecinos(lat, lon, k=k)
+        validas = muestras >= 0
+        tramos = self.muestra_tramo[np.where(validas, muestras, 0)]
+
+        # Proyección del punto sobre cada tramo candidato, en UTM
+        x, y = a_utm(lat, lon)
+        x, y = x[:, None], y[:, None]
+        ux, uy = self.x[self.tramo_u[tramos]], self.y[self.tramo_u[tramos]]
+        dx, dy = self.x[self.tramo_v[tramos]] - ux, self.y[self.tramo_v[tramos]] - uy
+        largo2 = dx * dx + dy * dy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(largo2 > 0, ((x - ux) * dx + (y - uy) * dy) / largo2, 0.0).clip(0.0, 1.0)
+        px, py = ux + t * dx, uy + t * dy
+        recto = np.hypot(x - px, y - py) / escala_utm(px, py)
+        recto[~validas] = np.inf
+
+        mejor = np.argmin(recto, axis=1)[:, None]
+        tramo = np.take_along_axis(tramos, mejor, axis=1)[:, 0]
+        t = np.take_along_axis(t, mejor, axis=1)[:, 0]
+        recto = np.take_along_axis(recto, mejor, axis=1)[:, 0]
+        largo = self.tramo_largo[tramo]
+        nodos = np.column_stack((self.tramo_u[tramo], self.tramo_v[tramo]))
+        metros = np.column_stack((recto + t * largo, recto + (1 - t) * largo))
+        sin_tramo = ~np.isfinite(recto)
+        nodos[sin_tramo], metros[sin_tramo] = -1, np.inf
+        return (nodos[0], metros[0]) if escalar else (nodos, metros)
+
+    def guardar(self, ruta: str):
+        tmp = ruta + ".tmp.npz"
+        np.savez(tmp, lats=self.lats, lons=self.lons, inicio=self.inicio, destino=self.destino, peso=self.peso,
+                 componente=self.componente)
+        os.replace(tmp, ruta)
+
+    @classmethod
+    def cargar(cls, ruta: str) -> "RedCalles":
+        with np.load(ruta) as z:
+            return cls(z["lats"], z["lons"], z["inicio"], z["destino"], z["peso"], z["componente"])
+
+
+def _ruta_red(sha1):
+    return os.path.join(CARPETA_CACHE, f"red.v{VERSION_RED}.{sha1[:12]}.npz")
+
+
+def red_para(ruta: str = RUTA_OSM) -> RedCalles:
+    """Grafo del extracto, construido una vez por contenido del fichero y guardado en disco."""
+    sha1 = _huella_osm(ruta)
+    red = _redes.buscar(os.path.abspath(ruta), sha1)
+    if red is not None:
+        return red
+
+    ruta_red = _ruta_red(sha1)
+    if os.path.exists(ruta_red):
+        red = RedCalles.cargar(ruta_red)
+    else:
+        red = RedCalles.desde_osm(ruta)
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        red.guardar(ruta_red)
+    return _redes.guardar(os.path.abspath(ruta), sha1, red)
+
+
+# ---------- etiquetas por capa ----------
+def dijkstra_multiorigen(red: RedCalles, nodos, distancias, centros):
+    """Distancia de cada nodo al origen más cercano por la red, y su centro.
+
+    Los orígenes son nodos con una distancia inicial (el tramo desde el
+    centro hasta la red) y el centro al que pertenecen. Los nodos a los que
+    no se llega quedan con inf y -1.
+    """
+    n = red.lats.size
+    inicio, destino, peso = red.inicio.tolist(), red.destino.tolist(), red.peso.tolist()
+    dist = [float("inf")] * n
+    centro = [-1] * n
+    cola = []
+    for nodo, d, c in zip(nodos.tolist(), distancias.tolist(), centros.tolist()):
+        if d < dist[nodo]:
+            dist[nodo], centro[nodo] = d, c
+            cola.append((d, nodo))
+    heapq.heapify(cola)
+
+    while cola:
+        d, nodo = heapq.heappop(cola)
+        if d > dist[nodo]:
+            continue
+        c = centro[nodo]
+        for i in range(inicio[nodo], inicio[nodo + 1]):
+            vecino = destino[i]
+            nueva = d + peso[i]
+            if nueva < dist[vecino]:
+                dist[vecino], centro[vecino] = nueva, c
+                heapq.heappush(cola, (nueva, vecino))
+    return np.array(dist, dtype=np.float32), np.array(centro, dtype=np.int32)
+
+
+def _ruta_etiquetas(sha1_osm, archivo_csv, sha1_csv):
+    nombre = os.path.splitext(archivo_csv)[0]
+    return os.path.join(CARPETA_CACHE, f"red.v{VERSION_RED}.{sha1_osm[:12]}.{nombre}.{sha1_csv[:12]}.npz")
+
+
+def etiquetas_para(archivo_csv: str, carpeta: str = CARPETA_CSV, ruta: str = RUTA_OSM):
+    """(distancia, centro) por nodo de la red hacia los puntos del CSV, guardado en disco."""
+    sha1_osm, sha1_csv = _huella_osm(ruta), huella_csv(archivo_csv, carpeta)
+    clave = (os.path.abspath(ruta), os.path.abspath(os.path.join(carpeta, archivo_csv)))
+    etiquetas = _etiquetas.buscar(clave, (sha1_osm, sha1_csv))
+    if etiquetas is not None:
+        return etiquetas
+
+    ruta_etiquetas = _ruta_etiquetas(sha1_osm, archivo_csv, sha1_csv)
+    if os.path.exists(ruta_etiquetas):
+        with np.load(ruta_etiquetas) as z:
+            etiquetas = z["distancia"], z["centro"]
+    else:
+        red = red_para(ruta)
+        df = cargar_csv(archivo_csv, carpeta, columnas=())
+        # Cada centro entra por los dos extremos de su tramo de calle más
+        # cercano, con lo que hay hasta ellos como distancia inicial
+        nodos, tramo = red.enganchar(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy())
+        centros = np.repeat(np.arange(len(df)), nodos.shape[1])
+        validos = nodos.ravel() >= 0
+        etiquetas = dijkstra_multiorigen(red, nodos.ravel()[validos], tramo.ravel()[validos], centros[validos])
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        tmp = ruta_etiquetas + ".tmp.npz"
+        np.savez(tmp, distancia=etiquetas[0], centro=etiquetas[1])
+        os.replace(tmp, ruta_etiquetas)
+    return _etiquetas.guardar(clave, (sha1_osm, sha1_csv), etiquetas)
+
+
+# ---------- consulta ----------
+def mas_cercano_red(lat: float, lon: float, archivo_csv: str, carpeta: str = CARPETA_CSV,
+                    ruta: str = RUTA_OSM):
+    """(fila del CSV, metros por la red) del punto más cercano; (-1, inf) si no hay camino."""
+    distancia, centro = etiquetas_para(archivo_csv, carpeta, ruta)
+    nodos, tramo = red_para(ruta).enganchar(lat, lon)
+    validos = nodos >= 0
+    total = tramo[validos] + distancia[nodos[validos]]
+    if not total.size or not np.isfinite(total.min()):
+        return -1, float("inf")
+    mejor = int(np.argmin(total))
+    return int(centro[nodos[validos][mejor]]), float(total[mejor])
+
+
+if __name__ == "__main__":
+    from precarga import constante_app
+
+    parser = argparse.ArgumentParser(description="Distancias por la red de calles de un extracto de OSM.")
+    parser.add_argument("--osm", default=RUTA_OSM, help="extracto .osm, .osm.gz u .osm.bz2")
+    sub = parser.add_subparsers(dest="orden", required=True)
+    p_prep = sub.add_parser("preparar", help="construir el grafo y las etiquetas de las capas")
+    # Por defecto, las capas del selector de app5.py (las que ofrecen la distancia por calles)
+    p_prep.add_argument("archivos", nargs="*", default=list(constante_app("app5.py", "opciones_selector").values()))
+    p_cons = sub.add_parser("consultar", help="centro más cercano por la red a un punto")
+    p_cons.add_argument("lat", type=float)
+    p_cons.add_argument("lon", type=float)
+    p_cons.add_argument("--archivo", default="hospitales.csv")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    red = red_para(args.osm)
+    print(f"Red: {red.lats.size} nodos, {red.destino.size // 2} tramos, {red.tramo_u.size} en la componente "
+          f"principal ({time.perf_counter() - inicio:.2f} s)")
+    if args.orden == "preparar":
+        for archivo in args.archivos:
+            t = time.perf_counter()
+            distancia, _ = etiquetas_para(archivo, ruta=args.osm)
+            print(f"{archivo}: {np.isfinite(distancia).mean():.1%} de los nodos con camino "
+                  f"({time.perf_counter() - t:.2f} s)")
+    else:
+        fila, metros = mas_cercano_red(args.lat, args.lon, args.archivo, ruta=args.osm)
+        t = time.perf_counter()
+        mas_cercano_red(args.lat, args.lon, args.archivo, ruta=args.osm)
+        if fila < 0:
+            print("Sin camino por la red desde ese punto")
+        else:
+            df = cargar_csv(args.archivo)
+            nombre = df.iloc[fila].get("Nombre", df.iloc[fila].get("equipamien"))
+            print(f"{nombre}: {metros:,.0f} m por la red ({(time.perf_counter() - t) * 1e3:.2f} ms)")
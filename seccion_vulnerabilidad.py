@@ -1,49 +1,56 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
+import importlib.util
+import io
 import json
 import folium
-from streamlit_folium import folium_static
 from folium import GeoJson, GeoJsonTooltip
 
-# =================== CSS Personalizado ===================
-st.markdown("""
-<style>
-body {
-    background-color: #eef2f5;
-    font-family: 'Segoe UI', sans-serif;
-}
-h1, h2, h3 {
-    color: #2c3e50;
-}
-.block-container {
-    padding-top: 1rem;
-    padding-bottom: 1rem;
-}
-.stDataFrame {
-    background-color: #ffffff;
-    border: 1px solid #ddd;
-    border-radius: 10px;
-}
-</style>
-""", unsafe_allow_html=True)
+from accesibilidad import CAPAS_SERVICIOS, RADIOS_M, tabla_accesibilidad
+from datos import CacheVersiones, cargar_csv, huella_csv
+from geometria import ZOOM_DETALLE, capa_simplificada
+from instrumentacion import etapa
+from mapas import TESELAS, capa_teselas, mostrar_html
+from union_espacial import conteo_por_barrio
 
-# =================== Título de la sección ===================
-st.title("📊 Vulnerabilidad por Barrios")
-st.markdown("Análisis geográfico y estadístico de vulnerabilidad en los barrios de la ciudad.")
+# matplotlib y altair solo se importan al dibujar los gráficos (cuestan ~0.5 s
+# de arranque y las otras pestañas no los usan). Altair (Vega-Lite) viene con
+# Streamlit; si falta, solo hay gráficos matplotlib.
+HAY_ALTAIR = importlib.util.find_spec("altair") is not None
 
-# =================== Selector de funcionalidad ===================
-feature = st.sidebar.selectbox("Selecciona una funcionalidad", ["Mapa interactivo", "Gráficos", "Tabla de datos"])
+ARCHIVO_VULNERABILIDAD = "vulnerabilidad-por-barrios.csv"
+COLUMNAS_VULNERABILIDAD = ["Vul_Equip", "Vul_Dem", "Vul_Econom", "Vul_Global"]
+COLUMNAS_INDICES = ["Ind_Equip", "Ind_Dem", "Ind_Econom", "Ind_Global"]
+# Propiedades de cada barrio en la capa del mapa: {propiedad: columna}
+PROPIEDADES_BARRIOS = {
+    "Barrio": "Name",
+    "Distrito": "District",
+    "Índice Global": "Ind_Global",
+    "Vulnerabilidad": "Vul_Global"
+}
+MOTOR_IMAGEN = "Imagen (matplotlib)"
+MOTOR_VEGA = "Interactivo (Vega-Lite)"
 
 # =================== Carga de datos con cache ===================
-@st.cache_data
+# CSV -> (huella, barrios con geometry y color), compartidos por todas las
+# sesiones del proceso
+_barrios = CacheVersiones()
+
 def cargar_datos():
-    df = pd.read_csv("./data/csv/vulnerabilidad-por-barrios.csv", sep=";")
-    df = df[df['geo_point_2d'].notna() & df['geo_point_2d'].str.contains(',')]
-    df[['LATITUD', 'LONGITUD']] = df['geo_point_2d'].str.split(',', expand=True).astype(float)
-    df["geometry"] = df["Geo Shape"].apply(json.loads)
-    df["color"] = df["Vul_Global"].apply(get_color)
-    return df
+    """Barrios con la geometría ya parseada y el color de Vul_Global.
+
+    Se calcula una vez por contenido del CSV y cada llamada recibe una vista
+    (ver datos.py): sin st.cache_data, que devolvía a cada sesión su propia
+    copia deserializada de la tabla con todas las geometrías.
+    """
+    huella = huella_csv(ARCHIVO_VULNERABILIDAD)
+    df = _barrios.buscar(ARCHIVO_VULNERABILIDAD, huella)
+    if df is None:
+        df = cargar_csv(ARCHIVO_VULNERABILIDAD)
+        df["geometry"] = df["Geo Shape"].apply(json.loads)
+        df["color"] = df["Vul_Global"].apply(get_color)
+        _barrios.guardar(ARCHIVO_VULNERABILIDAD, huella, df)
+    return df.copy(deep=False)
 
 def get_color(vul):
     return {
@@ -52,50 +59,83 @@ def get_color(vul):
         "Vulnerabilidad Baja": "green"
     }.get(vul, "gray")
 
-vuln_df = cargar_datos()
+# Una sola FeatureCollection con todos los barrios: el color va en las
+# propiedades y el estilo y el tooltip son comunes a toda la capa. Las
+# geometrías vienen simplificadas y cuantizadas para el zoom indicado. Sin
+# caché propia: capa_simplificada ya guarda la capa por hash del CSV, y solo
+# la usa html_mapa_vulnerabilidad, que también va por hash.
+def cargar_capa_barrios(zoom=ZOOM_DETALLE):
+    capa = capa_simplificada(ARCHIVO_VULNERABILIDAD, "Geo Shape", PROPIEDADES_BARRIOS, zoom=zoom)
+    features = [
+        {**f, "properties": {**f["properties"], "color": get_color(f["properties"]["Vulnerabilidad"])}}
+        for f in capa["features"]
+    ]
+    return {"type": "FeatureCollection", "features": features}
 
-# =================== Mapa ===================
-if feature == "Mapa interactivo":
-    st.subheader("🌍 Mapa por nivel de vulnerabilidad global")
+def estilo_barrio(feature):
+    return {
+        "fillColor": feature["properties"]["color"],
+        "color": "black",
+        "weight": 1,
+        "fillOpacity": 0.5
+    }
 
-    mapa = folium.Map(location=[vuln_df['LATITUD'].mean(), vuln_df['LONGITUD'].mean()],
-                      zoom_start=12, tiles="OpenStreetMap")
+# Con teselas (EDM_TESELAS=1) el color se calcula en el navegador
+ESTILO_TESELAS = """function (p) {
+    var colores = %s;
+    return {fill: true, fillColor: colores[p.Vulnerabilidad] || "gray", fillOpacity: 0.5,
+            color: "black", weight: 1};
+}""" % json.dumps({v: get_color(v) for v in ("Vulnerabilidad Alta", "Vulnerabilidad Media", "Vulnerabilidad Baja")})
 
-    for _, row in vuln_df.iterrows():
-        geojson = {
-            "type": "Feature",
-            "geometry": row["geometry"],
-            "properties": {
-                "Barrio": row["Name"],
-                "Distrito": row["District"],
-                "Índice Global": row["Ind_Global"],
-                "Vulnerabilidad": row["Vul_Global"],
-                "color": row["color"]
-            }
-        }
-        GeoJson(
-            geojson,
-            style_function=lambda feature: {
-                "fillColor": feature["properties"]["color"],
-                "color": "black",
-                "weight": 1,
-                "fillOpacity": 0.5
-            },
-            tooltip=GeoJsonTooltip(fields=["Barrio", "Distrito", "Índice Global", "Vulnerabilidad"])
-        ).add_to(mapa)
-
-    folium_static(mapa, width=1100, height=600)
+@st.cache_data
+def html_mapa_vulnerabilidad(huella, teselas=False):
+    df = cargar_datos()
+    mapa = folium.Map(location=[df['LATITUD'].mean(), df['LONGITUD'].mean()],
+                      zoom_start=12, tiles="OpenStreetMap")
+    if teselas:
+        capa_teselas(ARCHIVO_VULNERABILIDAD, PROPIEDADES_BARRIOS, "Geo Shape", estilo=ESTILO_TESELAS,
+                     tooltip=list(PROPIEDADES_BARRIOS), name="Vulnerabilidad global").add_to(mapa)
+        return folium.Figure().add_child(mapa).render()
+    GeoJson(
+        cargar_capa_barrios(),
+        name="Vulnerabilidad global",
+        style_function=estilo_barrio,
+        tooltip=GeoJsonTooltip(fields=["Barrio", "Distrito", "Índice Global", "Vulnerabilidad"])
+    ).add_to(mapa)
+    return folium.Figure().add_child(mapa).render()
 
 # =================== Gráficos ===================
-elif feature == "Gráficos":
-    st.subheader("📊 Distribución por tipos de vulnerabilidad")
-    categorical_cols = ["Vul_Equip", "Vul_Dem", "Vul_Econom", "Vul_Global"]
+# Lo que se dibuja sale de agregados pequeños cacheados por hash del CSV. Con
+# matplotlib, el PNG también se cachea (la figura se cierra al rasterizarla);
+# con Vega-Lite, el navegador dibuja a partir de los agregados.
+@st.cache_data
+def conteos_vulnerabilidad(huella):
+    """Barrios por nivel de cada Vul_*, en el orden de value_counts."""
+    df = cargar_csv(ARCHIVO_VULNERABILIDAD, columnas=COLUMNAS_VULNERABILIDAD)
+    return {col: df[col].value_counts() for col in COLUMNAS_VULNERABILIDAD}
+
+@st.cache_data
+def estadisticas_indices(huella):
+    """Cuartiles, bigotes y atípicos de cada Ind_* (como los calcula boxplot)."""
+    from matplotlib.cbook import boxplot_stats
+    df = cargar_csv(ARCHIVO_VULNERABILIDAD, columnas=COLUMNAS_INDICES)
+    return {col: boxplot_stats(df[col].dropna().to_numpy())[0] for col in COLUMNAS_INDICES}
+
+def _png(fig):
+    import matplotlib.pyplot as plt
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
+
+@st.cache_data
+def png_barras(huella):
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(nrows=2, ncols=2, figsize=(20, 10))
     axes = axes.flatten()
 
-    for i, col in enumerate(categorical_cols):
+    for i, (col, counts) in enumerate(conteos_vulnerabilidad(huella).items()):
         ax = axes[i]
-        counts = vuln_df[col].value_counts()
         counts.plot(kind='bar', ax=ax, color=["green", "orange", "red"])
         for idx, value in enumerate(counts.values):
             ax.text(idx, value + 0.5, str(value), ha='center', va='bottom', fontsize=9)
@@ -104,34 +144,158 @@ elif feature == "Gráficos":
         ax.set_xlabel("")
         ax.grid(axis='y')
 
-    plt.tight_layout()
-    st.pyplot(fig)
-
-    st.subheader("📈 Indicadores numéricos de vulnerabilidad")
-    numerical_cols = ["Ind_Equip", "Ind_Dem", "Ind_Econom", "Ind_Global"]
-    fig2, axes2 = plt.subplots(nrows=2, ncols=2, figsize=(10, 5))
-    axes2 = axes2.flatten()
-
-    for i, col in enumerate(numerical_cols):
-        axes2[i].boxplot(vuln_df[col].dropna(), patch_artist=True,
-                         boxprops=dict(facecolor="#3498db", color="black"),
-                         medianprops=dict(color="black"))
-        axes2[i].set_title(col.replace("Ind_", "Índice "))
-        axes2[i].grid(True)
-
-    plt.tight_layout()
-    st.pyplot(fig2)
-
-# =================== Tabla de datos ===================
-elif feature == "Tabla de datos":
-    st.subheader("🧾 Tabla de indicadores por barrio")
-    cols = ["Name", "District", "Ind_Equip", "Vul_Equip", "Ind_Dem", "Vul_Dem", "Ind_Econom", "Vul_Econom", "Ind_Global", "Vul_Global"]
-    st.dataframe(vuln_df[cols])
-
-    # Botón para descargar CSV
-    st.download_button(
-        "📥 Descargar datos como CSV",
-        data=vuln_df[cols].to_csv(index=False),
-        file_name="vulnerabilidad_barrios.csv",
-        mime="text/csv"
+    fig.tight_layout()
+    return _png(fig)
+
+@st.cache_data
+def png_cajas(huella):
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(nrows=2, ncols=2, figsize=(10, 5))
+    axes = axes.flatten()
+
+    for i, (col, stats) in enumerate(estadisticas_indices(huella).items()):
+        axes[i].bxp([stats], patch_artist=True,
+                    boxprops=dict(facecolor="#3498db", edgecolor="black"),
+                    medianprops=dict(color="black"))
+        axes[i].set_title(col.replace("Ind_", "Índice "))
+        axes[i].grid(True)
+
+    fig.tight_layout()
+    return _png(fig)
+
+def vega_barras(huella):
+    import altair as alt
+    datos = pd.DataFrame([
+        {"indicador": col.replace("Vul_", "Vulnerabilidad "), "nivel": nivel, "barrios": int(n),
+         "color": get_color(nivel)}
+        for col, counts in conteos_vulnerabilidad(huella).items() for nivel, n in counts.items()
+    ])
+    base = alt.Chart(datos).encode(
+        x=alt.X("nivel:N", title=None, sort="-y"),
+        y=alt.Y("barrios:Q", title="Nº de barrios"),
     )
+    barras = base.mark_bar().encode(color=alt.Color("color:N", scale=None), tooltip=["nivel", "barrios"])
+    etiquetas = base.mark_text(dy=-6).encode(text="barrios:Q")
+    return (barras + etiquetas).properties(width=250, height=200).facet(facet="indicador:N", columns=2)
+
+def vega_cajas(huella):
+    import altair as alt
+    datos = pd.DataFrame([
+        {"indice": col.replace("Ind_", "Índice "), **{k: float(stats[k]) for k in ("whislo", "q1", "med", "q3", "whishi")}}
+        for col, stats in estadisticas_indices(huella).items()
+    ])
+    atipicos = pd.DataFrame([
+        {"indice": col.replace("Ind_", "Índice "), "valor": float(v)}
+        for col, stats in estadisticas_indices(huella).items() for v in stats["fliers"]
+    ], columns=["indice", "valor"])
+    base = alt.Chart(datos).encode(x=alt.X("indice:N", title=None))
+    capas = [
+        base.mark_rule().encode(y=alt.Y("whislo:Q", title=None), y2="whishi:Q"),
+        base.mark_bar(size=40, color="#3498db", stroke="black").encode(y="q1:Q", y2="q3:Q",
+                                                                       tooltip=["q1", "med", "q3"]),
+        base.mark_tick(size=40, color="black").encode(y="med:Q"),
+        alt.Chart(atipicos).mark_point(color="black").encode(x="indice:N", y="valor:Q"),
+    ]
+    return alt.layer(*capas).properties(height=300)
+
+# =================== Sección ===================
+# Se importa una vez desde app4.py/app5.py: las funciones cacheadas de arriba
+# se definen una sola vez por proceso y cada rerun solo llama a render().
+def render():
+    # =================== CSS Personalizado ===================
+    st.markdown("""
+    <style>
+    body {
+        background-color: #eef2f5;
+        font-family: 'Segoe UI', sans-serif;
+    }
+    h1, h2, h3 {
+        color: #2c3e50;
+    }
+    .block-container {
+        padding-top: 1rem;
+        padding-bottom: 1rem;
+    }
+    .stDataFrame {
+        background-color: #ffffff;
+        border: 1px solid #ddd;
+        border-radius: 10px;
+    }
+    </style>
+    """, unsafe_allow_html=True)
+
+    # =================== Título de la sección ===================
+    st.title("📊 Vulnerabilidad por Barrios")
+    st.markdown("Análisis geográfico y estadístico de vulnerabilidad en los barrios de la ciudad.")
+
+    # =================== Selector de funcionalidad ===================
+    feature = st.sidebar.selectbox("Selecciona una funcionalidad", ["Mapa interactivo", "Gráficos", "Tabla de datos", "Acceso a servicios"])
+
+    with etapa("cargar_datos"):
+        vuln_df = cargar_datos()
+
+    # =================== Mapa ===================
+    if feature == "Mapa interactivo":
+        st.subheader("🌍 Mapa por nivel de vulnerabilidad global")
+
+        with etapa("mapa coroplético"):
+            mostrar_html(html_mapa_vulnerabilidad(huella_csv(ARCHIVO_VULNERABILIDAD), TESELAS), width=1100, height=600)
+
+    # =================== Gráficos ===================
+    elif feature == "Gráficos":
+        motores = [MOTOR_IMAGEN, MOTOR_VEGA] if HAY_ALTAIR else [MOTOR_IMAGEN]
+        motor = st.radio("Tipo de gráfico", motores, horizontal=True)
+        huella = huella_csv(ARCHIVO_VULNERABILIDAD)
+
+        st.subheader("📊 Distribución por tipos de vulnerabilidad")
+        with etapa("gráfico: barras"):
+            if motor == MOTOR_VEGA:
+                st.altair_chart(vega_barras(huella))
+            else:
+                st.image(png_barras(huella))
+
+        st.subheader("📈 Indicadores numéricos de vulnerabilidad")
+        with etapa("gráfico: cajas"):
+            if motor == MOTOR_VEGA:
+                st.altair_chart(vega_cajas(huella))
+            else:
+                st.image(png_cajas(huella))
+
+    # =================== Tabla de datos ===================
+    elif feature == "Tabla de datos":
+        st.subheader("🧾 Tabla de indicadores por barrio")
+        cols = ["Name", "District", "Ind_Equip", "Vul_Equip", "Ind_Dem", "Vul_Dem", "Ind_Econom", "Vul_Econom", "Ind_Global", "Vul_Global"]
+        st.dataframe(vuln_df[cols])
+
+        # Botón para descargar CSV
+        st.download_button(
+            "📥 Descargar datos como CSV",
+            data=vuln_df[cols].to_csv(index=False),
+            file_name="vulnerabilidad_barrios.csv",
+            mime="text/csv"
+        )
+
+    # =================== Acceso a servicios ===================
+    elif feature == "Acceso a servicios":
+        st.subheader("🚶 Distancia a servicios por barrio")
+        capa = st.selectbox("Tipo de servicio", list(CAPAS_SERVICIOS))
+        # Tabla precalculada (python accesibilidad.py): aquí solo se filtra
+        with etapa("tabla de accesibilidad"):
+            acceso = tabla_accesibilidad()
+        acceso = acceso[acceso["capa"] == capa].merge(
+            vuln_df[["Codbar", "Vul_Equip"]], on="Codbar", how="left"
+        )
+        # Centros dentro del polígono del barrio (unión espacial precalculada)
+        with etapa("conteo por barrio"):
+            en_barrio = conteo_por_barrio({capa: CAPAS_SERVICIOS[capa]})[["Codbar", capa]]
+        acceso = acceso.merge(en_barrio.rename(columns={capa: "en_barrio"}), on="Codbar", how="left")
+        conteos = ["en_barrio"] + [f"n_{r}m" for r in RADIOS_M]
+
+        st.markdown("Media por nivel de vulnerabilidad en equipamientos")
+        st.dataframe(acceso.groupby("Vul_Equip")[["dist_m", *conteos]].mean().round(1))
+        st.dataframe(acceso[["Name", "District", "Vul_Equip", "dist_m", "mas_cercano", *conteos]]
+                     .sort_values("dist_m", ascending=False))
+
+
+if __name__ == "__main__":
+    render()
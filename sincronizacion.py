@@ -0,0 +1,368 @@
+# sincronizacion.py  ·  actualización incremental de los CSV desde el portal
+#
+# data/info.txt enlaza cada CSV con su conjunto de datos en
+# valencia.opendatasoft.com. Cada sincronización:
+#
+#   1. Pide la exportación CSV con If-None-Match / If-Modified-Since. Si el
+#      portal responde 304, no se hace nada más.
+#   2. Si llega contenido y es igual al CSV local (mismo SHA-1), solo se
+#      guardan las cabeceras nuevas.
+#   3. Si cambia, se compara registro a registro (línea a línea) con el CSV
+#      local. Solo se parsean las filas nuevas o modificadas; la tabla, el
+#      Parquet de cada proyección (datos.reemplazar_csv) y el índice espacial
+#      (IndiceRejilla.con_cambios) se actualizan a partir de los anteriores.
+#      Las demás cachés van por hash del CSV y se invalidan solas.
+#
+# Para probar sin red, `python sincronizacion.py servir` levanta un servidor
+# HTTP local que imita la exportación del portal a partir de una carpeta de
+# CSV (con ETag y Last-Modified), y EDM_URL_DATOS apunta la sincronización a él.
+# `python sincronizacion.py comprobar` aplica cambios de prueba (quitar,
+# modificar y añadir filas) a copias de los CSV y compara la tabla incremental
+# con una lectura completa, tipos incluidos.
+import argparse
+import email.utils
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from datos import CARPETA_CACHE, CARPETA_CSV, cargar_csv, olvidar_csv, parsear_csv, reemplazar_csv, unificar_tipos
+from indice_espacial import indice_para, registrar_indice
+
+URL_DATOS = os.environ.get("EDM_URL_DATOS", "https://valencia.opendatasoft.com")
+RUTA_EXPORTACION = "/api/explore/v2.1/catalog/datasets/{id}/exports/csv"
+RUTA_INFO = "./data/info.txt"
+RUTA_ESTADO = os.path.join(CARPETA_CACHE, "sincronizacion.json")
+
+
+# ---------- fuentes ----------
+def fuentes(carpeta: str = CARPETA_CSV, ruta_info: str = RUTA_INFO) -> dict:
+    """{CSV local: identificador del conjunto de datos en el portal}."""
+    with open(ruta_info, encoding="utf-8") as f:
+        ids = re.findall(r"/explore/dataset/([^/?#\s]+)", f.read())
+    resultado = {}
+    for archivo in sorted(os.listdir(carpeta)):
+        nombre, ext = os.path.splitext(archivo)
+        if ext != ".csv":
+            continue
+        for id_ in ids:
+            if id_ == nombre or id_.startswith(nombre + "-"):
+                resultado[archivo] = id_
+                break
+    return resultado
+
+
+def _leer_estado():
+    try:
+        with open(RUTA_ESTADO, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _escribir_estado(estado: dict):
+    os.makedirs(CARPETA_CACHE, exist_ok=True)
+    tmp = RUTA_ESTADO + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=1)
+    os.replace(tmp, RUTA_ESTADO)
+
+
+def descargar(url: str, etag: str = None, modificado: str = None, timeout: float = 60):
+    """GET condicional: (código HTTP, contenido o None, cabeceras)."""
+    peticion = urllib.request.Request(url)
+    if etag:
+        peticion.add_header("If-None-Match", etag)
+    if modificado:
+        peticion.add_header("If-Modified-Since", modificado)
+    try:
+        with urllib.request.urlopen(peticion, timeout=timeout) as r:
+            return r.status, r.read(), dict(r.headers)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return 304, None, dict(e.headers)
+        raise
+
+
+# ---------- diferencias por registro ----------
+def _registros(contenido: bytes):
+    """(cabecera, líneas de datos, máscara de filas con geo_point_2d válido).
+
+    None si algún registro ocupa más de una línea (no se puede comparar línea
+    a línea) o no hay columna geo_point_2d.
+    """
+    # Todo sobre el búfer con numpy (posiciones de saltos de línea, comillas,
+    # ';' y ',' y searchsorted) para no recorrer las líneas en Python
+    buf = np.frombuffer(contenido, dtype=np.uint8)
+    fin = np.flatnonzero(buf == ord("\n"))
+    if not len(buf):
+        return None
+    if buf[-1] != ord("\n"):
+        fin = np.append(fin, len(buf))
+    inicio = np.concatenate(([0], fin[:-1] + 1))
+    comillas = np.flatnonzero(buf == ord('"'))
+    if ((np.searchsorted(comillas, fin) - np.searchsorted(comillas, inicio)) % 2).any():
+        return None
+
+    lineas = contenido.split(b"\n")[:len(fin)]
+    retorno = (fin > inicio) & (buf[np.maximum(fin - 1, 0)] == ord("\r"))
+    fin = fin - retorno
+    no_vacia = fin > inicio
+    if retorno.any():
+        lineas = [l[:-1] if r else l for l, r in zip(lineas, retorno)]
+    lineas = [l for l, v in zip(lineas, no_vacia) if v]
+    inicio, fin = inicio[no_vacia], fin[no_vacia]
+    if not lineas:
+        return None
+    cabecera, filas = lineas[0], lineas[1:]
+    columnas = cabecera.decode("utf-8-sig").split(";")
+    if "geo_point_2d" not in columnas:
+        return None
+
+    # Mismo filtro que datos.parsear_csv: geo_point_2d con "lat, lon". En los
+    # CSV del portal es la primera o la última columna y basta con ver si hay
+    # una coma en ese tramo de la línea; si no, se lee esa columna con pandas
+    inicio, fin = inicio[1:], fin[1:]
+    puntos_coma = np.flatnonzero(buf == ord(";"))
+    comas = np.flatnonzero(buf == ord(","))
+    if columnas[-1] == "geo_point_2d":
+        anterior = puntos_coma[np.maximum(np.searchsorted(puntos_coma, fin) - 1, 0)] if len(puntos_coma) else inicio
+        desde, hasta = np.maximum(anterior + 1, inicio), fin
+    elif columnas[0] == "geo_point_2d":
+        siguiente = np.append(puntos_coma, len(buf))[np.searchsorted(puntos_coma, inicio)]
+        desde, hasta = inicio, np.minimum(siguiente, fin)
+    else:
+        geo = pd.read_csv(io.BytesIO(contenido), sep=";", usecols=["geo_point_2d"], dtype=str,
+                          keep_default_na=False)["geo_point_2d"]
+        if len(geo) != len(filas):
+            return None
+        return cabecera, filas, geo.str.contains(",").to_numpy()
+    return cabecera, filas, np.searchsorted(comas, hasta) > np.searchsorted(comas, desde)
+
+
+def diferencias(viejo: bytes, nuevo: bytes):
+    """Registros que cambian entre dos versiones del CSV.
+
+    Devuelve None si no se puede comparar por registro (cambia la cabecera o
+    hay registros en varias líneas); si no, (cabecera, origen, filas_nuevas):
+    para cada fila válida del CSV nuevo, origen da la fila válida del viejo
+    idéntica, o -1 si es nueva o modificada (y está en filas_nuevas).
+    """
+    a, b = _registros(viejo), _registros(nuevo)
+    if a is None or b is None or a[0] != b[0]:
+        return None
+    cabecera, filas, validas = b
+    filas_viejo = pd.Index([f for f, v in zip(a[1], a[2]) if v])
+    filas_nuevo = [f for f, v in zip(filas, validas) if v]
+
+    # Líneas repetidas: cualquiera de las copias sirve, se queda la primera
+    unicas = ~filas_viejo.duplicated()
+    posiciones = np.flatnonzero(unicas)
+    encontradas = filas_viejo[unicas].get_indexer(filas_nuevo)
+    origen = np.where(encontradas >= 0, posiciones[encontradas], -1)
+    filas_nuevas = [f for f, i in zip(filas_nuevo, encontradas) if i < 0]
+    return cabecera, origen.astype(np.int64), filas_nuevas
+
+
+# ---------- aplicar ----------
+def _tipos_como(nuevas: pd.DataFrame, df_viejo: pd.DataFrame) -> pd.DataFrame:
+    """Las filas nuevas con las columnas y, donde se puede, los tipos de la tabla.
+
+    En un bloque pequeño el tipo deducido puede no ser el de la tabla (enteros
+    leídos como float, una columna vacía como texto...); lo que no se puede
+    convertir lo resuelve unificar_tipos como en una lectura completa.
+    """
+    nuevas = nuevas.reindex(columns=df_viejo.columns)
+    for col in df_viejo.columns:
+        if nuevas[col].dtype != df_viejo[col].dtype:
+            try:
+                nuevas[col] = nuevas[col].astype(df_viejo[col].dtype)
+            except (TypeError, ValueError):
+                pass
+    return nuevas
+
+
+def aplicar(archivo_csv: str, contenido: bytes, carpeta: str = CARPETA_CSV) -> dict:
+    """Sustituye el CSV por `contenido` actualizando tabla, Parquet e índice."""
+    ruta = os.path.join(carpeta, archivo_csv)
+    with open(ruta, "rb") as f:
+        viejo = f.read()
+    if hashlib.sha1(viejo).hexdigest() == hashlib.sha1(contenido).hexdigest():
+        return {"modo": "igual"}
+
+    diff = diferencias(viejo, contenido)
+    if diff is None:
+        # Sin correspondencia por registro: se reescribe el CSV y las cachés se
+        # reconstruyen solas la próxima vez que se pidan
+        tmp = ruta + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(contenido)
+        os.replace(tmp, ruta)
+        return {"modo": "completo"}
+
+    cabecera, origen, filas_nuevas = diff
+    df_viejo = cargar_csv(archivo_csv, carpeta)
+    indice = indice_para(archivo_csv, carpeta)
+
+    nuevo = origen < 0
+    if filas_nuevas:
+        # Solo se parsean las filas nuevas o modificadas
+        nuevas = _tipos_como(parsear_csv(io.BytesIO(b"\n".join([cabecera, *filas_nuevas]))), df_viejo)
+        tomar = np.where(nuevo, len(df_viejo) + np.cumsum(nuevo) - 1, origen)
+        partes = unificar_tipos([df_viejo.copy(deep=False), nuevas])
+        df = pd.concat(partes, ignore_index=True).iloc[tomar]
+        lats, lons = nuevas["LATITUD"], nuevas["LONGITUD"]
+    else:
+        # Solo se quitan filas: un bloque vacío se leería todo como texto y
+        # unificar_tipos pasaría a texto las columnas numéricas de la tabla
+        df = df_viejo.iloc[origen]
+        lats = lons = np.zeros(0)
+
+    reemplazar_csv(archivo_csv, contenido, df, carpeta)
+    registrar_indice(archivo_csv, indice.con_cambios(origen, lats, lons), carpeta)
+    return {
+        "modo": "incremental",
+        "nuevas o modificadas": len(filas_nuevas),
+        "quitadas o modificadas": len(df_viejo) - len(np.unique(origen[~nuevo])),
+    }
+
+
+def sincronizar(archivos=None, url_base: str = URL_DATOS, carpeta: str = CARPETA_CSV) -> list:
+    """Sincroniza los CSV (todos los de data/info.txt por defecto)."""
+    estado = _leer_estado()
+    resultados = []
+    for archivo, id_ in fuentes(carpeta).items():
+        if archivos and archivo not in archivos:
+            continue
+        inicio = time.perf_counter()
+        previo = estado.get(archivo, {})
+        url = url_base.rstrip("/") + RUTA_EXPORTACION.format(id=id_) + "?delimiter=%3B"
+        codigo, contenido, cabeceras = descargar(url, previo.get("etag"), previo.get("last_modified"))
+        if codigo == 304:
+            resultado = {"modo": "sin cambios"}
+        else:
+            resultado = aplicar(archivo, contenido, carpeta)
+            estado[archivo] = {"etag": cabeceras.get("ETag"), "last_modified": cabeceras.get("Last-Modified")}
+        resultado.update(archivo=archivo, segundos=round(time.perf_counter() - inicio, 4))
+        resultados.append(resultado)
+    _escribir_estado(estado)
+    return resultados
+
+
+# ---------- comprobación ----------
+def comprobar_incremental(archivo_csv: str = "hospitales.csv", carpeta: str = CARPETA_CSV) -> dict:
+    """Aplica cambios de prueba a una copia del CSV y compara con una lectura completa.
+
+    Casos: solo quitar filas, quitar y modificar, y añadir una fila. Devuelve
+    {caso: lista de diferencias (vacía si la tabla incremental es idéntica)}.
+    """
+    resultado = {}
+    with open(os.path.join(carpeta, archivo_csv), "rb") as f:
+        original = f.read()
+    cabecera, *filas = original.rstrip(b"\r\n").split(b"\n")
+    casos = {
+        "solo quitar": [cabecera, *filas[:-3]],
+        "quitar y modificar": [cabecera, filas[1].replace(b";", b"; ", 1) if b";" in filas[1] else filas[1], *filas[3:]],
+        "añadir": [cabecera, *filas, filas[0]],
+    }
+    for caso, lineas in casos.items():
+        tmp = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(carpeta, archivo_csv), tmp)
+            cargar_csv(archivo_csv, tmp)
+            modo = aplicar(archivo_csv, b"\n".join(lineas) + b"\n", tmp)["modo"]
+            incremental = cargar_csv(archivo_csv, tmp).reset_index(drop=True)
+            completo = parsear_csv(os.path.join(tmp, archivo_csv))
+            diferencias_ = [f"modo {modo}"] if modo != "incremental" else []
+            if list(incremental.columns) != list(completo.columns):
+                diferencias_.append("columnas distintas")
+            else:
+                diferencias_ += [f"{col}: {incremental[col].dtype} frente a {completo[col].dtype}"
+                                 for col in completo.columns if incremental[col].dtype != completo[col].dtype]
+                if not diferencias_ and not incremental.equals(completo):
+                    diferencias_.append("valores distintos")
+            resultado[caso] = diferencias_
+        finally:
+            olvidar_csv(archivo_csv, tmp)
+            shutil.rmtree(tmp, ignore_errors=True)
+    return resultado
+
+
+# ---------- servidor local (sustituto del portal) ----------
+def servidor_local(carpeta: str = CARPETA_CSV, puerto: int = 8765) -> ThreadingHTTPServer:
+    """Servidor que exporta los CSV de `carpeta` como lo hace el portal."""
+    ids = {id_: archivo for archivo, id_ in fuentes(carpeta).items()}
+    patron = re.compile(re.escape(RUTA_EXPORTACION).replace(r"\{id\}", "([^/?]+)") + r"(\?.*)?$")
+
+    class Manejador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            m = patron.match(self.path)
+            if not m or m.group(1) not in ids:
+                self.send_error(404)
+                return
+            ruta = os.path.join(carpeta, ids[m.group(1)])
+            with open(ruta, "rb") as f:
+                contenido = f.read()
+            etag = '"%s"' % hashlib.sha1(contenido).hexdigest()
+            modificado = email.utils.formatdate(os.stat(ruta).st_mtime, usegmt=True)
+
+            si_etag = self.headers.get("If-None-Match")
+            si_fecha = self.headers.get("If-Modified-Since")
+            if (si_etag == etag) or (si_etag is None and si_fecha == modificado):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Length", str(len(contenido)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", modificado)
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincroniza los CSV con el portal de datos abiertos.")
+    sub = parser.add_subparsers(dest="orden")
+    p_sinc = sub.add_parser("sincronizar", help="descarga solo lo que ha cambiado (por defecto)")
+    p_sinc.add_argument("--url", default=URL_DATOS)
+    p_sinc.add_argument("--cada", type=float, default=0, help="repetir cada N minutos")
+    p_comp = sub.add_parser("comprobar", help="comparar la actualización incremental con una lectura completa")
+    p_comp.add_argument("archivos", nargs="*", default=sorted(fuentes()))
+    p_serv = sub.add_parser("servir", help="servidor local que imita la exportación del portal")
+    p_serv.add_argument("--carpeta", default=CARPETA_CSV)
+    p_serv.add_argument("--puerto", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.orden == "comprobar":
+        for archivo in args.archivos:
+            for caso, diferencias_ in comprobar_incremental(archivo).items():
+                print(f"{archivo} · {caso}: {'; '.join(diferencias_) or 'idéntica a la lectura completa'}")
+    elif args.orden == "servir":
+        servidor = servidor_local(args.carpeta, args.puerto)
+        print(f"Sirviendo {args.carpeta} en http://127.0.0.1:{args.puerto}")
+        servidor.serve_forever()
+    else:
+        url, cada = getattr(args, "url", URL_DATOS), getattr(args, "cada", 0)
+        while True:
+            for r in sincronizar(url_base=url):
+                print(r)
+            if not cada:
+                break
+            time.sleep(cada * 60)
@@ -0,0 +1,487 @@
+# teselas.py  ·  teselas vectoriales (MVT) de las capas, servidas en local
+#
+# En vez de incrustar todos los puntos o polígonos de una capa en el HTML del
+# mapa, el navegador pide solo las teselas que ve a un servidor HTTP local
+# (hilo aparte, biblioteca estándar) y las dibuja con Leaflet.VectorGrid:
+#
+#   GET {URL_TESELAS}/{capa}/{z}/{x}/{y}.pbf
+#
+# Cada tesela se codifica como Mapbox Vector Tile 2.1 (aquí mismo, sin
+# dependencias) a partir de LATITUD/LONGITUD (de geo_point_2d) o de los
+# polígonos de "Geo Shape"/"geo_shape" simplificados para ese zoom
+# (geometria.capa_simplificada). Se generan la primera vez que se piden, o
+# por adelantado con `python teselas.py generar`, y se guardan comprimidas
+# en un MBTiles (SQLite) por capa en ./data/cache/teselas.
+#
+# El identificador de capa lleva el hash del CSV y de las propiedades, así que
+# las teselas se pueden cachear en el navegador. Junto a cada MBTiles va su
+# definición en JSON, que es lo que necesita el servidor (de este u otro
+# proceso) para generar las que falten. Un id cuyo hash ya no es el del CSV
+# actual (una página abierta antes de sincronizar) recibe 404: sus teselas se
+# generarían con los datos nuevos y quedarían cacheadas con el id viejo.
+#
+# El servidor escucha solo en 127.0.0.1 (EDM_HOST_TESELAS para otra interfaz,
+# p. ej. si el navegador llega por la red; entonces EDM_URL_TESELAS también).
+# CORS solo admite el origen de la app (localhost/127.0.0.1 con el puerto de
+# Streamlit); EDM_ORIGEN_TESELAS da otros, separados por comas.
+#
+# Uso:  python teselas.py servir [--puerto 8791]
+#       python teselas.py generar [APP ...] [--zooms 10 16]
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+import numpy as np
+
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from encuadre import a_pixeles
+
+CARPETA_TESELAS = os.path.join(CARPETA_CACHE, "teselas")
+# Otro puerto que el del servidor de prueba de sincronizacion.py (8765)
+PUERTO = int(os.environ.get("EDM_PUERTO_TESELAS", 8791))
+HOST = os.environ.get("EDM_HOST_TESELAS", "127.0.0.1")
+# URL con la que el navegador llega al servidor de teselas
+URL_TESELAS = os.environ.get("EDM_URL_TESELAS", f"http://127.0.0.1:{PUERTO}")
+# El mapa va en un iframe con el origen de la app de Streamlit, otro que el
+# del servidor de teselas: hace falta CORS, solo para ese origen
+ORIGENES_PERMITIDOS = os.environ.get("EDM_ORIGEN_TESELAS", "")
+# Respuesta de GET /estado, para reconocer el servidor de otro proceso
+ESTADO = b"edm-teselas"
+EXTENSION = 4096
+# Margen alrededor de la tesela, en unidades de EXTENSION, para que los
+# símbolos del borde no se corten
+MARGEN = 256
+ZOOM_MAX = 18
+# Zooms que genera `python teselas.py generar` por defecto
+ZOOMS_GENERAR = (10, 16)
+
+_RUTA_TESELA = re.compile(r"^/([\w.\-]+)/(\d+)/(\d+)/(\d+)\.pbf$")
+# (nombre, definición) -> (huella, datos preparados para cortar teselas)
+_capas = CacheVersiones()
+# (nombre, definición) -> (huella, conexión al MBTiles), compartida por los
+# hilos del servidor
+_conexiones = CacheVersiones()
+_bloqueo_bd = threading.Lock()
+_bloqueo = threading.Lock()
+_servidor = None
+# id de capa -> definición (el JSON no cambia para un mismo id)
+_definiciones = {}
+_origenes = None
+registro = logging.getLogger("edm.teselas")
+
+
+# ---------- definición de capas ----------
+def _ruta(id_capa, extension):
+    return os.path.join(CARPETA_TESELAS, f"{id_capa}.{extension}")
+
+
+def registrar_capa(archivo_csv: str, propiedades: dict, columna_geo: str = None,
+                   carpeta: str = CARPETA_CSV) -> str:
+    """Id de la capa (nombre.hashCSV.hashDefinición); guarda su definición si es nueva.
+
+    propiedades: {nombre de la propiedad: columna del CSV}. Sin columna_geo la
+    capa es de puntos; con ella, de polígonos.
+    """
+    nombre = os.path.splitext(archivo_csv)[0]
+    firma = json.dumps([list(propiedades.items()), columna_geo], ensure_ascii=False)
+    id_capa = "%s.%s.%s" % (nombre, huella_csv(archivo_csv, carpeta)[:12],
+                            hashlib.sha1(firma.encode("utf-8")).hexdigest()[:8])
+    ruta = _ruta(id_capa, "json")
+    if not os.path.exists(ruta):
+        os.makedirs(CARPETA_TESELAS, exist_ok=True)
+        definicion = {"capa": nombre, "archivo": archivo_csv, "carpeta": os.path.abspath(carpeta),
+                      "propiedades": propiedades, "columna_geo": columna_geo}
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(definicion, f, ensure_ascii=False)
+        os.replace(tmp, ruta)
+    return id_capa
+
+
+def url_teselas(archivo_csv: str, propiedades: dict, columna_geo: str = None) -> str:
+    """Plantilla {z}/{x}/{y} de la capa para Leaflet."""
+    return f"{URL_TESELAS}/{registrar_capa(archivo_csv, propiedades, columna_geo)}/{{z}}/{{x}}/{{y}}.pbf"
+
+
+def _limpiar(valor):
+    if valor is None or (isinstance(valor, float) and math.isnan(valor)):
+        return None
+    return valor.item() if isinstance(valor, np.generic) else valor
+
+
+def _definicion(id_capa):
+    definicion = _definiciones.get(id_capa)
+    if definicion is None:
+        with open(_ruta(id_capa, "json"), encoding="utf-8") as f:
+            definicion = _definiciones.setdefault(id_capa, json.load(f))
+    return definicion
+
+
+def capa_vigente(id_capa: str) -> bool:
+    """True si la capa está registrada y su hash es el del CSV actual."""
+    if not os.path.exists(_ruta(id_capa, "json")):
+        return False
+    definicion = _definicion(id_capa)
+    try:
+        huella = huella_csv(definicion["archivo"], definicion["carpeta"])
+    except OSError:
+        return False
+    return _version(id_capa)[1] == huella[:12]
+
+
+def _version(id_capa):
+    """(clave sin la huella del CSV, huella) de un id de capa: una versión en memoria por capa."""
+    nombre, huella, definicion = id_capa.rsplit(".", 2)
+    return (nombre, definicion), huella
+
+
+def preparar_capa(id_capa: str):
+    """Datos de la capa en coordenadas de mundo Web Mercator (0-1), una vez por versión del CSV."""
+    clave, huella = _version(id_capa)
+    capa = _capas.buscar(clave, huella)
+    if capa is not None:
+        return capa
+    definicion = _definicion(id_capa)
+    capa = {**definicion, "poligonos": {}}
+    if definicion["columna_geo"] is None:
+        columnas = list(dict.fromkeys(definicion["propiedades"].values()))
+        df = cargar_csv(definicion["archivo"], definicion["carpeta"], columnas=columnas)
+        x, y = a_pixeles(df["LATITUD"].to_numpy(), df["LONGITUD"].to_numpy())
+        capa["x"], capa["y"] = x / 256, y / 256
+        valores = [df[col].tolist() if col in df.columns else [None] * len(df)
+                   for col in definicion["propiedades"].values()]
+        capa["props"] = [dict(zip(definicion["propiedades"], map(_limpiar, fila))) for fila in zip(*valores)]
+    return _capas.guardar(clave, huella, capa)
+
+
+def _poligonos(capa, zoom):
+    """[(anillos en coordenadas de mundo, caja, propiedades)] simplificados para el zoom."""
+    from geometria import ZOOM_DETALLE, capa_simplificada
+
+    zoom = min(zoom, ZOOM_DETALLE)
+    if zoom not in capa["poligonos"]:
+        geojson = capa_simplificada(capa["archivo"], capa["columna_geo"], capa["propiedades"],
+                                    zoom=zoom, carpeta=capa["carpeta"])
+        poligonos = []
+        for f in geojson["features"]:
+            coords = f["geometry"]["coordinates"]
+            partes = [coords] if f["geometry"]["type"] == "Polygon" else coords
+            anillos = []
+            for parte in partes:
+                for k, anillo in enumerate(parte):
+                    lonlat = np.asarray(anillo, dtype=float)
+                    x, y = a_pixeles(lonlat[:, 1], lonlat[:, 0])
+                    anillos.append((k == 0, np.column_stack((x, y)) / 256))
+            todo = np.vstack([a for _, a in anillos])
+            poligonos.append((anillos, (*todo.min(axis=0), *todo.max(axis=0)), f["properties"]))
+        capa["poligonos"][zoom] = poligonos
+    return capa["poligonos"][zoom]
+
+
+# ---------- codificación MVT ----------
+def _varint(n: int) -> bytes:
+    salida = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            salida.append(byte | 0x80)
+        else:
+            salida.append(byte)
+            return bytes(salida)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 31)
+
+
+def _campo(numero: int, datos: bytes) -> bytes:
+    """Campo de longitud variable (tipo 2)."""
+    return _varint(numero << 3 | 2) + _varint(len(datos)) + datos
+
+
+def _entero(numero: int, valor: int) -> bytes:
+    return _varint(numero << 3) + _varint(valor)
+
+
+def _empaquetar(numero: int, enteros) -> bytes:
+    return _campo(numero, b"".join(_varint(v) for v in enteros))
+
+
+def _valor(valor) -> bytes:
+    if isinstance(valor, bool):
+        return _entero(7, int(valor))
+    if isinstance(valor, int) and -2 ** 63 <= valor < 2 ** 63:
+        return _entero(6, (valor << 1) ^ (valor >> 63))
+    if isinstance(valor, float):
+        return _varint(3 << 3 | 1) + struct.pack("<d", valor)
+    return _campo(1, str(valor).encode("utf-8"))
+
+
+def _geometria_punto(x, y):
+    return [1 | 1 << 3, _zigzag(x), _zigzag(y)]
+
+
+def _geometria_poligono(anillos):
+    """Comandos MoveTo/LineTo/ClosePath de anillos ya en enteros de la tesela."""
+    comandos, cx, cy = [], 0, 0
+    for exterior, xy in anillos:
+        # Sin el punto de cierre y sin repetidos tras redondear
+        xy = xy[:-1] if len(xy) > 1 and (xy[0] == xy[-1]).all() else xy
+        xy = xy[np.r_[True, (np.diff(xy, axis=0) != 0).any(axis=1)]]
+        if len(xy) < 3:
+            continue
+        # Con y hacia abajo, el exterior tiene área positiva y los huecos negativa
+        area = float(np.sum(xy[:, 0] * np.roll(xy[:, 1], -1) - np.roll(xy[:, 0], -1) * xy[:, 1]))
+        if area == 0:
+            continue
+        if (area > 0) != exterior:
+            xy = xy[::-1]
+        delta = np.diff(np.vstack(([cx, cy], xy)), axis=0)
+        cx, cy = int(xy[-1, 0]), int(xy[-1, 1])
+        comandos += [1 | 1 << 3, _zigzag(int(delta[0, 0])), _zigzag(int(delta[0, 1])), 2 | (len(xy) - 1) << 3]
+        for dx, dy in delta[1:].tolist():
+            comandos += [_zigzag(dx), _zigzag(dy)]
+        comandos.append(7 | 1 << 3)
+    return comandos
+
+
+def codificar_capa(nombre: str, features) -> bytes:
+    """Mensaje Layer. features: [(tipo MVT, comandos de geometría, propiedades)]."""
+    claves, valores, cuerpo = {}, {}, []
+    for i, (tipo, geometria, props) in enumerate(features):
+        etiquetas = []
+        for clave, valor in props.items():
+            if valor is None:
+                continue
+            etiquetas += [claves.setdefault(clave, len(claves)),
+                          valores.setdefault((type(valor).__name__, valor), len(valores))]
+        cuerpo.append(_campo(2, _entero(1, i + 1) + _empaquetar(2, etiquetas) + _entero(3, tipo)
+                             + _empaquetar(4, geometria)))
+    return (_entero(15, 2) + _campo(1, nombre.encode("utf-8")) + b"".join(cuerpo)
+            + b"".join(_campo(3, c.encode("utf-8")) for c in claves)
+            + b"".join(_campo(4, _valor(v)) for _, v in valores)
+            + _entero(5, EXTENSION))
+
+
+def generar_tesela(id_capa: str, z: int, x: int, y: int) -> bytes:
+    """Tesela MVT (sin comprimir); b"" si no hay nada en ella."""
+    capa = preparar_capa(id_capa)
+    escala = 2 ** z * EXTENSION
+    margen = MARGEN / escala
+    x0, y0 = x / 2 ** z - margen, y / 2 ** z - margen
+    x1, y1 = (x + 1) / 2 ** z + margen, (y + 1) / 2 ** z + margen
+
+    features = []
+    if capa["columna_geo"] is None:
+        dentro = np.flatnonzero((capa["x"] >= x0) & (capa["x"] < x1) & (capa["y"] >= y0) & (capa["y"] < y1))
+        tx = np.round(capa["x"][dentro] * escala - x * EXTENSION).astype(np.int64)
+        ty = np.round(capa["y"][dentro] * escala - y * EXTENSION).astype(np.int64)
+        for i, px, py in zip(dentro.tolist(), tx.tolist(), ty.tolist()):
+            features.append((1, _geometria_punto(px, py), capa["props"][i]))
+    else:
+        for anillos, (bx0, by0, bx1, by1), props in _poligonos(capa, z):
+            if bx1 < x0 or bx0 > x1 or by1 < y0 or by0 > y1:
+                continue
+            origen = np.array([x, y]) * EXTENSION
+            enteros = [(ext, np.round(a * escala - origen).astype(np.int64)) for ext, a in anillos]
+            geometria = _geometria_poligono(enteros)
+            if geometria:
+                features.append((3, geometria, props))
+    # Tile: una sola capa (campo 3)
+    return _campo(3, codificar_capa(capa["capa"], features)) if features else b""
+
+
+# ---------- MBTiles ----------
+def _conexion(id_capa):
+    """Conexión al MBTiles de la capa (usar con _bloqueo_bd)."""
+    clave, huella = _version(id_capa)
+    con = _conexiones.buscar(clave, huella)
+    if con is None:
+        # La de la versión anterior del CSV se cierra
+        anterior = _conexiones.pop(clave, None)
+        if anterior is not None:
+            anterior[1].close()
+        os.makedirs(CARPETA_TESELAS, exist_ok=True)
+        con = sqlite3.connect(_ruta(id_capa, "mbtiles"), timeout=30, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER,
+                                              tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        capa = preparar_capa(id_capa)
+        tipo = "Point" if capa["columna_geo"] is None else "Polygon"
+        capas_json = {"vector_layers": [{"id": capa["capa"], "geometry": tipo,
+                                         "fields": {p: "String" for p in capa["propiedades"]}}]}
+        con.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)", [
+            ("name", capa["capa"]), ("format", "pbf"), ("minzoom", "0"), ("maxzoom", str(ZOOM_MAX)),
+            ("json", json.dumps(capas_json, ensure_ascii=False)),
+        ])
+        con.commit()
+        _conexiones.guardar(clave, huella, con)
+    return con
+
+
+def tesela(id_capa: str, z: int, x: int, y: int) -> bytes:
+    """Tesela comprimida con gzip (como se guarda en MBTiles); b"" si está vacía."""
+    # MBTiles numera las filas desde el sur (esquema TMS)
+    fila = (1 << z) - 1 - y
+    with _bloqueo_bd:
+        encontrada = _conexion(id_capa).execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, fila)
+        ).fetchone()
+    if encontrada is not None:
+        return encontrada[0]
+    # Se genera fuera del bloqueo: si dos hilos piden la misma, gana la última
+    datos = generar_tesela(id_capa, z, x, y)
+    datos = gzip.compress(datos, mtime=0) if datos else b""
+    with _bloqueo_bd:
+        con = _conexion(id_capa)
+        con.execute("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", (z, x, fila, datos))
+        con.commit()
+    return datos
+
+
+def generar(id_capa: str, zoom_min: int, zoom_max: int) -> int:
+    """Genera las teselas que cubren la capa en esos zooms; devuelve cuántas no están vacías."""
+    capa = preparar_capa(id_capa)
+    if capa["columna_geo"] is None:
+        xs, ys = capa["x"], capa["y"]
+    else:
+        cajas = np.array([caja for _, caja, _ in _poligonos(capa, zoom_max)])
+        xs, ys = cajas[:, [0, 2]].ravel(), cajas[:, [1, 3]].ravel()
+    llenas = 0
+    for z in range(zoom_min, zoom_max + 1):
+        n = 2 ** z
+        for x in range(int(xs.min() * n), int(xs.max() * n) + 1):
+            for y in range(int(ys.min() * n), int(ys.max() * n) + 1):
+                llenas += bool(tesela(id_capa, z, x, y))
+    return llenas
+
+
+# ---------- servidor ----------
+def _origenes_permitidos():
+    """Orígenes a los que se responde con CORS: los de EDM_ORIGEN_TESELAS o los de la app."""
+    global _origenes
+    if _origenes is None:
+        origenes = {o.strip().rstrip("/") for o in ORIGENES_PERMITIDOS.split(",") if o.strip()}
+        if not origenes:
+            try:
+                from streamlit import config
+                puerto = config.get_option("server.port")
+            except Exception:
+                puerto = 8501
+            origenes = {f"http://localhost:{puerto}", f"http://127.0.0.1:{puerto}"}
+        _origenes = origenes
+    return _origenes
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/estado":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(ESTADO)))
+            self.end_headers()
+            self.wfile.write(ESTADO)
+            return
+        encaje = _RUTA_TESELA.match(self.path.split("?")[0])
+        if not encaje or not capa_vigente(encaje.group(1)):
+            self.send_error(404)
+            return
+        id_capa, z, x, y = encaje.group(1), *map(int, encaje.groups()[1:])
+        if z > ZOOM_MAX or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            self.send_error(404)
+            return
+        datos = tesela(id_capa, z, x, y)
+        self.send_response(200 if datos else 204)
+        origen = self.headers.get("Origin")
+        permitidos = _origenes_permitidos()
+        if "*" in permitidos:
+            self.send_header("Access-Control-Allow-Origin", "*")
+        elif origen in permitidos:
+            self.send_header("Access-Control-Allow-Origin", origen)
+        self.send_header("Vary", "Origin")
+        # El id cambia con los datos: la tesela no caduca
+        self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        if datos:
+            self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass
+
+
+def _es_servidor_de_teselas(host, puerto) -> bool:
+    try:
+        with urlopen(f"http://{host or '127.0.0.1'}:{puerto}/estado", timeout=1) as respuesta:
+            return respuesta.read(len(ESTADO) + 1) == ESTADO
+    except (OSError, ValueError):
+        return False
+
+
+def iniciar_servidor(puerto: int = PUERTO, host: str = HOST):
+    """Arranca (una vez por proceso) el servidor de teselas en un hilo aparte.
+
+    Si el puerto ya está ocupado por otro proceso de las apps, ese sirve las
+    mismas teselas (comparten ./data/cache/teselas). Si lo ocupa otra cosa, se
+    avisa: las capas en teselas no se verán hasta cambiar EDM_PUERTO_TESELAS.
+    """
+    global _servidor
+    with _bloqueo:
+        if _servidor is not None:
+            return
+        try:
+            _servidor = ThreadingHTTPServer((host, puerto), _Manejador)
+        except OSError as e:
+            _servidor = False
+            if not _es_servidor_de_teselas(host, puerto):
+                registro.warning("No se puede servir teselas en %s:%d (%s) y lo que escucha ahí no es el "
+                                 "servidor de teselas; cambia EDM_PUERTO_TESELAS", host, puerto, e)
+            return
+        _servidor.daemon_threads = True
+        threading.Thread(target=_servidor.serve_forever, name="teselas", daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teselas vectoriales de las capas.")
+    sub = parser.add_subparsers(dest="orden", required=True)
+    p_serv = sub.add_parser("servir", help="servir las teselas (sin las apps)")
+    p_serv.add_argument("--puerto", type=int, default=PUERTO)
+    p_serv.add_argument("--host", default=HOST)
+    p_gen = sub.add_parser("generar", help="generar por adelantado las teselas de las capas de las apps")
+    p_gen.add_argument("apps", nargs="*", default=["app3.py", "app4.py", "app5.py"])
+    p_gen.add_argument("--zooms", type=int, nargs=2, default=ZOOMS_GENERAR, metavar=("MIN", "MAX"))
+    args = parser.parse_args()
+
+    if args.orden == "servir":
+        servidor = ThreadingHTTPServer((args.host, args.puerto), _Manejador)
+        print(f"Teselas en http://{args.host}:{args.puerto}/<capa>/<z>/<x>/<y>.pbf")
+        servidor.serve_forever()
+    else:
+        from mapas import propiedades_teselas
+        from precarga import constante_app
+        from seccion_vulnerabilidad import ARCHIVO_VULNERABILIDAD, PROPIEDADES_BARRIOS
+
+        capas = {registrar_capa(ARCHIVO_VULNERABILIDAD, PROPIEDADES_BARRIOS, "Geo Shape")}
+        for app in args.apps:
+            info = constante_app(app, "info_util_por_archivo") or {}
+            for archivo in (constante_app(app, "opciones_selector") or {}).values():
+                capas.add(registrar_capa(archivo, *propiedades_teselas(archivo, info[os.path.splitext(archivo)[0]])))
+        for id_capa in sorted(capas):
+            print(f"{id_capa}: {generar(id_capa, *args.zooms)} teselas")
@@ -0,0 +1,232 @@
+# union_espacial.py  ·  a qué barrio y barrio policial pertenece cada centro
+#
+# Los CSV de servicios solo traen coordenadas. Aquí se cruzan con los polígonos
+# de "Geo Shape" (vulnerabilidad-por-barrios.csv) y "geo_shape"
+# (barris-policials.csv):
+#
+#   1. Árbol STR (Sort-Tile-Recursive) sobre las cajas de los polígonos: se
+#      recorre por niveles para todos los puntos a la vez y solo quedan los
+#      pares (punto, polígono) cuya caja contiene el punto.
+#   2. Punto en polígono vectorizado (regla par-impar, por lo que agujeros y
+#      MultiPolygon salen solos) sobre las aristas de esos candidatos.
+#
+# Las asignaciones y los conteos por barrio se guardan en ./data/cache con
+# clave el hash de los CSV implicados.
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from datos import CARPETA_CACHE, CARPETA_CSV, CacheVersiones, cargar_csv, huella_csv
+from geometria import poligonos_de
+from indice_espacial import MAX_PARES
+
+# Hijos por nodo del árbol STR
+CAPACIDAD_NODO = 8
+
+# Capas de polígonos: nombre -> (CSV, columna de geometría, columnas que se copian)
+POLIGONOS = {
+    "barrio": ("vulnerabilidad-por-barrios.csv", "Geo Shape", {"Codbar": "Codbar", "barrio": "Name"}),
+    "barrio_policial": ("barris-policials.csv", "geo_shape", {"codigo_policial": "Código", "barrio_policial": "Nombre"}),
+}
+
+# (ruta CSV, columna) -> (sha1, Poligonos)
+_poligonos = CacheVersiones()
+# (carpeta, tipo, capa o capas) -> (huellas, DataFrame)
+_tablas = CacheVersiones()
+
+
+# ---------- árbol STR ----------
+def _orden_str(cajas: np.ndarray, capacidad: int) -> np.ndarray:
+    """Orden Sort-Tile-Recursive: franjas verticales por x y, dentro, por y."""
+    n = len(cajas)
+    cx = (cajas[:, 0] + cajas[:, 2]) / 2
+    cy = (cajas[:, 1] + cajas[:, 3]) / 2
+    hojas = -(-n // capacidad)
+    por_franja = int(np.ceil(np.sqrt(hojas))) * capacidad
+    orden = np.argsort(cx, kind="stable")
+    franjas = [orden[i:i + por_franja] for i in range(0, n, por_franja)]
+    return np.concatenate([f[np.argsort(cy[f], kind="stable")] for f in franjas])
+
+
+def _agrupar(cajas: np.ndarray, capacidad: int):
+    """Caja envolvente y rango [inicio, fin) de cada grupo de `capacidad` consecutivos."""
+    inicio = np.arange(0, len(cajas), capacidad)
+    fin = np.minimum(inicio + capacidad, len(cajas))
+    envolvente = np.column_stack((
+        np.minimum.reduceat(cajas[:, 0], inicio), np.minimum.reduceat(cajas[:, 1], inicio),
+        np.maximum.reduceat(cajas[:, 2], inicio), np.maximum.reduceat(cajas[:, 3], inicio),
+    ))
+    return envolvente, inicio, fin
+
+
+class ArbolSTR:
+    """Árbol R empaquetado con STR sobre cajas (xmin, ymin, xmax, ymax)."""
+
+    def __init__(self, cajas, capacidad: int = CAPACIDAD_NODO):
+        cajas = np.asarray(cajas, dtype=float).reshape(-1, 4)
+        self.ids = _orden_str(cajas, capacidad) if len(cajas) else np.zeros(0, dtype=np.int64)
+        self.cajas = cajas[self.ids]
+        # Niveles de nodos de abajo arriba: (cajas, inicio, fin) en el nivel inferior
+        self.niveles = []
+        actual = self.cajas
+        while len(actual) > 1:
+            envolvente, inicio, fin = _agrupar(actual, capacidad)
+            orden = _orden_str(envolvente, capacidad)
+            self.niveles.append((envolvente[orden], inicio[orden], fin[orden]))
+            actual = envolvente[orden]
+
+    @staticmethod
+    def _contiene(cajas, x, y):
+        return (cajas[:, 0] <= x) & (x <= cajas[:, 2]) & (cajas[:, 1] <= y) & (y <= cajas[:, 3])
+
+    def candidatos(self, x, y):
+        """Pares (punto, id de caja) con la caja conteniendo el punto."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if not len(self.ids):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        # Se baja nivel a nivel con todos los pares (punto, nodo) a la vez
+        punto = np.arange(x.size)
+        nodo = np.zeros(x.size, dtype=np.int64)
+        cajas = self.niveles[-1][0] if self.niveles else self.cajas
+        for nivel in range(len(self.niveles) - 1, -2, -1):
+            dentro = self._contiene(cajas[nodo], x[punto], y[punto])
+            punto, nodo = punto[dentro], nodo[dentro]
+            if nivel < 0:
+                break
+            _, inicio, fin = self.niveles[nivel]
+            cuenta = fin[nodo] - inicio[nodo]
+            punto = np.repeat(punto, cuenta)
+            salto = np.repeat(inicio[nodo] - np.concatenate(([0], np.cumsum(cuenta)[:-1])), cuenta)
+            nodo = np.arange(punto.size) + salto
+            cajas = self.niveles[nivel - 1][0] if nivel > 0 else self.cajas
+        return punto, self.ids[nodo]
+
+
+# ---------- polígonos ----------
+class Poligonos:
+    """Aristas de todos los anillos de cada polígono, en formato CSR."""
+
+    def __init__(self, geometrias):
+        aristas, inicio, cajas = [], [0], []
+        for g in geometrias:
+            propias = []
+            for poligono in poligonos_de(g):
+                for anillo in poligono:
+                    a = np.asarray(anillo, dtype=float)
+                    propias.append(np.column_stack((a[:-1], a[1:])) if (a[0] == a[-1]).all()
+                                   else np.column_stack((a, np.roll(a, -1, axis=0))))
+            propias = np.vstack(propias)
+            aristas.append(propias)
+            inicio.append(inicio[-1] + len(propias))
+            puntos = propias[:, :2]
+            cajas.append((*puntos.min(axis=0), *puntos.max(axis=0)))
+        self.aristas = np.vstack(aristas) if aristas else np.zeros((0, 4))
+        self.inicio = np.asarray(inicio, dtype=np.int64)
+        self.arbol = ArbolSTR(np.asarray(cajas, dtype=float).reshape(-1, 4))
+
+    def localizar(self, lons, lats) -> np.ndarray:
+        """Índice del polígono que contiene cada punto (-1 si ninguno)."""
+        x = np.asarray(lons, dtype=float)
+        y = np.asarray(lats, dtype=float)
+        # Ante un punto en la frontera de dos polígonos se queda el de menor índice
+        sin_poligono = np.iinfo(np.int64).max
+        resultado = np.full(x.size, sin_poligono, dtype=np.int64)
+        punto, poligono = self.arbol.candidatos(x, y)
+
+        # Bloques de candidatos con como mucho ~MAX_PARES aristas que probar
+        n_aristas = self.inicio[poligono + 1] - self.inicio[poligono]
+        cortes = np.searchsorted(np.cumsum(n_aristas), np.arange(MAX_PARES, n_aristas.sum(), MAX_PARES))
+        for p, q, n in zip(np.split(punto, cortes), np.split(poligono, cortes), np.split(n_aristas, cortes)):
+            dentro = self._dentro(x[p], y[p], q, n)
+            np.minimum.at(resultado, p[dentro], q[dentro])
+        return np.where(resultado == sin_poligono, -1, resultado)
+
+    def _dentro(self, x, y, poligono, n_aristas):
+        par = np.repeat(np.arange(x.size), n_aristas)
+        salto = np.repeat(self.inicio[poligono] - np.concatenate(([0], np.cumsum(n_aristas)[:-1])), n_aristas)
+        x1, y1, x2, y2 = self.aristas[np.arange(par.size) + salto].T
+        px, py = x[par], y[par]
+        # Regla par-impar: la arista cruza la horizontal del punto a su derecha
+        cruza = (y1 > py) != (y2 > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        cruza &= px < corte
+        return np.bincount(par, weights=cruza, minlength=x.size).astype(np.int64) % 2 == 1
+
+
+def poligonos_para(archivo_csv: str, columna_geo: str, carpeta: str = CARPETA_CSV) -> Poligonos:
+    sha1 = huella_csv(archivo_csv, carpeta)
+    clave = (os.path.abspath(os.path.join(carpeta, archivo_csv)), columna_geo)
+    poligonos = _poligonos.buscar(clave, sha1)
+    if poligonos is None:
+        df = cargar_csv(archivo_csv, carpeta, columnas=[columna_geo])
+        poligonos = _poligonos.guardar(clave, sha1, Poligonos([json.loads(g) for g in df[columna_geo]]))
+    return poligonos
+
+
+# ---------- uniones cacheadas ----------
+def _cacheada(nombre, clave, huellas, calcular):
+    """Tabla `nombre` (con las huellas de sus CSV dentro) de memoria, de disco o calculada."""
+    tabla = _tablas.buscar(clave, huellas)
+    if tabla is not None:
+        return tabla
+    ruta = os.path.join(CARPETA_CACHE, f"{nombre}.parquet")
+    if os.path.exists(ruta):
+        tabla = pd.read_parquet(ruta)
+    else:
+        tabla = calcular()
+        os.makedirs(CARPETA_CACHE, exist_ok=True)
+        tmp = ruta + ".tmp"
+        tabla.to_parquet(tmp, index=False)
+        os.replace(tmp, ruta)
+    return _tablas.guardar(clave, huellas, tabla)
+
+
+def _huellas(archivos, carpeta):
+    return ".".join(huella_csv(a, carpeta)[:8] for a in archivos)
+
+
+def asignar_barrios(archivo_csv: str, carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """Por cada fila del CSV de servicios, su barrio y su barrio policial (o nulo)."""
+    archivos = [archivo_csv] + [csv for csv, _, _ in POLIGONOS.values()]
+    huellas = _huellas(archivos, carpeta)
+    nombre = f"{os.path.splitext(archivo_csv)[0]}.barrios.{huellas}"
+
+    def calcular():
+        puntos = cargar_csv(archivo_csv, carpeta, columnas=())
+        tabla = pd.DataFrame(index=puntos.index)
+        for csv, columna_geo, copiar in POLIGONOS.values():
+            i = poligonos_para(csv, columna_geo, carpeta).localizar(puntos["LONGITUD"], puntos["LATITUD"])
+            poligonos = cargar_csv(csv, carpeta, columnas=list(copiar.values()))
+            for destino, origen in copiar.items():
+                valores = poligonos[origen].to_numpy()[i.clip(0)] if len(poligonos) else None
+                serie = pd.Series(valores, index=puntos.index).where(i >= 0)
+                # Códigos enteros con nulos para los centros fuera de todo polígono
+                tabla[destino] = serie.astype("Int64") if poligonos[origen].dtype.kind in "iu" else serie
+        return tabla.reset_index(drop=True)
+
+    return _cacheada(nombre, (os.path.abspath(carpeta), "barrios", archivo_csv), huellas, calcular)
+
+
+def conteo_por_barrio(capas: dict, carpeta: str = CARPETA_CSV) -> pd.DataFrame:
+    """Centros de cada capa por barrio. capas: {nombre de la columna: CSV}."""
+    archivos = [POLIGONOS["barrio"][0]] + list(capas.values())
+    columnas = hashlib.sha1(json.dumps(capas, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    huellas = _huellas(archivos, carpeta)
+    nombre = f"conteo_barrios.{huellas}.{columnas}"
+
+    def calcular():
+        barrios = cargar_csv(POLIGONOS["barrio"][0], carpeta, columnas=["Codbar", "Name", "District"])
+        barrios = barrios[["Codbar", "Name", "District"]]
+        tabla = barrios.copy()
+        for columna, archivo in capas.items():
+            cuenta = asignar_barrios(archivo, carpeta)["Codbar"].value_counts()
+            tabla[columna] = tabla["Codbar"].map(cuenta).fillna(0).astype(int)
+        return tabla
+
+    return _cacheada(nombre, (os.path.abspath(carpeta), "conteo", columnas), huellas, calcular)